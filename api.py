@@ -1,27 +1,84 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
 import tempfile
 import os
-import sys
-import base64
 import json
 import re
-import requests
-from typing import Optional, Dict, Any
+import uuid
+import hashlib
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Literal
+import httpx
 import sample
+import clients
+import jobs
+import uploads
+import metrics
+import tracing
+from jobs import JobStore, JobQueue, JobQueueFull
+from ratelimit import RateLimiter
+from uploads import UploadTooLarge, InvalidUpload
+from cache import VideoResultCache, video_cache_key
+from dust import DustClient, DustError, DustTimeout
 from prompt import PROMPT
 from dotenv import load_dotenv
 
-app = FastAPI(title="Video Analysis API", description="Analyze video frames with OpenAI Vision API")
 load_dotenv()
 
+# Background job queue, created at startup
+JOB_STORE: Optional[JobStore] = None
+JOB_QUEUE: Optional[JobQueue] = None
+
+# OpenAI rate limiter shared by all uploads and jobs (they use the same API key), created at startup
+RATE_LIMITER: Optional[RateLimiter] = None
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", str(sample.MAX_CONCURRENCY)))  # Parallel OpenAI calls of the whole server
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global JOB_STORE, JOB_QUEUE, RATE_LIMITER
+    # Pooled OpenAI and Dust clients, shared by all requests
+    clients.open_async_clients()
+    RATE_LIMITER = RateLimiter(sample.MAX_WORKERS, OPENAI_MAX_CONCURRENCY)
+    JOB_STORE = JobStore()
+    JOB_QUEUE = JobQueue(JOB_STORE, run_job)
+    await JOB_QUEUE.start()
+    try:
+        yield
+    finally:
+        await JOB_QUEUE.stop()
+        JOB_STORE.close()
+        JOB_QUEUE = None
+        JOB_STORE = None
+        RATE_LIMITER = None
+        await clients.close_clients()
+
+app = FastAPI(title="Video Analysis API", description="Analyze video frames with OpenAI Vision API", lifespan=lifespan)
+
 # Dust API configuration
 DUST_API_BASE = os.getenv("DUST_API_BASE", "https://dust.tt")
 API_KEY = os.getenv("API_KEY")
 WORKSPACE_ID = os.getenv("WORKSPACE_ID")
 HEALTH_AGENT_ID = os.getenv("HEALTH_AGENT_ID")
 TIMEZONE = os.getenv("TIMEZONE", "Europe/Stockholm")
+DUST_PAYLOAD_FORMAT = os.getenv("DUST_PAYLOAD_FORMAT", "frames")  # "frames" (one record per second) or "timeline" (merged segments)
+DUST_PAYLOAD_FORMATS = ['frames', 'timeline']
+MAX_SEGMENT_DESCRIPTIONS = 3  # Descriptions kept per timeline segment
+
+# Per-frame result cache shared by all requests (opt-in)
+FRAME_CACHE = sample.FrameCache() if os.getenv("FRAME_CACHE_ENABLED", "").lower() in ("1", "true", "yes") else None
+
+# Whole-video result cache, keyed by the upload's content hash (opt-in)
+VIDEO_CACHE = VideoResultCache() if os.getenv("VIDEO_CACHE_ENABLED", "").lower() in ("1", "true", "yes") else None
+
+# Analyses in progress by cache key, so identical concurrent uploads (streamed or not) share one
+IN_FLIGHT: Dict[str, "InFlightAnalysis"] = {}
+
+# Requests traced (sampled at TRACE_SAMPLE_RATE); background jobs are traced by run_job
+TRACED_PATHS = ("/analyze",)
 
 def need(var: str) -> str:
     v = os.getenv(var)
@@ -33,10 +90,98 @@ def need(var: str) -> str:
 if not all([API_KEY, WORKSPACE_ID, HEALTH_AGENT_ID]):
     print("Warning: Dust API configuration incomplete. Some endpoints may not work.")
 
-class Base64VideoRequest(BaseModel):
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Reject request bodies that cannot fit within MAX_UPLOAD_MB before reading them."""
+    content_length = request.headers.get("content-length")
+    max_bytes = uploads.max_upload_bytes()
+    if content_length and content_length.isdigit() and int(content_length) > uploads.max_request_bytes(max_bytes):
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"Upload exceeds the maximum size of {max_bytes / (1024 * 1024):g} MB"}
+        )
+    return await call_next(request)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Count requests by route and status and time them, including streamed response bodies."""
+    start = time.perf_counter()
+    metrics.HTTP_IN_FLIGHT.inc()
+    
+    def finish(status: int):
+        metrics.HTTP_IN_FLIGHT.dec()
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.HTTP_REQUESTS.labels(request.method, route, status).inc()
+        metrics.HTTP_REQUEST_SECONDS.labels(route).observe(time.perf_counter() - start)
+    
+    try:
+        response = await call_next(request)
+    except BaseException:
+        finish(500)
+        raise
+    body = response.body_iterator
+    
+    async def tracked_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            finish(response.status_code)
+    
+    response.body_iterator = tracked_body()
+    return response
+
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    """
+    Give every request a correlation ID (the client's X-Request-ID, or a new one), returned in
+    the X-Request-ID response header. A sample of the analysis requests is traced under that ID,
+    until the end of a streamed response body (see tracing.py).
+    """
+    request_id = tracing.correlation_id(request.headers.get("x-request-id"))
+    root = None
+    if request.url.path.startswith(TRACED_PATHS):
+        print(f"[API] {request.method} {request.url.path}: request ID {request_id}")
+        root = tracing.start_trace(f"{request.method} {request.url.path}", request_id)
+    try:
+        response = await call_next(request)
+    except BaseException as e:
+        tracing.finish_trace(root, e)
+        raise
+    response.headers["X-Request-ID"] = request_id
+    if root is None:
+        return response
+    root.set(status=response.status_code)
+    body = response.body_iterator
+    
+    async def traced_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            tracing.finish_trace(root)
+    
+    response.body_iterator = traced_body()
+    return response
+
+class AnalysisOptions(BaseModel):
+    """Per-request analysis settings, passed through to sample.process_video_async."""
+    max_workers: Optional[int] = 5  # Concurrent OpenAI requests to start with (None = sample.MAX_WORKERS)
+    max_concurrency: int = sample.MAX_CONCURRENCY  # Upper bound for the adaptive number of concurrent requests
+    adaptive: bool = False  # Skip frames whose scene did not change and reuse the previous labels
+    max_dimension: Optional[int] = sample.MAX_FRAME_DIMENSION  # Downscale frames to this longer side (None = full resolution)
+    jpeg_quality: int = sample.JPEG_QUALITY  # JPEG quality 0-100
+    detail: Literal["low", "high", "auto"] = sample.IMAGE_DETAIL  # OpenAI image detail level
+    batch_size: int = sample.BATCH_SIZE  # Frames per OpenAI request
+    structured_output: bool = sample.STRUCTURED_OUTPUT  # Constrain answers to the prompt's JSON schema
+    dust_payload_format: Literal["frames", "timeline"] = DUST_PAYLOAD_FORMAT  # What is sent to the Dust agent (not a frame setting)
+
+class Base64VideoRequest(AnalysisOptions):
     video_base64: str
     file_extension: str = ".mp4"  # e.g., ".mp4", ".mov", ".avi"
-    max_workers: Optional[int] = 5
+    
+    def analysis_options(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in AnalysisOptions.__fields__}
 
 def strip_code_fences(text: str) -> str:
     """Remove ```json ... ``` or ``` ... ``` fences if present."""
@@ -64,8 +209,15 @@ def extract_assistant_content(json_response: Dict[str, Any]) -> Optional[str]:
                 return item["content"]
     return None
 
-async def send_to_dust(frames_data: Dict[str, Any]) -> Dict[str, Any]:
-    """Send frames data to Dust API and return parsed JSON response."""
+def dust_input(frames_data: Dict[str, Any]) -> str:
+    """The user message sent to the Dust agent for frames_data."""
+    return "INPUT_JSON:\n" + json.dumps(frames_data, ensure_ascii=False)
+
+async def send_to_dust(frames_data: Dict[str, Any], uncompacted_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Send frames data to Dust API and return parsed JSON response. uncompacted_data is the
+    per-frame object frames_data was compacted from, if any; it is only used to log the saving.
+    """
     if not all([API_KEY, WORKSPACE_ID, HEALTH_AGENT_ID]):
         raise HTTPException(
             status_code=500,
@@ -77,34 +229,34 @@ async def send_to_dust(frames_data: Dict[str, Any]) -> Dict[str, Any]:
     print(f"[DUST] Health Agent ID: {HEALTH_AGENT_ID}")
     print(f"[DUST] Timezone: {TIMEZONE}")
     
-    url = f"{DUST_API_BASE}/api/v1/w/{WORKSPACE_ID}/assistant/conversations"
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json",
-    }
-    
-    content = "INPUT_JSON:\n" + json.dumps(frames_data, ensure_ascii=False)
-    print(f"[DUST] Request payload size: {len(content)} characters")
+    content = dust_input(frames_data)
+    metrics.DUST_PAYLOAD_CHARACTERS.observe(len(content))
+    span = tracing.span("send_to_dust", payload_characters=len(content), frames=frames_data.get('total_frames', 0)).start()
+    if uncompacted_data is not None:
+        full_size = len(dust_input(uncompacted_data))
+        print(f"[DUST] Request payload size: {len(content)} characters "
+              f"({full_size} as frames, {100 * (1 - len(content) / full_size):.0f}% smaller)")
+    else:
+        print(f"[DUST] Request payload size: {len(content)} characters")
     print(f"[DUST] Number of frames: {frames_data.get('total_frames', 0)}")
     
-    payload = {
-        "message": {
-            "content": content,
-            "context": {"timezone": TIMEZONE, "username": "me", "email": None},
-            "mentions": [{"configurationId": HEALTH_AGENT_ID}],
-        },
-        "blocking": True,
-        "visibility": "unlisted",
-        "title": "Video Analysis Summary"
+    message = {
+        "content": content,
+        "context": {"timezone": TIMEZONE, "username": "me", "email": None},
+        "mentions": [{"configurationId": HEALTH_AGENT_ID}],
     }
     
+    # The server's pooled client if there is one, else a client for this call only
+    shared_client = clients.get_dust_client()
+    client = shared_client or clients.make_dust_client()
+    dust_start = time.perf_counter()
+    outcome = "error"
     try:
-        print(f"[DUST] Sending POST request to: {url}")
-        print(f"[DUST] Waiting for response (timeout: 180s)...")
-        resp = requests.post(url, headers=headers, json=payload, timeout=180)
-        resp.raise_for_status()
-        print(f"[DUST] Received response with status: {resp.status_code}")
-        data = resp.json()
+        print(f"[DUST] Creating conversation at: {DUST_API_BASE}")
+        dust_client = DustClient(client, DUST_API_BASE, API_KEY, WORKSPACE_ID)
+        data = await dust_client.ask(message, title="Video Analysis Summary")
+        outcome = "success"
+        print(f"[DUST] Agent message complete")
         
         print(f"[DUST] Extracting assistant content from response...")
         assistant_text = extract_assistant_content(data)
@@ -132,12 +284,22 @@ async def send_to_dust(frames_data: Dict[str, Any]) -> Dict[str, Any]:
                 "raw_response": assistant_text,
                 "note": "Dust response was not valid JSON"
             }
-    except requests.exceptions.RequestException as e:
+    except DustTimeout as e:
+        outcome = "timeout"
+        print(f"[DUST] ERROR: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except (DustError, httpx.HTTPError) as e:
         print(f"[DUST] ERROR: Request failed: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"Error calling Dust API: {str(e)}"
         )
+    finally:
+        metrics.DUST_SECONDS.labels(outcome).observe(time.perf_counter() - dust_start)
+        span.set(outcome=outcome)
+        span.end()
+        if client is not shared_client:
+            await client.aclose()
 
 @app.get("/")
 async def root():
@@ -145,172 +307,557 @@ async def root():
         "message": "Video Analysis API is running",
         "endpoints": {
             "/analyze": "Upload video file (multipart/form-data)",
-            "/analyze/base64": "Send base64 encoded video (JSON)"
+            "/analyze/base64": "Send base64 encoded video (JSON)",
+            "/analyze/stream": "Upload video file, stream per-frame results and the Dust summary (NDJSON or SSE)",
+            "/analyze/base64/stream": "Send base64 encoded video, stream per-frame results and the Dust summary (NDJSON or SSE)",
+            "/jobs": "Queue video file for background analysis, returns a job ID (multipart/form-data)",
+            "/jobs/base64": "Queue base64 encoded video for background analysis, returns a job ID (JSON)",
+            "/jobs/{job_id}": "Job status, per-frame progress and result (GET)",
+            "/metrics": "Prometheus metrics: request, frame, OpenAI and Dust counters and timings (GET)"
         }
     }
 
+@app.get("/metrics")
+async def get_metrics():
+    """Metrics of this server (all its worker processes in multiprocess mode) in the Prometheus text format, for scraping."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+def validate_file_extension(file_ext: str) -> str:
+    """Normalize a file extension and reject unsupported video formats."""
+    file_ext = file_ext.lower()
+    if not file_ext.startswith('.'):
+        file_ext = '.' + file_ext
+    if file_ext not in sample.SUPPORTED_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file format: {file_ext}. Supported: {', '.join(sample.SUPPORTED_FORMATS)}"
+        )
+    return file_ext
+
+def build_frames_object(results) -> Dict[str, Any]:
+    """Format per-frame results as the frames object sent to Dust."""
+    # Extract only the parsed JSON data
+    print(f"\n[API] Extracting parsed JSON data from results...")
+    json_data_list = []
+    for result in results:
+        if result.get('success') and result.get('parsed_json'):
+            json_data_list.append(result['parsed_json'])
+    
+    # Check if all succeeded
+    total_frames = len(results)
+    successful = len(json_data_list)
+    print(f"[API] Successfully parsed {successful}/{total_frames} frames")
+    
+    # Format data for Dust API
+    print(f"\n[API] Formatting data for Dust API...")
+    return {
+        "status": "success" if successful == total_frames else "partial_success",
+        "message": "All frames analyzed successfully" if successful == total_frames else f"Processed {successful}/{total_frames} frames successfully",
+        "total_frames": total_frames,
+        "data": json_data_list
+    }
+
+def representative_descriptions(descriptions, limit: int = MAX_SEGMENT_DESCRIPTIONS):
+    """Up to limit distinct descriptions, spread evenly from the first to the last."""
+    distinct = list(dict.fromkeys(d for d in descriptions if d))
+    if len(distinct) <= limit:
+        return distinct
+    if limit <= 1:
+        return distinct[:limit]
+    step = (len(distinct) - 1) / (limit - 1)
+    return [distinct[round(i * step)] for i in range(limit)]
+
+def compact_timeline(frames) -> list:
+    """
+    Merge consecutive per-frame records with the same overall_action and sub_action into
+    {start, end, frames, action, sub_action, representative_descriptions} segments. A missing
+    second (e.g. a failed frame) ends a segment, so a segment never spans seconds not analyzed.
+    """
+    segments = []
+    descriptions = []
+    for frame in sorted(frames, key=lambda f: f.get('second', 0)):
+        second = frame.get('second', 0)
+        action = frame.get('overall_action')
+        sub_action = frame.get('sub_action', "")
+        current = segments[-1] if segments else None
+        if current is not None and current['action'] == action and current['sub_action'] == sub_action and second == current['end'] + 1:
+            current['end'] = second
+            current['frames'] += 1
+        else:
+            if current is not None:
+                current['representative_descriptions'] = representative_descriptions(descriptions)
+            descriptions = []
+            current = {
+                "start": second,
+                "end": second,
+                "frames": 1,
+                "action": action,
+                "sub_action": sub_action,
+                "representative_descriptions": []
+            }
+            segments.append(current)
+        descriptions.append(frame.get('description'))
+    if segments:
+        segments[-1]['representative_descriptions'] = representative_descriptions(descriptions)
+    return segments
+
+def build_dust_payload(frames_object: Dict[str, Any], payload_format: str = DUST_PAYLOAD_FORMAT) -> Dict[str, Any]:
+    """
+    The frames object in the requested format: unchanged for "frames", or with "data" replaced
+    by a run-length-encoded "timeline" of segments.
+    """
+    if payload_format not in DUST_PAYLOAD_FORMATS:
+        raise ValueError(f"Unknown Dust payload format: {payload_format}. Supported: {', '.join(DUST_PAYLOAD_FORMATS)}")
+    if payload_format == "frames":
+        return frames_object
+    payload = {key: value for key, value in frames_object.items() if key != "data"}
+    payload["format"] = "timeline"
+    payload["timeline"] = compact_timeline(frames_object["data"])
+    print(f"[API] Compacted {len(frames_object['data'])} frames into {len(payload['timeline'])} timeline segments")
+    return payload
+
+async def analyze_frames(video_path: str, options: Dict[str, Any], on_result=None):
+    """Analyze a video frame by frame with OpenAI; returns the per-frame results."""
+    options = {name: value for name, value in options.items() if name != "dust_payload_format"}
+    print(f"[API] Starting with up to {options['max_concurrency']} concurrent OpenAI requests (shared server limit: {OPENAI_MAX_CONCURRENCY})")
+    with tracing.span("process_video", **options):
+        return await sample.process_video_async(
+            video_path,
+            prompt=PROMPT,
+            verbose=True,
+            cache=FRAME_CACHE,
+            on_result=on_result,
+            routing_model=sample.ROUTING_MODEL,
+            reask_budget=sample.REASK_BUDGET,
+            rate_limiter=RATE_LIMITER,
+            **options
+        )
+
+async def summarize_with_dust(results, payload_format: str = DUST_PAYLOAD_FORMAT) -> Dict[str, Any]:
+    """Send the per-frame results to Dust in payload_format (see build_dust_payload) and return Dust's response."""
+    frames_object = build_frames_object(results)
+    payload = build_dust_payload(frames_object, payload_format)
+    
+    # Send to Dust API and return its response
+    print(f"[API] Sending {frames_object['total_frames']} frames to Dust API...")
+    dust_response = await send_to_dust(payload, frames_object if payload is not frames_object else None)
+    print(f"[API] Received response from Dust API")
+    print(f"[API] Response keys: {list(dust_response.keys()) if isinstance(dust_response, dict) else 'N/A'}")
+    return dust_response
+
+async def analyze_and_summarize(video_path: str, options: Dict[str, Any], on_result=None) -> Dict[str, Any]:
+    """Analyze a video frame by frame, send the results to Dust and return Dust's response."""
+    results = await analyze_frames(video_path, options, on_result=on_result)
+    return await summarize_with_dust(results, payload_format=options.get("dust_payload_format", DUST_PAYLOAD_FORMAT))
+
+def analysis_cache_key(content_hash: str, options: Dict[str, Any]) -> str:
+    """
+    Cache key of a video's analysis: its content hash, the prompt, the model and everything else
+    that changes the frame results or the Dust response (concurrency settings do not).
+    """
+    settings = {name: value for name, value in options.items() if name not in ("max_workers", "max_concurrency")}
+    settings.setdefault("dust_payload_format", DUST_PAYLOAD_FORMAT)
+    settings.update(dust_agent=HEALTH_AGENT_ID, routing_model=sample.ROUTING_MODEL)
+    return video_cache_key(content_hash, PROMPT, sample.OPENAI_MODEL, json.dumps(settings, sort_keys=True))
+
+def cache_analysis(cache_key: str, results, dust_response: Dict[str, Any]):
+    """Store a finished analysis in the video cache, unless some frames failed (so a re-upload retries them)."""
+    if VIDEO_CACHE is None:
+        return
+    if not all(result.get('success') for result in results):
+        print(f"[API] Not caching the video result: some frames failed")
+        return
+    VIDEO_CACHE.put(cache_key, {"results": results, "dust_response": dust_response})
+
+class InFlightAnalysis:
+    """
+    An analysis running in the background for the requests that uploaded the same video: its
+    task (resolving to {"results", "dust_response"}, like a video cache entry), the frame results
+    reported so far, and a queue per streaming request that follows them.
+    """
+
+    def __init__(self):
+        self.task: Optional[asyncio.Future] = None
+        self.frames = []  # Frame results in the order they arrived
+        self.results = None  # All frame results, once the frames are analyzed and Dust is asked
+        self.listeners = set()
+        self.streams = 0  # Streaming requests following it
+        self.keep_running = False  # Set once a non-streaming request waits for it
+
+    def report(self, result: Dict):
+        self.frames.append(result)
+        for listener in self.listeners:
+            listener.put_nowait(result)
+
+    def follow(self) -> asyncio.Queue:
+        """A queue of the frame results, starting with those reported before."""
+        listener = asyncio.Queue()
+        for result in self.frames:
+            listener.put_nowait(result)
+        self.listeners.add(listener)
+        return listener
+
+async def _analyze_and_cache(video_path: str, options: Dict[str, Any], cache_key: Optional[str], flight: InFlightAnalysis) -> Dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    try:
+        results = await analyze_frames(video_path, options, on_result=lambda result: loop.call_soon_threadsafe(flight.report, result))
+        flight.results = results
+        dust_response = await summarize_with_dust(results, payload_format=options.get("dust_payload_format", DUST_PAYLOAD_FORMAT))
+        if cache_key:
+            await asyncio.to_thread(cache_analysis, cache_key, results, dust_response)
+        return {"results": results, "dust_response": dust_response}
+    finally:
+        if os.path.exists(video_path):
+            os.unlink(video_path)
+
+def _forget_in_flight(cache_key: Optional[str], flight: InFlightAnalysis):
+    if cache_key and IN_FLIGHT.get(cache_key) is flight:
+        del IN_FLIGHT[cache_key]
+    if not flight.task.cancelled():
+        flight.task.exception()  # Retrieved here in case every waiter has gone away
+
+def join_analysis(video_path: str, options: Dict[str, Any], cache_key: Optional[str], stream=False) -> InFlightAnalysis:
+    """
+    The analysis of the same video (by cache_key) already in progress, or a new one of video_path
+    started in the background. Takes ownership of video_path (deletes it). An analysis keeps
+    running when a non-streaming caller goes away; when only streaming callers follow it, it is
+    cancelled once the last of them disconnects.
+    """
+    flight = IN_FLIGHT.get(cache_key) if cache_key else None
+    if flight is not None:
+        os.unlink(video_path)
+        print(f"[API] The same video is already being analyzed, waiting for its result")
+    else:
+        flight = InFlightAnalysis()
+        flight.task = asyncio.ensure_future(_analyze_and_cache(video_path, options, cache_key, flight))
+        if cache_key:
+            IN_FLIGHT[cache_key] = flight
+        flight.task.add_done_callback(lambda done: _forget_in_flight(cache_key, flight))
+    if stream:
+        flight.streams += 1
+    else:
+        flight.keep_running = True
+    return flight
+
+async def analyze_and_summarize_cached(video_path: str, options: Dict[str, Any], cache_key: str) -> Dict[str, Any]:
+    """
+    analyze_and_summarize, answered from the video cache when the same content was analyzed
+    with the same settings before. Concurrent calls with the same cache_key share one analysis
+    (see join_analysis). Takes ownership of video_path (deletes it).
+    """
+    cached = await asyncio.to_thread(VIDEO_CACHE.get, cache_key) if VIDEO_CACHE else None
+    if cached is not None:
+        os.unlink(video_path)
+        print(f"[API] Video result cache hit, returning the stored Dust response")
+        return cached["dust_response"]
+    
+    flight = join_analysis(video_path, options, cache_key)
+    outcome = await asyncio.shield(flight.task)
+    return outcome["dust_response"]
+
+def format_event(event: str, data: Any, stream_format: str) -> str:
+    """One streamed event as an NDJSON line or a Server-Sent Event."""
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
+
+def frame_event(result: Dict) -> tuple:
+    """(event, data) for a per-frame result: its parsed JSON, or the error if it failed."""
+    if result.get('success') and result.get('parsed_json'):
+        return "frame", result['parsed_json']
+    return "frame_error", {"second": result.get('second'), "error": result.get('error', 'Unknown error')}
+
+async def stream_analysis(video_path: str, options: Dict[str, Any], stream_format: str, cache_key: Optional[str] = None):
+    """
+    Analyze a video and yield events as they happen: "start" (expected frame count), one
+    "frame" (validated parsed_json) or "frame_error" per analyzed frame as soon as its result
+    arrives, "frame" events for seconds that inherited labels from adaptive sampling, and
+    finally "summary" with the Dust response (or "error"). With a cache_key, a cached analysis
+    is replayed instead, and a new one is stored; a request for a video that is being analyzed
+    follows that analysis (see join_analysis), replaying the frames it already reported.
+    Deletes video_path when done.
+    """
+    flight = None
+    try:
+        cached = await asyncio.to_thread(VIDEO_CACHE.get, cache_key) if VIDEO_CACHE and cache_key else None
+        if cached is not None:
+            print(f"[API] Video result cache hit, replaying the stored results")
+            yield format_event("start", {"frames_total": len(cached["results"]), "cached": True}, stream_format)
+            for result in cached["results"]:
+                yield format_event(*frame_event(result), stream_format)
+            yield format_event("summary", cached["dust_response"], stream_format)
+            return
+        
+        try:
+            frames_total = sample.probe_video(video_path)["expected_samples"]
+        except ValueError:
+            frames_total = None
+        yield format_event("start", {"frames_total": frames_total}, stream_format)
+        
+        flight = join_analysis(video_path, options, cache_key, stream=True)
+        results_queue = flight.follow()
+        while not flight.task.done() or not results_queue.empty():
+            next_result = asyncio.ensure_future(results_queue.get())
+            done, _ = await asyncio.wait({next_result, flight.task}, return_when=asyncio.FIRST_COMPLETED)
+            if next_result in done:
+                yield format_event(*frame_event(next_result.result()), stream_format)
+            else:
+                next_result.cancel()
+        
+        try:
+            outcome = flight.task.result()
+        except Exception as e:
+            if flight.results is None:
+                yield format_event("error", {"detail": f"Error processing video: {str(e)}"}, stream_format)
+            else:
+                detail = getattr(e, "detail", None) or str(e)
+                yield format_event("error", {"detail": f"Error summarizing with Dust: {detail}"}, stream_format)
+            return
+        for result in outcome["results"]:
+            if result.get('inherited_from') is not None:
+                yield format_event(*frame_event(result), stream_format)
+        yield format_event("summary", outcome["dust_response"], stream_format)
+    finally:
+        # Also reached when the client disconnects mid-stream
+        if flight is not None:
+            flight.listeners.discard(results_queue)
+            flight.streams -= 1
+            if not flight.task.done() and flight.streams == 0 and not flight.keep_running:
+                flight.task.cancel()
+        elif os.path.exists(video_path):
+            os.unlink(video_path)
+
+def streaming_response(video_path: str, options: Dict[str, Any], stream_format: str, cache_key: Optional[str] = None) -> StreamingResponse:
+    if stream_format == "sse":
+        return StreamingResponse(
+            stream_analysis(video_path, options, stream_format, cache_key),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    return StreamingResponse(stream_analysis(video_path, options, stream_format, cache_key), media_type="application/x-ndjson")
+
+async def run_job(job: Dict[str, Any], on_result) -> Dict[str, Any]:
+    """Job handler for the background job queue."""
+    print(f"\n[API] Starting video analysis for job {job['id']} ({job['filename']})")
+    with tracing.traced("job", job['id'], filename=job['filename']):
+        return await analyze_and_summarize(job['video_path'], job['options'], on_result=on_result)
+
+def enqueue_job(video_path: str, options: AnalysisOptions, filename: Optional[str], job_id: str) -> Dict[str, Any]:
+    """Record a job for an uploaded video and put it on the queue."""
+    if JOB_QUEUE is None:
+        raise HTTPException(status_code=503, detail="Job queue is not running")
+    job = JOB_STORE.create(video_path, dict(options), filename=filename, job_id=job_id)
+    try:
+        JOB_QUEUE.submit(job_id)
+    except JobQueueFull as e:
+        JOB_STORE.update(job_id, status=jobs.FAILED, error=str(e))
+        os.unlink(video_path)
+        raise HTTPException(status_code=503, detail=str(e))
+    print(f"[API] Queued job {job_id} ({JOB_QUEUE.queued()} waiting)")
+    return job
+
+async def receive_upload_file(file: UploadFile, directory: Optional[str] = None, name: Optional[str] = None, digest=None) -> str:
+    """
+    Stream a multipart upload to directory/name<ext> (a temp file by default) in chunks,
+    enforcing MAX_UPLOAD_MB, and hashing it into digest if given. Returns the video path.
+    """
+    file_ext = validate_file_extension(os.path.splitext(file.filename)[1])
+    video_path = os.path.join(directory or tempfile.gettempdir(), f"{name or uuid.uuid4().hex}{file_ext}")
+    try:
+        with tracing.span("receive_upload", filename=file.filename) as span:
+            size = await uploads.save_upload_file(file, video_path, uploads.max_upload_bytes(), digest=digest)
+            span.set(size_mb=round(size / (1024 * 1024), 2))
+    except UploadTooLarge as e:
+        if os.path.exists(video_path):
+            os.unlink(video_path)
+        raise HTTPException(status_code=413, detail=str(e))
+    print(f"[API] Received {file.filename} ({size / (1024 * 1024):.2f} MB)")
+    return video_path
+
+async def receive_base64_video(request: Request, directory: Optional[str] = None, name: Optional[str] = None, digest=None):
+    """
+    Stream a Base64VideoRequest JSON body, decoding the video to directory/name<ext> (a temp file
+    by default) as it arrives, enforcing MAX_UPLOAD_MB and hashing it into digest if given.
+    Returns (video_path, body) where body is the Base64VideoRequest without the video.
+    """
+    partial_path = os.path.join(directory or tempfile.gettempdir(), f"{name or uuid.uuid4().hex}.part")
+    try:
+        with tracing.span("receive_upload", encoding="base64"):
+            fields = await uploads.save_base64_json_body(request.stream(), partial_path, uploads.max_upload_bytes(), digest=digest)
+        try:
+            body = Base64VideoRequest(**fields)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+        file_ext = validate_file_extension(body.file_extension)
+    except UploadTooLarge as e:
+        os.unlink(partial_path)
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidUpload as e:
+        os.unlink(partial_path)
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.unlink(partial_path)
+        raise
+    video_path = partial_path[:-len(".part")] + file_ext
+    os.replace(partial_path, video_path)
+    print(f"[API] Received base64 encoded video ({os.path.getsize(video_path) / (1024 * 1024):.2f} MB)")
+    return video_path, body
+
+# The base64 endpoints read their body as a stream; document it as the Base64VideoRequest schema
+BASE64_VIDEO_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": Base64VideoRequest.model_json_schema()}}
+    }
+}
+
 @app.post("/analyze")
 async def analyze_video(
     file: UploadFile = File(...),
-    max_workers: Optional[int] = 5
+    options: AnalysisOptions = Depends()
 ):
     """
     Analyze a video file frame by frame using OpenAI Vision API, then send results to Dust API.
     
     Args:
-        file: Video file to analyze (mp4, mov, avi, etc.)
-        max_workers: Number of parallel API calls (default: 5)
+        file: Video file to analyze (mp4, mov, avi, etc.), at most MAX_UPLOAD_MB
+        options: Query parameters, see AnalysisOptions:
+            - max_workers: Number of concurrent OpenAI requests to start with (default: 5)
+            - max_concurrency: Upper bound the concurrency adapts to, backing off on rate limits (default: 20)
+            - adaptive: Skip frames whose scene did not change and reuse the previous labels (default: False)
+            - max_dimension: Downscale frames so the longer side is at most this many pixels (default: full resolution)
+            - jpeg_quality: JPEG quality 0-100 for frames sent to OpenAI (default: 95)
+            - detail: OpenAI image detail level, "low", "high" or "auto" (default: "auto")
+            - batch_size: Frames sent per OpenAI request (default: 1)
+            - structured_output: Constrain OpenAI's answers to the prompt's JSON schema (default: STRUCTURED_OUTPUT)
+            - dust_payload_format: "frames" or "timeline", what is sent to the Dust agent (default: DUST_PAYLOAD_FORMAT)
     
     Returns:
         JSON response from Dust API (health analysis, tips, etc.)
     """
-    # Validate file type
-    file_ext = os.path.splitext(file.filename)[1].lower()
-    if file_ext not in sample.SUPPORTED_FORMATS:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Unsupported file format: {file_ext}. Supported: {', '.join(sample.SUPPORTED_FORMATS)}"
-        )
-    
-    # Save uploaded file to temporary location
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp_file:
-        try:
-            # Write uploaded file to temp file
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_file_path = tmp_file.name
-            
-            # Process video with verbose output
-            print(f"\n[API] Starting video analysis for file: {file.filename}")
-            print(f"[API] Using {max_workers} parallel workers")
-            results = sample.process_video(
-                tmp_file_path,
-                prompt=PROMPT,
-                max_workers=max_workers,
-                verbose=True
-            )
-            
-            # Extract only the parsed JSON data
-            print(f"\n[API] Extracting parsed JSON data from results...")
-            json_data_list = []
-            for result in results:
-                if result.get('success') and result.get('parsed_json'):
-                    json_data_list.append(result['parsed_json'])
-            
-            # Check if all succeeded
-            total_frames = len(results)
-            successful = len(json_data_list)
-            print(f"[API] Successfully parsed {successful}/{total_frames} frames")
-            
-            # Format data for Dust API
-            print(f"\n[API] Formatting data for Dust API...")
-            frames_object = {
-                "status": "success" if successful == total_frames else "partial_success",
-                "message": "All frames analyzed successfully" if successful == total_frames else f"Processed {successful}/{total_frames} frames successfully",
-                "total_frames": total_frames,
-                "data": json_data_list
-            }
+    # Save uploaded file to temporary location, hashing it on the way
+    digest = hashlib.sha256()
+    tmp_file_path = await receive_upload_file(file, digest=digest)
+    try:
+        # Process video with verbose output (the analysis deletes the temporary file)
+        print(f"\n[API] Starting video analysis for file: {file.filename}")
+        cache_key = analysis_cache_key(digest.hexdigest(), dict(options))
+        dust_response = await analyze_and_summarize_cached(tmp_file_path, dict(options), cache_key)
+        return JSONResponse(content=dust_response)
             
-            # Send to Dust API and return its response
-            print(f"[API] Sending {total_frames} frames to Dust API...")
-            dust_response = await send_to_dust(frames_object)
-            print(f"[API] Received response from Dust API")
-            print(f"[API] Response keys: {list(dust_response.keys()) if isinstance(dust_response, dict) else 'N/A'}")
-            return JSONResponse(content=dust_response)
-                
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error processing video: {str(e)}")
-        finally:
-            # Clean up temporary file
-            if os.path.exists(tmp_file_path):
-                os.unlink(tmp_file_path)
+    except HTTPException:
+        # Already carries its status, e.g. 504 when the Dust agent did not answer in time
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing video: {str(e)}")
 
-@app.post("/analyze/base64")
-async def analyze_video_base64(request: Base64VideoRequest):
+@app.post("/analyze/base64", openapi_extra=BASE64_VIDEO_BODY)
+async def analyze_video_base64(request: Request):
     """
     Analyze a base64 encoded video file frame by frame using OpenAI Vision API, then send results to Dust API.
     
     Args:
-        request: JSON body with:
-            - video_base64: Base64 encoded video string
+        request: JSON body (Base64VideoRequest) with:
+            - video_base64: Base64 encoded video string, at most MAX_UPLOAD_MB once decoded
             - file_extension: File extension (e.g., ".mp4", ".mov", ".avi") - default: ".mp4"
-            - max_workers: Number of parallel API calls (default: 5)
+            - the options of AnalysisOptions (max_workers, max_concurrency, adaptive, max_dimension, jpeg_quality, detail, batch_size, structured_output, dust_payload_format)
     
     Returns:
         JSON response from Dust API (health analysis, tips, etc.)
     """
-    # Validate file extension
-    file_ext = request.file_extension.lower()
-    if not file_ext.startswith('.'):
-        file_ext = '.' + file_ext
-    
-    if file_ext not in sample.SUPPORTED_FORMATS:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Unsupported file format: {file_ext}. Supported: {', '.join(sample.SUPPORTED_FORMATS)}"
-        )
-    
-    # Decode base64 video
+    # Decode the base64 video to a temporary file while it is received, hashing it on the way
+    digest = hashlib.sha256()
+    tmp_file_path, body = await receive_base64_video(request, digest=digest)
     try:
-        video_bytes = base64.b64decode(request.video_base64)
+        # Process video with verbose output (the analysis deletes the temporary file)
+        print(f"\n[API] Starting video analysis for base64 encoded video")
+        print(f"[API] File extension: {os.path.splitext(tmp_file_path)[1]}")
+        cache_key = analysis_cache_key(digest.hexdigest(), body.analysis_options())
+        dust_response = await analyze_and_summarize_cached(tmp_file_path, body.analysis_options(), cache_key)
+        return JSONResponse(content=dust_response)
+            
+    except HTTPException:
+        # Already carries its status, e.g. 504 when the Dust agent did not answer in time
+        raise
     except Exception as e:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invalid base64 encoding: {str(e)}"
-        )
+        raise HTTPException(status_code=500, detail=f"Error processing video: {str(e)}")
+
+@app.post("/analyze/stream")
+async def analyze_video_stream(
+    file: UploadFile = File(...),
+    options: AnalysisOptions = Depends(),
+    format: Literal["ndjson", "sse"] = "ndjson"
+):
+    """
+    Like /analyze, but streams the results while the video is analyzed instead of returning
+    them at the end. format selects NDJSON lines ({"event": ..., "data": ...}) or Server-Sent
+    Events. Events:
+        - start: {"frames_total": expected number of frames}
+        - frame: a frame's validated JSON, as soon as it has been analyzed
+        - frame_error: {"second": ..., "error": ...} for a frame that could not be analyzed
+        - summary: the Dust API response, last
+        - error: {"detail": ...} if the analysis or the Dust call failed
+    """
+    digest = hashlib.sha256()
+    tmp_file_path = await receive_upload_file(file, digest=digest)
+    print(f"\n[API] Starting streamed video analysis for file: {file.filename}")
+    return streaming_response(tmp_file_path, dict(options), format, analysis_cache_key(digest.hexdigest(), dict(options)))
+
+@app.post("/analyze/base64/stream", openapi_extra=BASE64_VIDEO_BODY)
+async def analyze_video_base64_stream(request: Request, format: Literal["ndjson", "sse"] = "ndjson"):
+    """
+    Like /analyze/base64, but streams the results as they arrive; see /analyze/stream.
+    """
+    digest = hashlib.sha256()
+    tmp_file_path, body = await receive_base64_video(request, digest=digest)
+    print(f"\n[API] Starting streamed video analysis for base64 encoded video")
+    options = body.analysis_options()
+    return streaming_response(tmp_file_path, options, format, analysis_cache_key(digest.hexdigest(), options))
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    file: UploadFile = File(...),
+    options: AnalysisOptions = Depends()
+):
+    """
+    Queue a video file for background analysis. Same parameters as /analyze.
     
-    # Save decoded video to temporary location
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp_file:
-        tmp_file_path = None
-        try:
-            tmp_file.write(video_bytes)
-            tmp_file_path = tmp_file.name
-            
-            # Process video with verbose output
-            print(f"\n[API] Starting video analysis for base64 encoded video")
-            print(f"[API] File extension: {file_ext}")
-            print(f"[API] Using {request.max_workers} parallel workers")
-            results = sample.process_video(
-                tmp_file_path,
-                prompt=PROMPT,
-                max_workers=request.max_workers,
-                verbose=True
-            )
-            
-            # Extract only the parsed JSON data
-            print(f"\n[API] Extracting parsed JSON data from results...")
-            json_data_list = []
-            for result in results:
-                if result.get('success') and result.get('parsed_json'):
-                    json_data_list.append(result['parsed_json'])
-            
-            # Check if all succeeded
-            total_frames = len(results)
-            successful = len(json_data_list)
-            print(f"[API] Successfully parsed {successful}/{total_frames} frames")
-            
-            # Format data for Dust API
-            print(f"\n[API] Formatting data for Dust API...")
-            frames_object = {
-                "status": "success" if successful == total_frames else "partial_success",
-                "message": "All frames analyzed successfully" if successful == total_frames else f"Processed {successful}/{total_frames} frames successfully",
-                "total_frames": total_frames,
-                "data": json_data_list
-            }
-            
-            # Send to Dust API and return its response
-            print(f"[API] Sending {total_frames} frames to Dust API...")
-            dust_response = await send_to_dust(frames_object)
-            print(f"[API] Received response from Dust API")
-            print(f"[API] Response keys: {list(dust_response.keys()) if isinstance(dust_response, dict) else 'N/A'}")
-            return JSONResponse(content=dust_response)
-                
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error processing video: {str(e)}")
-        finally:
-            # Clean up temporary file
-            if tmp_file_path and os.path.exists(tmp_file_path):
-                os.unlink(tmp_file_path)
+    Returns:
+        The job ID and status; poll GET /jobs/{job_id} for progress and the Dust result.
+    """
+    job_id = uuid.uuid4().hex
+    os.makedirs(jobs.JOBS_UPLOAD_DIR, exist_ok=True)
+    video_path = await receive_upload_file(file, jobs.JOBS_UPLOAD_DIR, job_id)
+    
+    job = enqueue_job(video_path, options, file.filename, job_id)
+    return {"job_id": job["id"], "status": job["status"]}
+
+@app.post("/jobs/base64", status_code=202, openapi_extra=BASE64_VIDEO_BODY)
+async def create_job_base64(request: Request):
+    """
+    Queue a base64 encoded video for background analysis. Same body as /analyze/base64.
+    
+    Returns:
+        The job ID and status; poll GET /jobs/{job_id} for progress and the Dust result.
+    """
+    job_id = uuid.uuid4().hex
+    os.makedirs(jobs.JOBS_UPLOAD_DIR, exist_ok=True)
+    video_path, body = await receive_base64_video(request, jobs.JOBS_UPLOAD_DIR, job_id)
+    
+    job = enqueue_job(video_path, AnalysisOptions(**body.analysis_options()), None, job_id)
+    return {"job_id": job["id"], "status": job["status"]}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Status of a background job: queued, running, completed or failed, with per-frame
+    progress, and the Dust result once completed (or the error if it failed).
+    """
+    job = JOB_STORE.get(job_id) if JOB_STORE else None
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return jobs.job_status(job)
 
 if __name__ == "__main__":
     import uvicorn
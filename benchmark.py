@@ -0,0 +1,1057 @@
+"""
+Benchmarks for the video analysis pipeline. Nothing here calls OpenAI or Dust unless asked to
+(encode --live).
+
+Usage:
+  python benchmark.py decode [--video PATH] [--seconds 60] [--fps 29.97] [--width 1280] [--height 720] [--repeat 3]
+  python benchmark.py parallel-decode [--video PATH] [--seconds 300] [--width 1920] [--height 1080] [--workers 1,2,4,8]
+  python benchmark.py ffmpeg-decode [--video PATH] [--seconds 120] [--width 1920] [--height 1080] [--max-dimension 768]
+  python benchmark.py encode [--video PATH] [--width 3840] [--height 2160] [--frames 5] [--live 0]
+  python benchmark.py upload [--sizes 16,64,256]
+  python benchmark.py connections [--videos 10] [--frames 20] [--workers 5]
+  python benchmark.py ratelimit [--frames 200] [--workers 5] [--max-concurrency 20] [--server-concurrency 8] [--error-rate 0.05]
+  python benchmark.py resume [--seconds 60] [--kill-after 25] [--workers 5]
+  python benchmark.py batch [--videos 3] [--seconds 20] [--expire-fraction 0.6] [--error-rate 0.05]
+  python benchmark.py pipeline [--seconds 60] [--fps 30] [--width 1280] [--height 720] [--modes phased,streaming,api]
+                               [--openai-latency 0.3] [--openai-error-rate 0.02] [--dust-latency 1] [--dust-error-rate 0]
+                               [--routing-model gpt-4o-mini] [--routing-latency 0.15] [--routing-noise 0.1]
+                               [--openai-malformed-rate 0.05] [--structured-output] [--reask-budget 50] [--prompt-cache-min-tokens 1024]
+                               [--runs 3] [--output results.json] [--baseline previous.json] [--tolerance 0.2]
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import datetime
+import io
+import itertools
+import json
+import math
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import ffmpeg_pipe
+import sample
+from prompt import PROMPT
+
+
+def make_synthetic_video(path, seconds=60, fps=30.0, width=1280, height=720):
+    """
+    Write a synthetic test video with OpenCV: a moving gradient with the frame number drawn on it,
+    so consecutive frames differ and the encoder cannot collapse them.
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"Could not open video writer for {path}")
+    gradient = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+    total_frames = int(round(seconds * fps))
+    for i in range(total_frames):
+        shifted = np.roll(gradient, i * 4, axis=1)
+        frame = cv2.merge([shifted, np.roll(shifted, height // 3, axis=0), np.full_like(shifted, (i // int(fps or 1)) * 16 % 256)])
+        cv2.putText(frame, f"frame {i}", (40, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def make_synthetic_frame(width=3840, height=2160, seed=0):
+    """
+    A synthetic "photo-like" frame: smooth gradients, some shapes, text and sensor-like noise,
+    so JPEG sizes are in a realistic range (a flat test image would compress to almost nothing).
+    """
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    frame = np.stack([
+        180 * x + 40 * y,
+        120 + 60 * np.sin(6 * x + seed) * np.cos(4 * y),
+        200 * y + 30 * x,
+    ], axis=-1)
+    frame = np.clip(frame + rng.normal(0, 6, frame.shape), 0, 255).astype(np.uint8)
+    for _ in range(12):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(frame, center, int(rng.integers(height // 20, height // 5)), color, -1)
+    cv2.putText(frame, f"frame {seed}", (width // 10, height // 2), cv2.FONT_HERSHEY_SIMPLEX, height / 300, (255, 255, 255), max(1, height // 200))
+    return frame
+
+
+def estimate_image_tokens(width, height, detail):
+    """
+    Image input tokens per OpenAI's published gpt-4o formula: 85 for detail=low; otherwise the image
+    is fit into 2048x2048, its shortest side scaled down to 768, and it costs 85 + 170 per 512px tile.
+    "auto" is counted as high, which is what the API picks for images of this size.
+    """
+    if detail == 'low':
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def legacy_extract_frames(video_path, fps=1):
+    """The original extract_frames loop: cap.read() every frame, keep every int(video_fps / fps)-th."""
+    cap = cv2.VideoCapture(video_path)
+    video_fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_interval = max(int(video_fps / fps), 1) if video_fps > 0 else 1
+    frames = []
+    frame_count = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if frame_count % frame_interval == 0:
+            frames.append((len(frames), frame))
+        frame_count += 1
+    cap.release()
+    return frames
+
+
+def _time_best(fn, repeat):
+    """Run fn repeat times and return (best wall time, last return value)."""
+    best = None
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, value
+
+
+def bench_decode(args):
+    """Compare decode time of the legacy read loop against the read/grab/seek samplers."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = args.video
+        if not video_path:
+            video_path = os.path.join(tmp_dir, "synthetic.mp4")
+            print(f"[BENCH] Generating {args.seconds}s synthetic video at {args.fps} fps ({args.width}x{args.height})...")
+            make_synthetic_video(video_path, args.seconds, args.fps, args.width, args.height)
+
+        cap = cv2.VideoCapture(video_path)
+        video_fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        duration = total_frames / video_fps if video_fps > 0 else 0
+        print(f"[BENCH] Video: {total_frames} frames, {video_fps:.2f} fps, {duration:.2f}s")
+        print(f"[BENCH] Sampling {args.sample_fps} frame(s) per second, best of {args.repeat}\n")
+
+        candidates = [("legacy read loop", lambda: legacy_extract_frames(video_path, fps=args.sample_fps))]
+        for sampler in sample.SAMPLERS:
+            candidates.append((
+                f"{sampler} sampler",
+                lambda sampler=sampler: sample.extract_frames(video_path, fps=args.sample_fps, sampler=sampler, verbose=False)[0]
+            ))
+
+        baseline = None
+        print(f"{'method':<20} {'time (s)':>10} {'frames':>8} {'ms/frame':>10} {'speedup':>8}")
+        for name, fn in candidates:
+            elapsed, frames = _time_best(fn, args.repeat)
+            baseline = baseline or elapsed
+            per_frame = elapsed * 1000 / len(frames) if frames else 0
+            print(f"{name:<20} {elapsed:>10.3f} {len(frames):>8} {per_frame:>10.2f} {baseline / elapsed:>7.2f}x")
+
+        expected = sample._expected_sample_count(duration, args.sample_fps)
+        print(f"\n[BENCH] Expected samples by timestamp: {expected}")
+
+
+def bench_parallel_decode(args):
+    """
+    Decode throughput of extract_frames against the number of decoding processes, and whether
+    the frames are identical to a single-process decode (same seconds, same pixels).
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = args.video
+        if not video_path:
+            video_path = os.path.join(tmp_dir, "synthetic.mp4")
+            print(f"[BENCH] Generating {args.seconds}s synthetic video at {args.fps} fps ({args.width}x{args.height})...")
+            make_synthetic_video(video_path, args.seconds, args.fps, args.width, args.height)
+        info = sample.probe_video(video_path)
+        print(f"[BENCH] Video: {info['total_frames']} frames, {info['video_fps']:.2f} fps, {info['duration']:.2f}s; "
+              f"{os.cpu_count()} CPUs, {args.sampler} sampler, best of {args.repeat}\n")
+
+        reference = None
+        baseline = None
+        print(f"{'workers':>8} {'time (s)':>10} {'frames':>8} {'video s/s':>10} {'speedup':>8} {'identical':>10}")
+        for workers in [int(w) for w in args.workers.split(",")]:
+            elapsed, frames = _time_best(
+                lambda: sample.extract_frames(video_path, sampler=args.sampler, verbose=False, workers=workers)[0],
+                args.repeat
+            )
+            if reference is None:
+                reference = frames
+                baseline = elapsed
+            identical = (len(frames) == len(reference) and
+                         all(a[0] == b[0] and np.array_equal(a[1], b[1]) for a, b in zip(frames, reference)))
+            print(f"{workers:>8} {elapsed:>10.3f} {len(frames):>8} {info['duration'] / elapsed:>10.1f} "
+                  f"{baseline / elapsed:>7.2f}x {'yes' if identical else 'NO':>10}")
+            del frames
+
+
+def _encode_frames_opencv(video_path, backend, max_dimension, jpeg_quality):
+    frames, _ = sample.extract_frames(video_path, verbose=False, backend=backend, max_dimension=max_dimension)
+    return [(second, sample.encode_frame_to_base64(frame, max_dimension, jpeg_quality)[0]) for second, frame in frames]
+
+
+def _decode_base64_jpeg(frame_base64):
+    return cv2.imdecode(np.frombuffer(base64.b64decode(frame_base64), np.uint8), cv2.IMREAD_COLOR)
+
+
+def bench_ffmpeg_decode(args):
+    """
+    Decoding, sampling, downscaling and JPEG-encoding a video into API-ready frames: OpenCV
+    (grab sampler + cv2.resize + cv2.imencode) vs an ffmpeg subprocess sampling and scaling in
+    its filter graph (raw frames, encoded by OpenCV) vs ffmpeg also encoding the JPEGs (MJPEG).
+    Also reports whether the same seconds come out and how far the pixels are from OpenCV's.
+    """
+    if not ffmpeg_pipe.ffmpeg_available():
+        print(f"[BENCH] ffmpeg not found ({ffmpeg_pipe.FFMPEG_BINARY}); install it or set FFMPEG_BINARY")
+        return 1
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = args.video
+        if not video_path:
+            video_path = os.path.join(tmp_dir, "synthetic.mp4")
+            print(f"[BENCH] Generating {args.seconds}s synthetic video at {args.fps} fps ({args.width}x{args.height})...")
+            make_synthetic_video(video_path, args.seconds, args.fps, args.width, args.height)
+        info = sample.probe_video(video_path)
+        print(f"[BENCH] Video: {info['width']}x{info['height']}, {info['total_frames']} frames, {info['video_fps']:.2f} fps, "
+              f"{info['duration']:.2f}s; max dimension {args.max_dimension or 'full'}, JPEG quality {args.jpeg_quality}, best of {args.repeat}\n")
+
+        variants = [
+            ("opencv", lambda: _encode_frames_opencv(video_path, "opencv", args.max_dimension, args.jpeg_quality)),
+            ("ffmpeg", lambda: _encode_frames_opencv(video_path, "ffmpeg", args.max_dimension, args.jpeg_quality)),
+            ("ffmpeg-mjpeg", lambda: [item[:2] for item in sample.iter_encoded_frames_ffmpeg(
+                video_path, max_dimension=args.max_dimension, jpeg_quality=args.jpeg_quality, verbose=False)]),
+        ]
+        reference = None
+        baseline = None
+        print(f"{'backend':>13} {'time (s)':>10} {'frames':>8} {'KB/frame':>9} {'speedup':>8} {'same seconds':>13} {'pixel diff':>11}")
+        for name, fn in variants:
+            elapsed, encoded = _time_best(fn, args.repeat)
+            if reference is None:
+                reference = [(second, _decode_base64_jpeg(frame_base64).astype(np.int16)) for second, frame_base64 in encoded]
+                baseline = elapsed
+            same_seconds = [second for second, _ in encoded] == [second for second, _ in reference]
+            # Mean absolute difference (0-1) of the decoded JPEGs against OpenCV's, over the common seconds
+            diffs = [np.mean(np.abs(_decode_base64_jpeg(frame_base64).astype(np.int16) - ref)) / 255
+                     for (_, frame_base64), (_, ref) in zip(encoded, reference)]
+            kb_per_frame = sum(len(frame_base64) for _, frame_base64 in encoded) / 1024 / max(1, len(encoded))
+            print(f"{name:>13} {elapsed:>10.3f} {len(encoded):>8} {kb_per_frame:>9.1f} {baseline / elapsed:>7.2f}x "
+                  f"{'yes' if same_seconds else 'NO':>13} {float(np.mean(diffs)) if diffs else 0:>11.4f}")
+            del encoded
+
+
+def bench_encode(args):
+    """Report payload bytes, estimated image tokens and latency per frame for each encoding setting."""
+    if args.video:
+        frames = [frame for _, frame in sample.extract_frames(args.video, verbose=False)[0][:args.frames]]
+    else:
+        frames = [make_synthetic_frame(args.width, args.height, seed=i) for i in range(args.frames)]
+    height, width = frames[0].shape[:2]
+    print(f"[BENCH] {len(frames)} frames at {width}x{height}\n")
+
+    client = None
+    if args.live:
+        from openai import OpenAI
+        client = OpenAI(api_key=sample.OPENAI_API_KEY)
+        print(f"[BENCH] Live mode: {args.live} {sample.OPENAI_MODEL} call(s) per setting\n")
+
+    dimensions = [None] + [int(d) for d in args.max_dimensions.split(",")]
+    qualities = [int(q) for q in args.qualities.split(",")]
+    details = args.details.split(",")
+
+    header = f"{'max_dim':>8} {'quality':>8} {'detail':>7} {'KB/frame':>9} {'size':>11} {'est.tokens':>11} {'encode ms':>10}"
+    if client:
+        header += f" {'api tokens':>11} {'api s':>7}"
+    print(header)
+    for max_dimension, quality, detail in itertools.product(dimensions, qualities, details):
+        sizes = []
+        start = time.perf_counter()
+        for frame in frames:
+            frame_base64, size_kb = sample.encode_frame_to_base64(frame, max_dimension, quality)
+            sizes.append(size_kb)
+        encode_ms = (time.perf_counter() - start) * 1000 / len(frames)
+        out_height, out_width = sample.resize_frame(frames[0], max_dimension).shape[:2]
+        line = (f"{max_dimension or 'full':>8} {quality:>8} {detail:>7} {sum(sizes) / len(sizes):>9.1f} "
+                f"{f'{out_width}x{out_height}':>11} {estimate_image_tokens(out_width, out_height, detail):>11} {encode_ms:>10.1f}")
+        if client:
+            tokens, latencies = [], []
+            for i in range(args.live):
+                frame_base64, _ = sample.encode_frame_to_base64(frames[i % len(frames)], max_dimension, quality)
+                result = sample.analyze_frame_with_openai((client, frame_base64, PROMPT, i, i, detail))
+                latencies.append(result['elapsed_time'])
+                if result.get('tokens_used'):
+                    tokens.append(result['tokens_used'])
+            avg_tokens = f"{sum(tokens) / len(tokens):.0f}" if tokens else "n/a"
+            line += f" {avg_tokens:>11} {sum(latencies) / len(latencies):>7.2f}"
+        print(line)
+
+
+def _write_upload_files(tmp_dir, size_mb):
+    """Write a random "video" of size_mb and its base64 JSON request body to disk, in chunks."""
+    video_path = os.path.join(tmp_dir, f"upload_{size_mb}.mp4")
+    body_path = os.path.join(tmp_dir, f"upload_{size_mb}.json")
+    chunk_size = 3 * 1024 * 1024  # Multiple of 3, so the base64 of each chunk can be concatenated
+    remaining = size_mb * 1024 * 1024
+    with open(video_path, "wb") as video, open(body_path, "wb") as body:
+        body.write(b'{"file_extension": ".mp4", "video_base64": "')
+        while remaining > 0:
+            chunk = os.urandom(min(chunk_size, remaining))
+            video.write(chunk)
+            body.write(base64.b64encode(chunk))
+            remaining -= len(chunk)
+        body.write(b'", "max_workers": 5}')
+    return video_path, body_path
+
+
+def _peak_memory_mb(fn):
+    """Peak Python heap allocation (MB) while running fn."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def bench_upload(args):
+    """Peak memory of receiving an upload (multipart and base64 JSON) as the upload grows."""
+    from starlette.datastructures import UploadFile
+    import uploads
+
+    async def read_chunks(path, size=64 * 1024):
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def legacy_multipart(video_path, out_path):
+        with open(video_path, "rb") as f, open(out_path, "wb") as out:
+            out.write(f.read())
+
+    def legacy_base64(body_path, out_path):
+        with open(body_path, "rb") as f:
+            body = json.loads(f.read())
+        with open(out_path, "wb") as out:
+            out.write(base64.b64decode(body["video_base64"]))
+
+    def streamed_multipart(video_path, out_path):
+        upload = UploadFile(file=open(video_path, "rb"), size=os.path.getsize(video_path), filename="upload.mp4")
+        try:
+            asyncio.run(uploads.save_upload_file(upload, out_path, max_bytes=1 << 40))
+        finally:
+            upload.file.close()
+
+    def streamed_base64(body_path, out_path):
+        asyncio.run(uploads.save_base64_json_body(read_chunks(body_path), out_path, max_bytes=1 << 40))
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    print(f"[BENCH] Peak Python memory (MB) while receiving an upload, by upload size\n")
+    print(f"{'size (MB)':>10} {'multipart':>10} {'streamed':>10} {'base64':>10} {'streamed':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_path = os.path.join(tmp_dir, "out.mp4")
+        for size_mb in sizes:
+            video_path, body_path = _write_upload_files(tmp_dir, size_mb)
+            row = []
+            for fn, path in ((legacy_multipart, video_path), (streamed_multipart, video_path),
+                             (legacy_base64, body_path), (streamed_base64, body_path)):
+                if fn in (legacy_multipart, legacy_base64) and size_mb > args.legacy_max:
+                    row.append("skipped")
+                    continue
+                row.append(f"{_peak_memory_mb(lambda: fn(path, out_path)):.1f}")
+            print(f"{size_mb:>10} {row[0]:>10} {row[1]:>10} {row[2]:>10} {row[3]:>10}")
+            os.unlink(video_path)
+            os.unlink(body_path)
+    print(f"\n[BENCH] multipart / base64: previous handlers (whole upload in memory); streamed: uploads.py")
+
+
+def bench_connections(args):
+    """
+    TLS connections opened and wall time for several videos against a local HTTPS mock: a new
+    OpenAI client per video and requests.post per Dust call (the previous behaviour) vs the
+    shared pooled clients from clients.py.
+    """
+    import requests
+    import clients
+    from mock_servers import BackgroundServer, create_openai_app, make_self_signed_cert
+
+    frame_base64, size_kb = sample.encode_frame_to_base64(make_synthetic_frame(320, 240), jpeg_quality=70)
+    encoded_frames = [(second, frame_base64, size_kb, None) for second in range(args.frames)]
+    request_body = sample._frame_request(PROMPT, frame_base64, 0)
+
+    def analyze_videos(make_client):
+        for _ in range(args.videos):
+            client = make_client()
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                sample._analyze_encoded_frames(executor, client, encoded_frames, PROMPT, total=args.frames, verbose=False)
+
+    async def post_shared(url, certfile):
+        async with clients.make_dust_client(verify=certfile) as client:
+            for _ in range(args.videos):
+                (await client.post(url, json=request_body)).raise_for_status()
+
+    def post_fresh(url, certfile):
+        for _ in range(args.videos):
+            requests.post(url, json=request_body, verify=certfile, timeout=30).raise_for_status()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        certfile, keyfile = make_self_signed_cert(tmp_dir)
+        print(f"[BENCH] {args.videos} videos x {args.frames} frames, {args.workers} workers, "
+              f"HTTPS mock with {args.latency}s latency\n")
+        print(f"{'method':<40} {'time (s)':>9} {'connections':>12}")
+        shared = clients.make_openai_client(verify=certfile)
+        runs = [
+            ("OpenAI: new client per video", lambda: analyze_videos(lambda: clients.make_openai_client(verify=certfile))),
+            ("OpenAI: shared pooled client", lambda: analyze_videos(lambda: shared)),
+            ("Dust: requests.post per call", lambda: post_fresh(url, certfile)),
+            ("Dust: shared pooled client", lambda: asyncio.run(post_shared(url, certfile))),
+        ]
+        for name, run in runs:
+            app = create_openai_app(latency=args.latency, jitter=0, max_concurrency=1000, rpm=1_000_000)
+            with BackgroundServer(app, port=args.port, ssl_certfile=certfile, ssl_keyfile=keyfile) as server:
+                os.environ["OPENAI_BASE_URL"] = f"{server.url}/v1"
+                url = f"{server.url}/v1/chat/completions"
+                shared.base_url = f"{server.url}/v1"
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+            print(f"{name:<40} {elapsed:>9.2f} {len(app.state.connections):>12}")
+        shared.close()
+
+
+def bench_ratelimit(args):
+    """
+    Frames lost, 429s and wall time against the rate-limited mock OpenAI server: a fixed thread
+    pool relying on the SDK's own retries (the previous behaviour) vs the RateLimiter at a fixed
+    and at an adaptive concurrency.
+    """
+    from openai import OpenAI
+    from mock_servers import BackgroundServer, create_openai_app
+    from ratelimit import RateLimiter
+
+    frame_base64, size_kb = sample.encode_frame_to_base64(make_synthetic_frame(320, 240), jpeg_quality=70)
+    encoded_frames = [(second, frame_base64, size_kb, None) for second in range(args.frames)]
+    print(f"[BENCH] {args.frames} frames against a mock allowing {args.server_concurrency} concurrent requests, "
+          f"{args.rpm} rpm, {args.latency}s latency, {args.error_rate:.0%} injected errors\n")
+
+    configs = [
+        (f"pool {args.workers}, SDK retries", None),
+        (f"limiter, max {args.workers}", lambda: RateLimiter(args.workers, args.workers)),
+        (f"limiter {args.workers}..{args.max_concurrency}", lambda: RateLimiter(args.workers, args.max_concurrency)),
+    ]
+    print(f"{'method':<26} {'time (s)':>9} {'ok':>5} {'failed':>7} {'429s':>6} {'retries':>8} {'limit':>6}")
+    for name, make_limiter in configs:
+        limiter = make_limiter() if make_limiter else None
+        app = create_openai_app(
+            latency=args.latency, jitter=args.latency / 4, max_concurrency=args.server_concurrency,
+            rpm=args.rpm, error_rate=args.error_rate
+        )
+        with BackgroundServer(app, port=args.port) as server:
+            client = OpenAI(api_key="test", base_url=f"{server.url}/v1", max_retries=0 if limiter else 2)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=limiter.max_concurrency if limiter else args.workers) as executor:
+                results, stats = sample._analyze_encoded_frames(
+                    executor, client, encoded_frames, PROMPT, total=len(encoded_frames),
+                    limiter=limiter, verbose=False
+                )
+            elapsed = time.perf_counter() - start
+        limiter_stats = limiter.stats() if limiter else {}
+        print(f"{name:<26} {elapsed:>9.2f} {stats['successful_calls']:>5} {stats['failed_calls']:>7} "
+              f"{app.state.stats['429']:>6} {limiter_stats.get('retries', 'n/a'):>8} "
+              f"{limiter_stats.get('concurrency_limit', args.workers):>6.1f}")
+
+
+def bench_resume(args):
+    """
+    Kill a `sample.py` run part-way through a video, then run it again with --resume, both against
+    the mock OpenAI server. Counts the API calls of each run and how many frames the resumed run
+    asked for again although the killed run had already checkpointed them (should be 0).
+    """
+    from checkpoint import load_results
+    from mock_servers import BackgroundServer, create_openai_app
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample.py")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = os.path.join(tmp_dir, "resume.mp4")
+        make_synthetic_video(video_path, seconds=args.seconds, fps=10, width=320, height=240)
+        checkpoint_dir = os.path.join(tmp_dir, "checkpoints")
+        app = create_openai_app(latency=args.latency, jitter=args.latency / 4, max_concurrency=1000, rpm=1_000_000)
+        with BackgroundServer(app, port=args.port) as server:
+            env = dict(os.environ, OPENAI_BASE_URL=f"{server.url}/v1", OPENAI_API_KEY="test")
+            command = [sys.executable, script, video_path, "--max-concurrency", str(args.workers), "--checkpoint-dir", checkpoint_dir]
+            print(f"[BENCH] {args.seconds:g}s video, killing the first run after {args.kill_after} answered API calls\n")
+
+            first = subprocess.Popen(command, cwd=tmp_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            while sum(app.state.seconds.values()) < args.kill_after and first.poll() is None:
+                time.sleep(0.01)
+            first.send_signal(signal.SIGKILL)
+            first.wait()
+            time.sleep(2 * args.latency)  # Requests in flight at the kill still reach the mock
+            killed_calls = app.state.seconds.copy()
+            checkpointed = {}
+            for name in os.listdir(checkpoint_dir):
+                checkpointed.update(load_results(os.path.join(checkpoint_dir, name)))
+
+            start = time.perf_counter()
+            subprocess.run(command + ["--resume"], cwd=tmp_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            elapsed = time.perf_counter() - start
+            resumed_calls = app.state.seconds - killed_calls
+
+        with open(os.path.join(tmp_dir, "output", "resume.json"), encoding="utf-8") as f:
+            saved = json.load(f)
+        repeated = sum(resumed_calls[second] for second in checkpointed)
+        print(f"{'run':<14} {'API calls':>10} {'time (s)':>9}")
+        print(f"{'killed':<14} {sum(killed_calls.values()):>10} {'':>9}")
+        print(f"{'resumed':<14} {sum(resumed_calls.values()):>10} {elapsed:>9.2f}")
+        print(f"\n[BENCH] Frames checkpointed before the kill: {len(checkpointed)} "
+              f"({sum(killed_calls.values()) - len(checkpointed)} answers lost in flight)")
+        print(f"[BENCH] Checkpointed frames analyzed again on resume: {repeated}")
+        print(f"[BENCH] Frames in the final results: {len(saved)} of {int(args.seconds)}; checkpoint removed: {not os.listdir(checkpoint_dir)}")
+        return 1 if repeated else 0
+
+
+def bench_batch(args):
+    """
+    Run `sample.py --batch-api` over generated videos against a mock whose batches expire after
+    answering part of their requests, then run it again against one that answers them all, like
+    a resumed run after an outage. Counts the requests of each round, how many of the second
+    round's had already been answered (should be 0) and the frames in the final results.
+    """
+    from mock_servers import BackgroundServer, create_openai_app
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample.py")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_dir = os.path.join(tmp_dir, "videos")
+        os.makedirs(video_dir)
+        for number in range(args.videos):
+            make_synthetic_video(os.path.join(video_dir, f"batch{number}.mp4"), seconds=args.seconds, fps=10, width=320, height=240)
+        command = [sys.executable, script, video_dir, "--batch-api", "--batch-dir", os.path.join(tmp_dir, "batches"), "--poll-interval", "0.1"]
+        print(f"[BENCH] {args.videos} videos of {args.seconds:g}s; the first round's batches expire after "
+              f"{args.expire_fraction:.0%} of their requests, {args.error_rate:.0%} injected errors\n")
+
+        rounds = []
+        for name, expire_fraction in (("expiring", args.expire_fraction), ("resumed", None)):
+            app = create_openai_app(error_rate=args.error_rate, batch_latency=args.latency, batch_expire_fraction=expire_fraction)
+            with BackgroundServer(app, port=args.port) as server:
+                env = dict(os.environ, OPENAI_BASE_URL=f"{server.url}/v1", OPENAI_API_KEY="test")
+                start = time.perf_counter()
+                subprocess.run(command, cwd=tmp_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+                elapsed = time.perf_counter() - start
+            submitted = app.state.stats['batch_requests']
+            answered = sum(app.state.seconds.values())
+            rounds.append((name, submitted, answered, elapsed))
+
+        saved = 0
+        for number in range(args.videos):
+            with open(os.path.join(tmp_dir, "output", f"batch{number}.json"), encoding="utf-8") as f:
+                saved += len(json.load(f))
+        print(f"{'round':<10} {'submitted':>10} {'answered':>9} {'time (s)':>9}")
+        for name, submitted, answered, elapsed in rounds:
+            print(f"{name:<10} {submitted:>10} {answered:>9} {elapsed:>9.2f}")
+        repeated = rounds[1][1] - (rounds[0][1] - rounds[0][2])
+        print(f"\n[BENCH] Requests resubmitted although answered: {repeated}")
+        print(f"[BENCH] Frames in the final results: {saved} of {args.videos * int(args.seconds)}")
+        return 1 if repeated else 0
+
+
+PIPELINE_MODES = ['phased', 'streaming', 'api']
+PIPELINE_RESULTS_DIR = os.path.join(".cache", "benchmarks")  # Default place for pipeline results
+# Metrics compared against a baseline: (path in a mode's summary, True if higher is better)
+REGRESSION_METRICS = [
+    ("wall_s", False),
+    ("frames_per_s", True),
+    ("peak_rss_mb", False),
+    ("latency_ms.p50", False),
+    ("latency_ms.p95", False),
+    ("latency_ms.p99", False),
+]
+MIN_TIME_CHANGE_S = 0.05  # Smaller changes of wall / stage times are noise, not regressions
+
+
+def _rss_mb():
+    """Current resident set size of this process in MB, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class PeakRss:
+    """
+    Peak resident set size of this process while the with block runs, sampled every interval
+    seconds from /proc. Where /proc is not available, the peak over the process lifetime
+    (getrusage) is reported instead.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+
+    def _sample(self):
+        while True:
+            rss = _rss_mb()
+            if rss is not None:
+                self.peak_mb = max(self.peak_mb or 0, rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        if self.peak_mb is None:
+            import resource
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak_mb = max_rss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+
+def _percentiles_ms(seconds):
+    """p50 / p95 / p99 of a list of durations in seconds, in milliseconds."""
+    if not seconds:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(np.array(seconds) * 1000, [50, 95, 99])
+    return {"p50": round(float(p50), 1), "p95": round(float(p95), 1), "p99": round(float(p99), 1)}
+
+
+def _frame_metrics(results):
+    """Frame counts and per-frame latency (submitted to parsed answer, rate limiter waits and retries included)."""
+    return {
+        "frames": len(results),
+        "failed_frames": sum(1 for result in results if not result.get('success')),
+        "escalated_frames": sum(1 for result in results if result.get('escalated')),
+        "reasked_frames": sum(1 for result in results if result.get('reasked')),
+        "tokens": sum(result.get('tokens_used') or 0 for result in results),
+        "cached_tokens": sum(result.get('cached_tokens') or 0 for result in results),
+        "latency_ms": _percentiles_ms([result['elapsed_time'] for result in results if result.get('success')]),
+    }
+
+
+async def _summarize(results):
+    """Dust summary of the results through the API's code path; returns (seconds, error message or None)."""
+    import api
+    start = time.perf_counter()
+    try:
+        await api.summarize_with_dust(results)
+        return time.perf_counter() - start, None
+    except Exception as e:
+        return time.perf_counter() - start, str(getattr(e, 'detail', e))
+
+
+def _run_phased(video_path, args):
+    """process_video's phases one after the other (decode, encode, analyze, save), then the Dust summary, each timed."""
+    from ratelimit import RateLimiter
+    import clients
+
+    stages = {}
+    start = time.perf_counter()
+    frames, _ = sample.extract_frames(video_path, verbose=False)
+    stages["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encoded_frames = []
+    for second, frame in frames:
+        frame_base64, size_kb = sample.encode_frame_to_base64(frame, args.max_dimension, args.jpeg_quality)
+        encoded_frames.append((second, frame_base64, size_kb, None))
+    del frames
+    stages["encode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    limiter = RateLimiter(args.workers, args.max_concurrency)
+    router = sample.ModelRouter(args.routing_model) if args.routing_model else None
+    with ThreadPoolExecutor(max_workers=limiter.max_concurrency) as executor:
+        results, _ = sample._analyze_encoded_frames(
+            executor, clients.get_openai_client(), encoded_frames, PROMPT,
+            total=len(encoded_frames), limiter=limiter, router=router,
+            structured=args.structured_output, reask_budget=args.reask_budget, verbose=False
+        )
+    stages["analyze"] = time.perf_counter() - start
+    del encoded_frames
+
+    start = time.perf_counter()
+    results.sort(key=lambda x: x['second'])
+    sample.save_json_results(results, video_path)
+    stages["save"] = time.perf_counter() - start
+
+    stages["summarize"], dust_error = asyncio.run(_summarize(results))
+    return dict(_frame_metrics(results), stages_s=stages, dust_error=dust_error)
+
+
+def _run_streaming(video_path, args):
+    """process_video in streaming mode (decode, encode and analyze overlap), then the Dust summary."""
+    from ratelimit import RateLimiter
+
+    start = time.perf_counter()
+    results = sample.process_video(
+        video_path, PROMPT, max_workers=args.workers, verbose=False, streaming=True,
+        max_dimension=args.max_dimension, jpeg_quality=args.jpeg_quality,
+        rate_limiter=RateLimiter(args.workers, args.max_concurrency), routing_model=args.routing_model,
+        structured_output=args.structured_output, reask_budget=args.reask_budget
+    )
+    stages = {"process_video": time.perf_counter() - start}
+    stages["summarize"], dust_error = asyncio.run(_summarize(results))
+    return dict(_frame_metrics(results), stages_s=stages, dust_error=dust_error)
+
+
+async def _post_analyze_stream(url, video_path, args):
+    """Upload a video to POST /analyze/stream and time the NDJSON events."""
+    import httpx
+
+    params = {"max_workers": args.workers, "max_concurrency": args.max_concurrency, "jpeg_quality": args.jpeg_quality,
+              "structured_output": args.structured_output}
+    if args.max_dimension:
+        params["max_dimension"] = args.max_dimension
+    metrics = {"frames": 0, "failed_frames": 0, "dust_error": None}
+    stages = {}
+    start = time.perf_counter()
+    async with httpx.AsyncClient(timeout=None) as http:
+        with open(video_path, "rb") as f:
+            files = {"file": (os.path.basename(video_path), f, "video/mp4")}
+            async with http.stream("POST", f"{url}/analyze/stream", params=params, files=files) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    if event["event"] in ("frame", "frame_error"):
+                        stages.setdefault("first_frame", time.perf_counter() - start)
+                        metrics["frames"] += 1
+                        metrics["failed_frames"] += event["event"] == "frame_error"
+                    elif event["event"] == "error":
+                        metrics["dust_error"] = str(event["data"])
+    stages["request"] = time.perf_counter() - start
+    # Per-frame latencies are not part of the event stream
+    return dict(metrics, stages_s=stages, latency_ms=_percentiles_ms([]))
+
+
+def _run_api(video_path, args):
+    """The FastAPI app in this process: upload, analysis, Dust summary, streamed back as NDJSON."""
+    import api
+    from mock_servers import BackgroundServer
+
+    with BackgroundServer(api.app, port=args.port + 2) as server:
+        return asyncio.run(_post_analyze_stream(server.url, video_path, args))
+
+
+@contextlib.contextmanager
+def _quiet(enabled=True):
+    """Swallow the pipeline's own progress output while a benchmark run is timed."""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+def _median_summary(runs):
+    """Median of every numeric metric over the runs of one mode (nested dicts are merged the same way)."""
+    summary = {}
+    for key, value in runs[0].items():
+        if isinstance(value, dict):
+            summary[key] = _median_summary([run[key] for run in runs])
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values = [run[key] for run in runs if run.get(key) is not None]
+            summary[key] = round(float(np.median(values)), 4) if values else None
+        else:
+            summary[key] = next((run[key] for run in runs if run.get(key) is not None), None)
+    return summary
+
+
+def _metric(summary, path):
+    for key in path.split("."):
+        summary = (summary or {}).get(key)
+    return summary
+
+
+def _compare_to_baseline(report, baseline, tolerance):
+    """Print the metrics that got worse than in baseline by more than tolerance; returns how many did."""
+    if baseline.get("config") != report["config"]:
+        print("[BENCH] WARNING: the baseline was recorded with different settings; differences may not be regressions")
+    regressions = 0
+    print(f"\n{'mode':<10} {'metric':<22} {'baseline':>10} {'now':>10} {'change':>8}")
+    for mode, summary in report["modes"].items():
+        previous = baseline.get("modes", {}).get(mode)
+        if previous is None:
+            continue
+        paths = [path for path, _ in REGRESSION_METRICS] + [f"stages_s.{stage}" for stage in summary.get("stages_s", {})]
+        for path in paths:
+            higher_is_better = dict(REGRESSION_METRICS).get(path, False)
+            old, new = _metric(previous, path), _metric(summary, path)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            is_time = path == "wall_s" or path.startswith("stages_s.")
+            flag = "  REGRESSION" if worse > tolerance and not (is_time and abs(new - old) < MIN_TIME_CHANGE_S) else ""
+            regressions += bool(flag)
+            print(f"{mode:<10} {path:<22} {old:>10.3f} {new:>10.3f} {change:>+7.0%}{flag}")
+    return regressions
+
+
+def bench_pipeline(args):
+    """
+    The whole pipeline against the mock OpenAI and Dust servers (run in this process, with the
+    configured latency and error rates) on a generated video: phased (each stage timed on its
+    own), streaming process_video, and the API's /analyze/stream endpoint. Reports wall time per
+    stage, frames per second, peak RSS and per-frame latency percentiles, writes them as JSON
+    (medians over the runs), and with --baseline flags metrics that got worse than in an earlier
+    result file by more than --tolerance (exit code 1).
+    """
+    import random
+    from mock_servers import BackgroundServer, create_dust_app, create_openai_app
+
+    modes = args.modes.split(",")
+    unknown = [mode for mode in modes if mode not in PIPELINE_MODES]
+    if unknown:
+        print(f"[BENCH] Unknown mode(s): {', '.join(unknown)}. Supported: {', '.join(PIPELINE_MODES)}")
+        return 2
+    output = os.path.abspath(args.output or os.path.join(
+        PIPELINE_RESULTS_DIR, f"pipeline-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json"))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    random.seed(args.seed)  # Latency jitter and injected errors of the mocks
+
+    # The pipeline's clients and the API module read their endpoints from the environment
+    os.environ.update({
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.port}/v1", "OPENAI_API_KEY": "test",
+        "DUST_API_BASE": f"http://127.0.0.1:{args.port + 1}", "API_KEY": "test",
+        "WORKSPACE_ID": "bench", "HEALTH_AGENT_ID": "bench",
+    })
+    openai_app = create_openai_app(
+        latency=args.openai_latency, jitter=args.openai_latency / 4, max_concurrency=args.server_concurrency,
+        rpm=1_000_000, error_rate=args.openai_error_rate, malformed_rate=args.openai_malformed_rate,
+        prompt_cache_min_tokens=args.prompt_cache_min_tokens,
+        models={args.routing_model: {"latency": args.routing_latency, "noise_rate": args.routing_noise}} if args.routing_model else None
+    )
+    sample.ROUTING_MODEL = args.routing_model  # Read by the API's analysis at call time
+    sample.REASK_BUDGET = args.reask_budget
+    dust_app = create_dust_app(latency=args.dust_latency, token_delay=0.01, error_rate=args.dust_error_rate)
+    runners = {"phased": _run_phased, "streaming": _run_streaming, "api": _run_api}
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = os.path.join(tmp_dir, "pipeline.mp4")
+        print(f"[BENCH] Generating {args.seconds:g}s synthetic video at {args.fps:g} fps ({args.width}x{args.height})...")
+        make_synthetic_video(video_path, args.seconds, args.fps, args.width, args.height)
+        print(f"[BENCH] Mock OpenAI: {args.openai_latency:g}s latency, {args.openai_error_rate:.0%} errors, {args.openai_malformed_rate:.0%} malformed, "
+              f"{args.server_concurrency} concurrent; mock Dust: {args.dust_latency:g}s latency, {args.dust_error_rate:.0%} errors")
+        if args.routing_model:
+            print(f"[BENCH] Routing through {args.routing_model}: {args.routing_latency:g}s latency, {args.routing_noise:.0%} wrong answers")
+        print(f"[BENCH] {args.workers}..{args.max_concurrency} concurrent API calls, median of {args.runs} run(s)\n")
+
+        os.chdir(tmp_dir)  # Results, job store and checkpoints of the runs stay in the temporary directory
+        report_modes = {}
+        try:
+            with BackgroundServer(openai_app, port=args.port), BackgroundServer(dust_app, port=args.port + 1):
+                print(f"{'mode':<10} {'wall (s)':>9} {'frames':>7} {'failed':>7} {'frames/s':>9} {'peak RSS MB':>12} "
+                      f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  stages (s)")
+                for mode in modes:
+                    runs = []
+                    for _ in range(args.runs):
+                        requests_before = openai_app.state.stats['requests']
+                        conversations_before = dust_app.state.stats['conversations']
+                        start = time.perf_counter()
+                        with _quiet(not args.verbose), PeakRss() as rss:
+                            run = runners[mode](video_path, args)
+                        run["wall_s"] = time.perf_counter() - start
+                        run["frames_per_s"] = run["frames"] / run["wall_s"]
+                        run["peak_rss_mb"] = rss.peak_mb
+                        run["openai_requests"] = openai_app.state.stats['requests'] - requests_before
+                        run["dust_conversations"] = dust_app.state.stats['conversations'] - conversations_before
+                        runs.append(run)
+                    summary = _median_summary(runs)
+                    report_modes[mode] = summary
+                    latency = summary["latency_ms"]
+                    stages = ", ".join(f"{stage} {seconds:.2f}" for stage, seconds in summary["stages_s"].items())
+                    print(f"{mode:<10} {summary['wall_s']:>9.2f} {summary['frames']:>7.0f} {summary['failed_frames']:>7.0f} "
+                          f"{summary['frames_per_s']:>9.1f} {summary['peak_rss_mb']:>12.1f} "
+                          + " ".join(f"{latency[p]:>8.0f}" if latency[p] is not None else f"{'-':>8}" for p in ("p50", "p95", "p99"))
+                          + f"  {stages}" + (f"  (escalated: {summary['escalated_frames']:.0f})" if args.routing_model and "escalated_frames" in summary else "")
+                          + (f"  (re-asked: {summary['reasked_frames']:.0f})" if summary.get("reasked_frames") else "")
+                          + (f"  (cached tokens: {summary['cached_tokens']:.0f} of {summary['tokens']:.0f})" if summary.get("cached_tokens") else "")
+                          + (f"  (Dust failed: {summary['dust_error']})" if summary.get("dust_error") else ""))
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        "benchmark": "pipeline",
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "cpus": os.cpu_count(),
+        "config": {key: getattr(args, key) for key in (
+            "seconds", "fps", "width", "height", "max_dimension", "jpeg_quality", "workers", "max_concurrency",
+            "server_concurrency", "openai_latency", "openai_error_rate", "openai_malformed_rate", "structured_output", "reask_budget", "prompt_cache_min_tokens",
+            "dust_latency", "dust_error_rate",
+            "routing_model", "routing_latency", "routing_noise", "runs", "seed")},
+        "modes": report_modes,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n[BENCH] Results written to {output}")
+
+    if baseline is not None:
+        regressions = _compare_to_baseline(report, baseline, args.tolerance)
+        print(f"\n[BENCH] {regressions} metric(s) worse than the baseline by more than {args.tolerance:.0%}")
+        return 1 if regressions else 0
+
+
+def _git_commit():
+    """Commit of the benchmarked tree, if it is a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the video analysis pipeline.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    decode = subparsers.add_parser("decode", help="Frame extraction: legacy read loop vs samplers")
+    decode.add_argument("--video", help="Benchmark this video instead of a generated one")
+    decode.add_argument("--seconds", type=float, default=60)
+    decode.add_argument("--fps", type=float, default=29.97, help="Frame rate of the generated video")
+    decode.add_argument("--width", type=int, default=1280)
+    decode.add_argument("--height", type=int, default=720)
+    decode.add_argument("--sample-fps", type=float, default=1, help="Frames to keep per second of video")
+    decode.add_argument("--repeat", type=int, default=3)
+    decode.set_defaults(func=bench_decode)
+
+    parallel_decode = subparsers.add_parser("parallel-decode", help="Decode throughput against the number of decoding processes")
+    parallel_decode.add_argument("--video", help="Benchmark this video instead of a generated one")
+    parallel_decode.add_argument("--seconds", type=float, default=300)
+    parallel_decode.add_argument("--fps", type=float, default=29.97, help="Frame rate of the generated video")
+    parallel_decode.add_argument("--width", type=int, default=1920)
+    parallel_decode.add_argument("--height", type=int, default=1080)
+    parallel_decode.add_argument("--sampler", choices=sample.SAMPLERS, default=sample.DEFAULT_SAMPLER)
+    parallel_decode.add_argument("--workers", default=",".join(str(w) for w in [1, 2, 4, 8] if w == 1 or w <= 2 * (os.cpu_count() or 1)),
+                                 help="Comma separated process counts; the first is the reference")
+    parallel_decode.add_argument("--repeat", type=int, default=1)
+    parallel_decode.set_defaults(func=bench_parallel_decode)
+
+    ffmpeg_decode = subparsers.add_parser("ffmpeg-decode", help="API-ready frames: OpenCV vs ffmpeg pipe (raw frames or MJPEG)")
+    ffmpeg_decode.add_argument("--video", help="Benchmark this video instead of a generated one")
+    ffmpeg_decode.add_argument("--seconds", type=float, default=120)
+    ffmpeg_decode.add_argument("--fps", type=float, default=29.97, help="Frame rate of the generated video")
+    ffmpeg_decode.add_argument("--width", type=int, default=1920)
+    ffmpeg_decode.add_argument("--height", type=int, default=1080)
+    ffmpeg_decode.add_argument("--max-dimension", type=int, default=768, help="Downscale frames to this size (0 = full resolution)")
+    ffmpeg_decode.add_argument("--jpeg-quality", type=int, default=sample.JPEG_QUALITY)
+    ffmpeg_decode.add_argument("--repeat", type=int, default=1)
+    ffmpeg_decode.set_defaults(func=bench_ffmpeg_decode)
+
+    encode = subparsers.add_parser("encode", help="Frame encoding: bytes, image tokens and latency per setting")
+    encode.add_argument("--video", help="Take frames from this video instead of generating them")
+    encode.add_argument("--width", type=int, default=3840)
+    encode.add_argument("--height", type=int, default=2160)
+    encode.add_argument("--frames", type=int, default=5)
+    encode.add_argument("--max-dimensions", default="2048,1024,768,512", help="Comma separated (full resolution is always included)")
+    encode.add_argument("--qualities", default="95,85,70")
+    encode.add_argument("--details", default="low,high")
+    encode.add_argument("--live", type=int, default=0, help="Also make this many real OpenAI calls per setting (costs money)")
+    encode.set_defaults(func=bench_encode)
+
+    upload = subparsers.add_parser("upload", help="Peak memory of receiving uploads: whole-body reads vs streaming")
+    upload.add_argument("--sizes", default="16,64,256", help="Comma separated upload sizes in MB")
+    upload.add_argument("--legacy-max", type=int, default=512, help="Skip the whole-body variants above this size (MB)")
+    upload.set_defaults(func=bench_upload)
+
+    connections = subparsers.add_parser("connections", help="Connection reuse: per-call clients vs shared pooled clients against a local HTTPS mock")
+    connections.add_argument("--videos", type=int, default=10, help="Videos (and Dust calls) to simulate")
+    connections.add_argument("--frames", type=int, default=20, help="Frames per video")
+    connections.add_argument("--workers", type=int, default=sample.MAX_WORKERS)
+    connections.add_argument("--latency", type=float, default=0.02, help="Mock seconds per request")
+    connections.add_argument("--port", type=int, default=8012)
+    connections.set_defaults(func=bench_connections)
+
+    ratelimit = subparsers.add_parser("ratelimit", help="Fixed thread pool vs adaptive rate limiter against the mock OpenAI server")
+    ratelimit.add_argument("--frames", type=int, default=200)
+    ratelimit.add_argument("--workers", type=int, default=sample.MAX_WORKERS, help="Fixed / starting concurrency")
+    ratelimit.add_argument("--max-concurrency", type=int, default=sample.MAX_CONCURRENCY)
+    ratelimit.add_argument("--server-concurrency", type=int, default=8, help="Concurrent requests the mock accepts before answering 429")
+    ratelimit.add_argument("--rpm", type=int, default=6000, help="Requests per minute the mock accepts")
+    ratelimit.add_argument("--latency", type=float, default=0.2, help="Mock seconds per request")
+    ratelimit.add_argument("--error-rate", type=float, default=0.05, help="Fraction of requests the mock fails at random")
+    ratelimit.add_argument("--port", type=int, default=8011)
+    ratelimit.set_defaults(func=bench_ratelimit)
+
+    resume = subparsers.add_parser("resume", help="Kill a CLI run part-way and resume it: API calls repeated for checkpointed frames")
+    resume.add_argument("--seconds", type=float, default=60, help="Length of the generated video")
+    resume.add_argument("--kill-after", type=int, default=25, help="Answered API calls after which the first run is killed")
+    resume.add_argument("--workers", type=int, default=sample.MAX_WORKERS, help="Concurrent API calls")
+    resume.add_argument("--latency", type=float, default=0.1, help="Mock seconds per request")
+    resume.add_argument("--port", type=int, default=8013)
+    resume.set_defaults(func=bench_resume)
+
+    batch = subparsers.add_parser("batch", help="Batch API mode: a run whose batches expire part-way, then resumed")
+    batch.add_argument("--videos", type=int, default=3, help="Generated videos in the run")
+    batch.add_argument("--seconds", type=float, default=20, help="Length of each generated video")
+    batch.add_argument("--expire-fraction", type=float, default=0.6, help="Fraction of requests the first round's batches answer before expiring")
+    batch.add_argument("--error-rate", type=float, default=0.05, help="Fraction of batch requests the mock fails at random")
+    batch.add_argument("--latency", type=float, default=0.5, help="Mock seconds before a batch is answered")
+    batch.add_argument("--port", type=int, default=8014)
+    batch.set_defaults(func=bench_batch)
+
+    pipeline = subparsers.add_parser("pipeline", help="End-to-end pipeline against mock OpenAI and Dust servers, with JSON results")
+    pipeline.add_argument("--seconds", type=float, default=60, help="Length of the generated video")
+    pipeline.add_argument("--fps", type=float, default=30, help="Frame rate of the generated video")
+    pipeline.add_argument("--width", type=int, default=1280)
+    pipeline.add_argument("--height", type=int, default=720)
+    pipeline.add_argument("--max-dimension", type=int, default=sample.MAX_FRAME_DIMENSION, help="Downscale frames sent to the API (default: full resolution)")
+    pipeline.add_argument("--jpeg-quality", type=int, default=sample.JPEG_QUALITY)
+    pipeline.add_argument("--modes", default=",".join(PIPELINE_MODES), help=f"Comma separated, of: {', '.join(PIPELINE_MODES)}")
+    pipeline.add_argument("--workers", type=int, default=sample.MAX_WORKERS, help="Concurrent API calls to start with")
+    pipeline.add_argument("--max-concurrency", type=int, default=sample.MAX_CONCURRENCY)
+    pipeline.add_argument("--openai-latency", type=float, default=0.3, help="Mock OpenAI seconds per request (+/- 25%% jitter)")
+    pipeline.add_argument("--openai-error-rate", type=float, default=0.02, help="Fraction of OpenAI requests failed at random (429 or 500)")
+    pipeline.add_argument("--openai-malformed-rate", type=float, default=0.0, help="Fraction of mock OpenAI answers given as prose with broken JSON (not with structured outputs)")
+    pipeline.add_argument("--structured-output", action="store_true", help="Ask for answers in the prompt's JSON schema")
+    pipeline.add_argument("--reask-budget", type=int, default=sample.REASK_BUDGET, help="Re-ask requests per run for frames that still failed (0 = off)")
+    pipeline.add_argument("--prompt-cache-min-tokens", type=int, default=1024, help="Shortest repeated prompt prefix the mock reports as cached tokens (OpenAI: 1024)")
+    pipeline.add_argument("--server-concurrency", type=int, default=16, help="Concurrent requests the OpenAI mock accepts before answering 429")
+    pipeline.add_argument("--dust-latency", type=float, default=1.0, help="Mock Dust seconds before the agent answers")
+    pipeline.add_argument("--dust-error-rate", type=float, default=0.0, help="Fraction of Dust answers failed at random")
+    pipeline.add_argument("--routing-model", help="Send frames to this cheaper model first, escalating doubtful answers (default: off)")
+    pipeline.add_argument("--routing-latency", type=float, default=0.15, help="Mock seconds per request to the routing model")
+    pipeline.add_argument("--routing-noise", type=float, default=0.1, help="Fraction of frames the routing model answers wrongly")
+    pipeline.add_argument("--runs", type=int, default=3, help="Runs per mode; the results are their medians")
+    pipeline.add_argument("--seed", type=int, default=0, help="Seed for the mocks' jitter and injected errors")
+    pipeline.add_argument("--port", type=int, default=8021, help="Mock OpenAI port; Dust and the API use the next two")
+    pipeline.add_argument("--output", help=f"Where to write the JSON results (default: {PIPELINE_RESULTS_DIR}/pipeline-<time>.json)")
+    pipeline.add_argument("--baseline", help="Earlier JSON results to compare against")
+    pipeline.add_argument("--tolerance", type=float, default=0.2, help="Relative change counted as a regression (default: 0.2)")
+    pipeline.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+# Configuration
+FRAME_CACHE_DIR = os.getenv("FRAME_CACHE_DIR", ".cache")
+FRAME_CACHE_MAX_MB = float(os.getenv("FRAME_CACHE_MAX_MB", "256"))  # Evict least recently used entries above this size
+VIDEO_CACHE_MAX_MB = float(os.getenv("VIDEO_CACHE_MAX_MB", "256"))  # Likewise for whole-video results
+
+def perceptual_hash(frame, hash_size=8) -> str:
+    """
+    Difference hash (dHash) of an OpenCV frame as a hex string.
+    Frames that look the same (re-encodes, small compression differences) get the same hash.
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return np.packbits(bits).tobytes().hex()
+
+def frame_cache_key(frame_hash: str, prompt: str, model: str, settings: str = "") -> str:
+    """
+    Content address of one frame analysis: the frame's perceptual hash plus prompt and model.
+    settings distinguishes results produced with different request options (e.g. image detail).
+    """
+    digest = hashlib.sha256()
+    for part in (frame_hash, prompt, model, settings):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def video_cache_key(content_hash: str, prompt: str, model: str, settings: str = "") -> str:
+    """
+    Content address of a whole-video analysis: the SHA-256 of the uploaded file plus prompt,
+    model and the settings that change the results.
+    """
+    return frame_cache_key(content_hash, prompt, model, settings)
+
+class FrameCache:
+    """
+    Persistent per-frame analysis cache stored in SQLite, bounded in size with LRU eviction.
+    Safe to use from multiple threads.
+    """
+    TABLE = "frame_results"
+
+    def __init__(self, cache_dir: str = FRAME_CACHE_DIR, max_mb: float = FRAME_CACHE_MAX_MB):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, f"{self.TABLE}.sqlite")
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.TABLE} ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {self.TABLE}_lru ON {self.TABLE} (last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached result for key (and mark it recently used), or None."""
+        with self._lock:
+            row = self._conn.execute(f"SELECT value FROM {self.TABLE} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(f"UPDATE {self.TABLE} SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, result: Dict):
+        """Store a result and evict least recently used entries if the cache is over its size limit."""
+        value = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.TABLE} (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.TABLE}").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(f"SELECT key, size FROM {self.TABLE} ORDER BY last_access").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany(f"DELETE FROM {self.TABLE} WHERE key = ?", evicted)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries, size = self._conn.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.TABLE}").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'size_kb': size / 1024}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class VideoResultCache(FrameCache):
+    """
+    Persistent cache of whole-video results (per-frame results plus the Dust response), keyed by
+    video_cache_key, with the same size bound and LRU eviction as FrameCache.
+    """
+    TABLE = "video_results"
+
+    def __init__(self, cache_dir: str = FRAME_CACHE_DIR, max_mb: float = VIDEO_CACHE_MAX_MB):
+        super().__init__(cache_dir, max_mb)
@@ -0,0 +1,86 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Dict
+
+from cache import video_cache_key
+
+# Configuration
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", os.path.join(".cache", "checkpoints"))
+HASH_CHUNK_SIZE = 1024 * 1024  # Bytes read at a time when hashing a video
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file's content as a hex string, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_results(path: str) -> Dict[int, Dict]:
+    """
+    The successful results in a checkpoint file, by second (the last one wins if a second was
+    saved twice). A line cut short by a crash is skipped.
+    """
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(result, dict) and result.get('success') and 'second' in result:
+                results[result['second']] = result
+    return results
+
+class RunCheckpoint:
+    """
+    Append-only JSONL log of the frame results of one run, so a run that dies part-way can be
+    resumed without analyzing the finished seconds again. The file is named after the video's
+    content hash, the prompt, the model and the encoding settings, so a changed video or setting
+    never picks up old results. Each successful result is written (and flushed) as one line as
+    soon as it arrives.
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self, video_path: str, prompt: str, model: str, settings: str = "", checkpoint_dir: str = CHECKPOINT_DIR):
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        key = video_cache_key(file_sha256(video_path), prompt, model, settings)
+        self.path = os.path.join(checkpoint_dir, f"{key}.jsonl")
+        self._lock = threading.Lock()
+        self._file = None
+
+    def load(self) -> Dict[int, Dict]:
+        """The results saved so far, by second."""
+        return load_results(self.path)
+
+    def open(self, resume: bool = False):
+        """Start writing: append to the existing log when resuming, else start a new one."""
+        with self._lock:
+            self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+            if resume and self._file.tell() > 0:
+                # Terminate a line the crashed run left unfinished, so the next one is not joined to it
+                self._file.write("\n")
+
+    def append(self, result: Dict):
+        """Save a successful frame result."""
+        line = json.dumps(result, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        """Delete the log, once the run's results have been saved for good."""
+        self.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
@@ -0,0 +1,99 @@
+import os
+import threading
+from typing import Optional
+
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+# Configuration
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))  # Per client, across all hosts
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "32"))  # Idle connections kept open for reuse
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))  # Seconds an idle connection is kept
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "120"))  # Seconds per OpenAI request
+DUST_TIMEOUT = float(os.getenv("DUST_TIMEOUT", "180"))  # Seconds per Dust request
+
+def _openai_limits():
+    # The SDK ships its own httpx (or httpx2) build; take the Limits class from it
+    return type(openai.DEFAULT_CONNECTION_LIMITS)(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+
+def make_openai_client(**http_options) -> OpenAI:
+    """
+    OpenAI client on a connection pool sized by the HTTP_* settings. Retries are left to
+    ratelimit.RateLimiter. http_options go to the underlying HTTP client (e.g. verify).
+    """
+    return OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        max_retries=0,
+        timeout=OPENAI_TIMEOUT,
+        http_client=openai.DefaultHttpxClient(limits=_openai_limits(), **http_options)
+    )
+
+def make_async_openai_client(**http_options) -> AsyncOpenAI:
+    """Async version of make_openai_client."""
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        max_retries=0,
+        timeout=OPENAI_TIMEOUT,
+        http_client=openai.DefaultAsyncHttpxClient(limits=_openai_limits(), **http_options)
+    )
+
+def make_dust_client(**http_options) -> httpx.AsyncClient:
+    """HTTP client for the Dust API on a connection pool sized by the HTTP_* settings."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=DUST_TIMEOUT,
+        **http_options
+    )
+
+# Process-wide clients. The sync OpenAI client is created on first use (CLI and thread pool
+# workers); the async clients belong to an event loop and are opened and closed by the API's
+# lifespan, so they are None outside of the server.
+_lock = threading.Lock()
+_openai_client: Optional[OpenAI] = None
+_async_openai_client: Optional[AsyncOpenAI] = None
+_dust_client: Optional[httpx.AsyncClient] = None
+
+def get_openai_client() -> OpenAI:
+    """The shared sync OpenAI client, created on first use."""
+    global _openai_client
+    with _lock:
+        if _openai_client is None:
+            _openai_client = make_openai_client()
+        return _openai_client
+
+def get_async_openai_client() -> Optional[AsyncOpenAI]:
+    """The shared AsyncOpenAI client if open_async_clients has been called, else None."""
+    return _async_openai_client
+
+def get_dust_client() -> Optional[httpx.AsyncClient]:
+    """The shared Dust HTTP client if open_async_clients has been called, else None."""
+    return _dust_client
+
+def open_async_clients():
+    """Create the shared async clients; call from the event loop that will use them (e.g. at startup)."""
+    global _async_openai_client, _dust_client
+    _async_openai_client = make_async_openai_client()
+    _dust_client = make_dust_client()
+
+async def close_clients():
+    """Close all shared clients and their connections (e.g. at shutdown)."""
+    global _openai_client, _async_openai_client, _dust_client
+    if _async_openai_client is not None:
+        await _async_openai_client.close()
+        _async_openai_client = None
+    if _dust_client is not None:
+        await _dust_client.aclose()
+        _dust_client = None
+    with _lock:
+        if _openai_client is not None:
+            _openai_client.close()
+            _openai_client = None
@@ -0,0 +1,166 @@
+import os
+import json
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+# Configuration
+DUST_MODE = os.getenv("DUST_MODE", "stream")  # "stream" the agent message events, or "poll" the conversation
+DUST_DEADLINE = float(os.getenv("DUST_DEADLINE", "180"))  # Seconds to wait for the agent's answer
+DUST_POLL_INTERVAL = float(os.getenv("DUST_POLL_INTERVAL", "2"))  # Seconds between polls in poll mode
+DUST_MODES = ['stream', 'poll']
+
+# Agent message events that end the answer
+TERMINAL_EVENTS = ('agent_message_success', 'agent_error', 'user_message_error', 'agent_generation_cancelled')
+
+class DustError(Exception):
+    """The Dust API answered, but the agent did not produce an answer."""
+
+class DustTimeout(DustError):
+    """The agent did not answer before the deadline."""
+
+class DustClient:
+    """
+    Non-blocking Dust conversations: the conversation is created with blocking=False and the
+    agent's answer is then streamed from its message events (or polled), so no request is held
+    open for the whole generation. Waiting is bounded by a deadline, and an answer that is
+    abandoned (deadline or cancellation of the awaiting task) is cancelled on the Dust side.
+    """
+
+    def __init__(self, http: httpx.AsyncClient, base_url: str, api_key: str, workspace_id: str):
+        self.http = http
+        self.base = f"{base_url.rstrip('/')}/api/v1/w/{workspace_id}/assistant"
+        self.headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+    async def create_conversation(self, message: Dict[str, Any], title: str, visibility: str = "unlisted") -> Dict[str, Any]:
+        resp = await self.http.post(
+            f"{self.base}/conversations",
+            headers=self.headers,
+            json={"message": message, "blocking": False, "visibility": visibility, "title": title}
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    async def get_conversation(self, conversation_id: str) -> Dict[str, Any]:
+        resp = await self.http.get(f"{self.base}/conversations/{conversation_id}", headers=self.headers)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def cancel(self, conversation_id: str, message_id: str):
+        """Ask Dust to stop generating an agent message (best effort)."""
+        try:
+            await self.http.post(
+                f"{self.base}/conversations/{conversation_id}/cancel",
+                headers=self.headers,
+                json={"messageIds": [message_id]},
+                timeout=10
+            )
+            print(f"[DUST] Cancelled agent message {message_id}")
+        except httpx.HTTPError as e:
+            print(f"[DUST] WARNING: Could not cancel agent message {message_id}: {e}")
+
+    async def message_events(self, conversation_id: str, message_id: str, timeout: Optional[httpx.Timeout] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield the agent message's events from its Server-Sent Events stream. By default the
+        stream has no read timeout: the agent may go quiet for a while, and the caller bounds the
+        wait with its deadline.
+        """
+        if timeout is None:
+            timeout = httpx.Timeout(self.http.timeout.connect, read=None, write=self.http.timeout.write, pool=self.http.timeout.pool)
+        url = f"{self.base}/conversations/{conversation_id}/messages/{message_id}/events"
+        async with self.http.stream("GET", url, headers=self.headers, timeout=timeout) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "done":
+                    return
+                try:
+                    event = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                yield event.get("data", event)
+
+    async def _stream_answer(self, conversation: Dict[str, Any], agent_message: Dict[str, Any]) -> Dict[str, Any]:
+        """Follow the agent message events until it has finished; returns the finished agent message."""
+        tokens = []
+        async for event in self.message_events(conversation["sId"], agent_message["sId"]):
+            event_type = event.get("type")
+            if event_type == "generation_tokens" and event.get("classification", "tokens") == "tokens":
+                tokens.append(event.get("text", ""))
+            elif event_type == "agent_message_success":
+                message = dict(agent_message, **(event.get("message") or {}))
+                if not isinstance(message.get("content"), str):
+                    message["content"] = "".join(tokens)
+                return message
+            elif event_type in TERMINAL_EVENTS:
+                error = event.get("error") or {}
+                raise DustError(f"Agent message ended with {event_type}: {error.get('message', error) or 'no details'}")
+        raise DustError("Agent message event stream ended before the answer was complete")
+
+    async def _poll_answer(self, conversation: Dict[str, Any], agent_message: Dict[str, Any]) -> Dict[str, Any]:
+        """Poll the conversation until the agent message is no longer being generated."""
+        while True:
+            await asyncio.sleep(DUST_POLL_INTERVAL)
+            data = await self.get_conversation(conversation["sId"])
+            message = find_agent_message(data.get("conversation", {}), agent_message["sId"])
+            status = (message or {}).get("status")
+            if status == "succeeded":
+                return message
+            if status in ("failed", "cancelled"):
+                raise DustError(f"Agent message {status}: {(message or {}).get('error') or 'no details'}")
+
+    async def ask(self, message: Dict[str, Any], title: str, deadline: float = DUST_DEADLINE, mode: str = DUST_MODE) -> Dict[str, Any]:
+        """
+        Post message to a new conversation and wait for the agent's answer, at most deadline seconds.
+        Returns the conversation response with the finished agent message in it, i.e. the same
+        shape as a blocking=True response.
+        """
+        if mode not in DUST_MODES:
+            raise ValueError(f"Unknown Dust mode: {mode}. Supported: {', '.join(DUST_MODES)}")
+        data = await self.create_conversation(message, title)
+        conversation = data["conversation"]
+        agent_message = find_agent_message(conversation)
+        if agent_message is None:
+            raise DustError("Dust did not start an agent message (check the agent mention)")
+        print(f"[DUST] Conversation {conversation['sId']} created, waiting for agent message {agent_message['sId']} ({mode}, deadline {deadline:g}s)...")
+
+        if mode == "stream":
+            wait = self._stream_answer(conversation, agent_message)
+        else:
+            wait = self._poll_answer(conversation, agent_message)
+        try:
+            answer = await asyncio.wait_for(wait, timeout=deadline)
+        except asyncio.TimeoutError as e:
+            await asyncio.shield(self.cancel(conversation["sId"], agent_message["sId"]))
+            raise DustTimeout(f"No answer from the Dust agent within {deadline:g}s") from e
+        except httpx.TimeoutException as e:
+            # A request to Dust timed out on its own (connect, pool, poll), not the deadline
+            await asyncio.shield(self.cancel(conversation["sId"], agent_message["sId"]))
+            raise DustError(f"Request to the Dust API timed out while waiting for the agent ({type(e).__name__})") from e
+        except asyncio.CancelledError:
+            await asyncio.shield(self.cancel(conversation["sId"], agent_message["sId"]))
+            raise
+
+        return {"conversation": replace_agent_message(conversation, answer)}
+
+def find_agent_message(conversation: Dict[str, Any], message_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """The (last, or given) agent message in a conversation's content blocks."""
+    found = None
+    for block in conversation.get("content", []):
+        for item in block if isinstance(block, list) else []:
+            if isinstance(item, dict) and item.get("type") == "agent_message":
+                if message_id is None or item.get("sId") == message_id:
+                    found = item
+    return found
+
+def replace_agent_message(conversation: Dict[str, Any], message: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of conversation with the agent message of the same sId replaced by message."""
+    content = [
+        [message if isinstance(item, dict) and item.get("sId") == message.get("sId") else item for item in block]
+        if isinstance(block, list) else block
+        for block in conversation.get("content", [])
+    ]
+    return dict(conversation, content=content)
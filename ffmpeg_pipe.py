@@ -0,0 +1,159 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+# Configuration
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")  # ffmpeg executable (name on PATH or full path)
+FFMPEG_THREADS = int(os.getenv("FFMPEG_THREADS", "0"))  # Decoder threads (0 = ffmpeg chooses)
+PIPE_READ_SIZE = 1024 * 1024  # Bytes read from ffmpeg's stdout at a time in MJPEG mode
+
+JPEG_SOI = b"\xff\xd8"
+JPEG_EOI = b"\xff\xd9"
+
+def ffmpeg_available() -> bool:
+    return shutil.which(FFMPEG_BINARY) is not None
+
+def scaled_size(width: int, height: int, max_dimension: Optional[int] = None) -> Tuple[int, int]:
+    """Output size for a frame downscaled so its longer side is at most max_dimension (same rounding as sample.resize_frame)."""
+    if not max_dimension:
+        return width, height
+    scale = max_dimension / max(height, width)
+    if scale >= 1:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def jpeg_qscale(jpeg_quality: int) -> int:
+    """Map a 0-100 JPEG quality (OpenCV/libjpeg scale) to ffmpeg's MJPEG -q:v (2 = best, 31 = worst), approximately."""
+    return int(min(31, max(2, round(2 + (100 - jpeg_quality) * 29 / 100))))
+
+def _start(video_path: str, filters: str, output_args, limit: Optional[int]) -> subprocess.Popen:
+    if not ffmpeg_available():
+        raise ValueError(f"ffmpeg not found ({FFMPEG_BINARY}); install it or set FFMPEG_BINARY")
+    # passthrough: write exactly the selected frames, without duplicating any to a constant rate
+    command = [FFMPEG_BINARY, "-nostdin", "-loglevel", "error", "-threads", str(FFMPEG_THREADS),
+               "-i", video_path, "-vf", filters, "-an", "-sn", "-vsync", "passthrough"]
+    if limit:
+        command += ["-frames:v", str(limit)]
+    command += list(output_args) + ["pipe:1"]
+    # stderr goes to a file: a pipe nobody reads could fill up on a damaged video and stall ffmpeg
+    error_log = tempfile.TemporaryFile()
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=error_log, bufsize=0)
+    proc.error_log = error_log
+    return proc
+
+def _finish(proc: subprocess.Popen, video_path: str, frames: int):
+    """Stop ffmpeg; raise if it failed before producing any frame."""
+    if proc.poll() is None:
+        proc.kill()
+    proc.wait()
+    proc.error_log.seek(0)
+    error = proc.error_log.read()[-4096:].decode("utf-8", "replace").strip()
+    proc.error_log.close()
+    proc.stdout.close()
+    if frames == 0 and proc.returncode not in (0, -9):
+        raise ValueError(f"ffmpeg could not decode {video_path}: {error or f'exit code {proc.returncode}'}")
+
+def _filters(fps: float, video_fps: float, width: int, height: int) -> str:
+    """
+    Filter graph keeping the first frame at or after each k / fps seconds (within half a frame),
+    the rule of sample._decode_frames, then scaling only the kept frames. (The fps filter rounds
+    to the nearest output tick instead, which picks frames half an interval late.)
+    """
+    tolerance = 0.5 / video_fps if video_fps > 0 else 0
+    return f"select='gte(t-start_t+{tolerance:.6f},selected_n/{fps})',scale={width}:{height}:flags=area"
+
+def iter_raw_frames(video_path: str, width: int, height: int, video_fps: float, fps: float = 1, max_dimension: Optional[int] = None,
+                    limit: Optional[int] = None, buffers: Optional[int] = None) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Decode a video with ffmpeg, sampling fps frames per second and scaling to max_dimension inside
+    ffmpeg's filter graph. Yields (sample_number, BGR frame) like sample.iter_frames; each frame
+    is read from the pipe straight into a NumPy array. width, height and video_fps are the
+    video's properties (see sample.probe_video).
+    By default every frame gets its own array, so the caller may keep them all. With buffers, the
+    frames are read into a ring of that many preallocated arrays instead: the array of a frame is
+    reused for the frame buffers samples later, so the caller must be done with a frame before it
+    asks for that one (e.g. when it passes frames through a bounded queue shorter than the ring).
+    """
+    out_width, out_height = scaled_size(width, height, max_dimension)
+    ring = [np.empty((out_height, out_width, 3), dtype=np.uint8) for _ in range(buffers)] if buffers else None
+    proc = _start(video_path, _filters(fps, video_fps, out_width, out_height), ["-f", "rawvideo", "-pix_fmt", "bgr24"], limit)
+    count = 0
+    try:
+        while True:
+            frame = ring[count % len(ring)] if ring else np.empty((out_height, out_width, 3), dtype=np.uint8)
+            view = memoryview(frame).cast("B")
+            filled = 0
+            while filled < len(view):
+                n = proc.stdout.readinto(view[filled:])
+                if not n:
+                    break
+                filled += n
+            if filled < len(view):
+                return
+            yield count, frame
+            count += 1
+    finally:
+        _finish(proc, video_path, count)
+
+def _scan_start(data) -> Optional[int]:
+    """
+    Offset where the entropy-coded data of the JPEG at the start of data begins (after the SOS
+    header), or None if the headers are not complete yet. Headers are walked by their lengths,
+    since table data may contain any byte values.
+    """
+    if len(data) < 2:
+        return None
+    if not data.startswith(JPEG_SOI):
+        raise ValueError("ffmpeg MJPEG output is not a JPEG stream")
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            raise ValueError("Malformed JPEG header in ffmpeg MJPEG output")
+        marker = data[i + 1]
+        if marker == 0xFF:  # Fill byte
+            i += 1
+            continue
+        length = int.from_bytes(data[i + 2:i + 4], "big")
+        if marker == 0xDA:  # Start of scan
+            return i + 2 + length if i + 2 + length <= len(data) else None
+        i += 2 + length
+    return None
+
+def iter_jpeg_frames(video_path: str, width: int, height: int, video_fps: float, fps: float = 1, max_dimension: Optional[int] = None,
+                     jpeg_quality: int = 95, limit: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+    """
+    Like iter_raw_frames, but ffmpeg also JPEG-encodes the frames (MJPEG) and yields
+    (sample_number, jpeg_bytes), so no frame is ever decoded to pixels in Python.
+    """
+    out_width, out_height = scaled_size(width, height, max_dimension)
+    proc = _start(video_path, _filters(fps, video_fps, out_width, out_height),
+                  ["-f", "image2pipe", "-c:v", "mjpeg", "-pix_fmt", "yuvj420p", "-q:v", str(jpeg_qscale(jpeg_quality))], limit)
+    count = 0
+    buffer = bytearray()
+    scan_start = None  # Start of the current image's entropy-coded data, once its headers are in
+    searched = 0  # Bytes of buffer already searched for the end marker
+    try:
+        while True:
+            if scan_start is None:
+                scan_start = _scan_start(buffer)
+            # Entropy-coded data stuffs every 0xFF byte, so the first EOI after the headers ends the image
+            end = buffer.find(JPEG_EOI, max(scan_start, searched - 1)) if scan_start is not None else -1
+            if end < 0:
+                searched = len(buffer)
+                chunk = proc.stdout.read(PIPE_READ_SIZE)
+                if not chunk:
+                    return
+                buffer += chunk
+                continue
+            image = bytes(buffer[:end + 2])
+            del buffer[:end + 2]
+            scan_start = None
+            searched = 0
+            yield count, image
+            count += 1
+    finally:
+        _finish(proc, video_path, count)
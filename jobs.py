@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import sample
+
+# Configuration
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(".cache", "jobs.sqlite"))
+JOBS_UPLOAD_DIR = os.getenv("JOBS_UPLOAD_DIR", os.path.join(".cache", "job_uploads"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # Videos processed at the same time
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))  # Jobs waiting beyond this are rejected
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", "1"))  # Seconds between progress writes of a running job
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+class JobStore:
+    """
+    Job state (status, per-frame progress, final result) persisted in a local SQLite database.
+    """
+
+    def __init__(self, db_path: str = JOBS_DB_PATH):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " filename TEXT,"
+            " video_path TEXT NOT NULL,"
+            " options TEXT NOT NULL,"
+            " frames_total INTEGER,"
+            " frames_done INTEGER NOT NULL DEFAULT 0,"
+            " frames_failed INTEGER NOT NULL DEFAULT 0,"
+            " result TEXT,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _row_to_job(self, row) -> Dict[str, Any]:
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def create(self, video_path: str, options: Dict[str, Any], filename: Optional[str] = None, job_id: Optional[str] = None) -> Dict[str, Any]:
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, filename, video_path, options, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, filename, video_path, json.dumps(options), now, now)
+            )
+            self._conn.commit()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def update(self, job_id: str, **fields):
+        """Set the given columns (status, frames_total, frames_done, frames_failed, result, error)."""
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], ensure_ascii=False)
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        """Jobs that were queued or running, oldest first (e.g. left over from a restart)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def job_status(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Public view of a job for the API."""
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "filename": job["filename"],
+        "progress": {
+            "frames_done": job["frames_done"],
+            "frames_failed": job["frames_failed"],
+            "frames_total": job["frames_total"],
+        },
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+# handler(job, on_result) -> final result; on_result is called with every frame result
+JobHandler = Callable[[Dict[str, Any], Callable[[Dict], None]], Awaitable[Dict[str, Any]]]
+
+class JobQueue:
+    """
+    Bounded asyncio queue of job IDs processed by a fixed number of worker tasks.
+    Each job's uploaded video is deleted once the job has finished, successfully or not.
+    Job state is written to the store in a thread, off the event loop; a running job's progress
+    is counted in memory and saved every JOB_PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, store: JobStore, handler: JobHandler, workers: int = JOB_WORKERS, max_queued: int = JOB_QUEUE_SIZE):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        """Start the workers and re-queue jobs that were unfinished when the server last stopped."""
+        for job in self.store.unfinished():
+            if os.path.exists(job["video_path"]):
+                self.store.update(job["id"], status=QUEUED, frames_done=0, frames_failed=0)
+                try:
+                    self.submit(job["id"])
+                except JobQueueFull as e:
+                    self.store.update(job["id"], status=FAILED, error=str(e))
+            else:
+                self.store.update(job["id"], status=FAILED, error="Upload no longer available after server restart")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        print(f"[JOBS] Started {self.workers} job workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, job_id: str):
+        try:
+            self._queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"Job queue is full ({self._queue.maxsize} jobs waiting)")
+
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id, worker_id)
+            finally:
+                self._queue.task_done()
+
+    async def _save_progress(self, job_id: str, progress: Dict[str, int], finished: asyncio.Event):
+        """Write progress to the store every JOB_PROGRESS_INTERVAL seconds while it changes, until finished is set."""
+        saved = dict(progress)
+        while not finished.is_set():
+            try:
+                await asyncio.wait_for(finished.wait(), JOB_PROGRESS_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            if progress != saved and not finished.is_set():
+                saved = dict(progress)
+                await asyncio.to_thread(self.store.update, job_id, **saved)
+
+    async def _run(self, job_id: str, worker_id: int):
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or job["status"] != QUEUED:
+            return
+        print(f"[JOBS] Worker {worker_id} starting job {job_id}")
+        try:
+            frames_total = await asyncio.to_thread(lambda: sample.probe_video(job["video_path"])["expected_samples"])
+        except ValueError:
+            frames_total = None
+        await asyncio.to_thread(self.store.update, job_id, status=RUNNING, frames_total=frames_total)
+        progress = {"frames_done": 0, "frames_failed": 0}
+
+        def on_result(result: Dict):
+            progress["frames_done"] += 1
+            if not result.get("success"):
+                progress["frames_failed"] += 1
+
+        finished = asyncio.Event()
+        reporter = asyncio.create_task(self._save_progress(job_id, progress, finished))
+
+        async def finish(**fields):
+            # Let a progress write in flight land first, so it cannot overwrite the final counts
+            finished.set()
+            await asyncio.gather(reporter, return_exceptions=True)
+            await asyncio.to_thread(self.store.update, job_id, **progress, **fields)
+
+        try:
+            result = await self.handler(job, on_result)
+            await finish(status=COMPLETED, result=result)
+            print(f"[JOBS] Job {job_id} completed")
+        except asyncio.CancelledError:
+            reporter.cancel()
+            # Shielded, so the job is re-queued for the next start even if the shutdown cancels again
+            await asyncio.shield(asyncio.to_thread(self.store.update, job_id, status=QUEUED))
+            raise
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            await finish(status=FAILED, error=str(detail))
+            print(f"[JOBS] Job {job_id} failed: {detail}")
+        finally:
+            await asyncio.shield(asyncio.to_thread(self._delete_upload, job_id))
+
+    def _delete_upload(self, job_id: str):
+        """Delete a finished job's uploaded video; a re-queued job keeps it to run again."""
+        job = self.store.get(job_id)
+        if job and job["status"] != QUEUED and os.path.exists(job["video_path"]):
+            os.unlink(job["video_path"])
@@ -0,0 +1,48 @@
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Histogram buckets in seconds, from a JPEG encode (milliseconds) to a whole video (minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+def multiprocess_dir() -> str:
+    """Where prometheus_client's multiprocess mode keeps the values of all processes ("" when it is off)."""
+    return os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+
+def render() -> bytes:
+    """
+    The metrics in the Prometheus text format. In multiprocess mode (PROMETHEUS_MULTIPROC_DIR set,
+    e.g. for several uvicorn workers) they are aggregated over all processes.
+    """
+    if multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+# Pipeline metrics, filled in by sample.py and api.py
+EXTRACT_SECONDS = Histogram("video_analysis_extract_seconds", "Time to decode and sample the frames of a video", buckets=DEFAULT_BUCKETS)
+FRAMES_EXTRACTED = Counter("video_analysis_frames_extracted", "Frames decoded from videos")
+ENCODE_SECONDS = Histogram("video_analysis_encode_seconds", "Time to resize and JPEG/base64-encode one frame", buckets=DEFAULT_BUCKETS)
+FRAME_SECONDS = Histogram("video_analysis_frame_seconds", "Time from submitting a frame to its parsed answer, rate limiter waits and retries included", buckets=DEFAULT_BUCKETS)
+FRAMES = Counter("video_analysis_frames", "Frame results by outcome", ["status"])
+OPENAI_REQUEST_SECONDS = Histogram("video_analysis_openai_request_seconds", "Duration of OpenAI chat completion calls (retries included)", ["outcome"], buckets=DEFAULT_BUCKETS)
+OPENAI_IN_FLIGHT = Gauge("video_analysis_openai_requests_in_flight", "OpenAI chat completion calls in progress", multiprocess_mode="livesum")
+OPENAI_TOKENS = Counter("video_analysis_openai_tokens", "Tokens used by OpenAI chat completions")
+OPENAI_CACHED_TOKENS = Counter("video_analysis_openai_cached_tokens", "Prompt tokens OpenAI served from its prompt cache")
+MODEL_ESCALATIONS = Counter("video_analysis_model_escalations", "Frames re-sent from the routing model to the larger model, by reason", ["reason"])
+OPENAI_ANSWERS = Counter("video_analysis_openai_answers", "OpenAI answers received, the denominator of the parse failure rate", ["request"])
+PARSE_FAILURES = Counter("video_analysis_parse_failures", "OpenAI answers whose JSON could not be parsed", ["request"])
+REASKS = Counter("video_analysis_reasks", "Failed frames requested again in the re-ask pass, by outcome", ["outcome"])
+VIDEO_SECONDS = Histogram("video_analysis_video_seconds", "Time to analyze a whole video (extraction to saved results)", buckets=DEFAULT_BUCKETS)
+DUST_SECONDS = Histogram("video_analysis_dust_seconds", "Duration of Dust summaries", ["outcome"], buckets=DEFAULT_BUCKETS)
+DUST_PAYLOAD_CHARACTERS = Histogram(
+    "video_analysis_dust_payload_characters", "Size of the frames payload sent to Dust",
+    buckets=tuple(1000 * 4 ** i for i in range(9))
+)
+HTTP_REQUESTS = Counter("video_analysis_http_requests", "API requests by route and status", ["method", "route", "status"])
+HTTP_REQUEST_SECONDS = Histogram("video_analysis_http_request_seconds", "API request durations, streamed response bodies included", ["route"], buckets=DEFAULT_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("video_analysis_http_requests_in_flight", "API requests in progress", multiprocess_mode="livesum")
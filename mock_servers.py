@@ -0,0 +1,532 @@
+"""
+Local stand-ins for the external APIs, for trying out and benchmarking the pipeline without
+network access or cost.
+
+Usage:
+  python mock_servers.py openai [--port 8001] [--latency 0.5] [--jitter 0.2] [--max-concurrency 8] [--rpm 600] [--error-rate 0.05]
+                                [--malformed-rate 0.05] [--batch-latency 1] [--batch-expire-fraction 0.5]
+
+  python mock_servers.py dust [--port 8002] [--latency 2] [--token-delay 0.02] [--error-rate 0.1]
+
+Then point the OpenAI SDK (or the API's Dust client) at it:
+  OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=test python sample.py video.mp4
+  DUST_API_BASE=http://127.0.0.1:8002 API_KEY=test WORKSPACE_ID=w HEALTH_AGENT_ID=a uvicorn api:app
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+ACTIONS = ['sport', 'sleep', 'food', 'work', 'leisure']
+SCENE_SECONDS = 10  # Mock answers keep the same overall_action for this many seconds, like a real recording
+
+
+def _frame_seconds(body):
+    """Seconds of the frames in a chat completion request built by sample.py."""
+    content = body['messages'][-1]['content']
+    texts = [part['text'] for part in content if part.get('type') == 'text']
+    labels = [int(m.group(1)) for text in texts for m in [re.match(r"Second (\d+):", text)] if m]
+    if labels:
+        return labels, True
+    match = re.search(r'"second":\s*(\d+)|\bsecond (\d+)\b', texts[0] if texts else "")
+    return [int(match.group(1) or match.group(2)) if match else 0], False
+
+
+def _prompt_prefix(body):
+    """The part of a request that can be served from the prompt cache: everything before the last (per-frame) message."""
+    return json.dumps([body.get('model'), body['messages'][:-1], body.get('response_format')], sort_keys=True)
+
+
+def _frame_analysis(second, noise_rate=0.0):
+    """The mock answer for a frame; noise_rate of them are wrong (an invalid or a different action), like a weaker model's."""
+    action = ACTIONS[(second // SCENE_SECONDS) % len(ACTIONS)]
+    if noise_rate and random.random() < noise_rate:
+        action = "resting" if random.random() < 0.5 else random.choice([other for other in ACTIONS if other != action])
+    return {
+        "second": second,
+        "overall_action": action,
+        "sub_action": "mock",
+        "description": f"Mock analysis of the frame at second {second}"
+    }
+
+
+def count_connections(app):
+    """Record the (host, port) of every client connection in app.state.connections."""
+    app.state.connections = set()
+
+    @app.middleware("http")
+    async def record_connection(request: Request, call_next):
+        if request.client:
+            app.state.connections.add((request.client.host, request.client.port))
+        return await call_next(request)
+
+
+def create_openai_app(latency=0.5, jitter=0.2, max_concurrency=8, rpm=600, tpm=1_000_000,
+                      error_rate=0.0, tokens_per_frame=900, models=None, malformed_rate=0.0, prompt_cache_min_tokens=1024,
+                      batch_latency=1.0, batch_expire_fraction=None):
+    """
+    A mock of the chat completions endpoint that behaves like a rate-limited OpenAI account:
+    - each request takes latency +/- jitter seconds,
+    - more than max_concurrency simultaneous requests, or more than rpm requests / tpm tokens
+      in the last minute, are answered 429 with retry-after and x-ratelimit-* headers,
+    - error_rate of the remaining requests fail at random (half 429, half 500).
+    The reply is a valid analysis JSON (or JSON array for batched requests) for every frame,
+    except that malformed_rate of the replies are prose with broken JSON, like a model ignoring
+    the output format; requests with a json_schema response_format always get the exact JSON
+    (batches wrapped in {"frames": [...]}), as with structured outputs.
+    models maps a model name to overrides of latency and tokens_per_frame for requests to that
+    model, and its noise_rate: the fraction of frames it answers wrongly (e.g. a cheaper model).
+    Like OpenAI's prompt caching, a request whose prefix (all messages but the last) has been seen
+    before and is at least prompt_cache_min_tokens long (estimated at 4 characters per token) reports
+    that prefix, in steps of 128 tokens, as usage.prompt_tokens_details.cached_tokens.
+    The Batch API is mocked too (files upload, download and delete; batches create, retrieve and
+    cancel): a batch's requests are answered like chat completions batch_latency seconds after it
+    is created, error_rate of them with status 500 in the error file. With batch_expire_fraction,
+    the batch expires after answering only that fraction of its requests, the rest going to the
+    error file as batch_expired. Batch requests are not rate limited.
+    app.state.stats counts requests by outcome (and by model) and batch activity, app.state.seconds
+    the answered requests per frame second, app.state.connections the client connections seen.
+    """
+    app = FastAPI(title="Mock OpenAI API")
+    state = {'active': 0, 'requests': collections.deque(), 'tokens': collections.deque(), 'prefixes': set()}
+    app.state.stats = collections.Counter()
+    app.state.seconds = collections.Counter()
+    ids = itertools.count(1)
+    files = {}
+    batches = {}
+    count_connections(app)
+
+    def window(now):
+        for key in ('requests', 'tokens'):
+            while state[key] and state[key][0][0] <= now - 60:
+                state[key].popleft()
+        return len(state['requests']), sum(amount for _, amount in state['tokens'])
+
+    def rate_limit_headers(now):
+        used_requests, used_tokens = window(now)
+        oldest = state['requests'][0][0] if state['requests'] else now
+        return {
+            'x-ratelimit-limit-requests': str(rpm),
+            'x-ratelimit-remaining-requests': str(max(0, rpm - used_requests)),
+            'x-ratelimit-reset-requests': f"{max(0.0, oldest + 60 - now):.3f}s",
+            'x-ratelimit-limit-tokens': str(tpm),
+            'x-ratelimit-remaining-tokens': str(max(0, tpm - used_tokens)),
+            'x-ratelimit-reset-tokens': f"{max(0.0, oldest + 60 - now):.3f}s",
+        }
+
+    def error(status, message, code, headers):
+        app.state.stats[str(status)] += 1
+        return JSONResponse(
+            status_code=status,
+            content={"error": {"message": message, "type": code, "param": None, "code": code}},
+            headers=headers
+        )
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        seconds, batched = _frame_seconds(body)
+        profile = (models or {}).get(body.get('model'), {})
+        tokens = profile.get('tokens_per_frame', tokens_per_frame) * len(seconds)
+        model_latency = profile.get('latency', latency)
+        now = time.monotonic()
+        used_requests, used_tokens = window(now)
+        headers = rate_limit_headers(now)
+        app.state.stats['requests'] += 1
+
+        if state['active'] >= max_concurrency:
+            return error(429, "Too many concurrent requests", "rate_limit_exceeded", dict(headers, **{'retry-after-ms': str(int(latency * 1000))}))
+        if used_requests >= rpm or used_tokens + tokens > tpm:
+            reset = state['requests'][0][0] + 60 - now if state['requests'] else 1
+            return error(429, "Rate limit reached for requests", "rate_limit_exceeded", dict(headers, **{'retry-after-ms': str(int(reset * 1000))}))
+        if random.random() < error_rate:
+            if random.random() < 0.5:
+                return error(429, "Rate limit reached (injected)", "rate_limit_exceeded", headers)
+            return error(500, "The server had an error (injected)", "server_error", headers)
+
+        state['requests'].append((now, 1))
+        state['tokens'].append((now, tokens))
+        state['active'] += 1
+        try:
+            await asyncio.sleep(max(0.0, random.uniform(model_latency - jitter, model_latency + jitter)))
+        finally:
+            state['active'] -= 1
+        app.state.stats['200'] += 1
+        return JSONResponse(content=completion(body), headers=rate_limit_headers(time.monotonic()))
+
+    def completion(body):
+        """The chat completion answering a request body."""
+        seconds, batched = _frame_seconds(body)
+        profile = (models or {}).get(body.get('model'), {})
+        tokens = profile.get('tokens_per_frame', tokens_per_frame) * len(seconds)
+        app.state.stats[f"model:{body.get('model')}"] += 1
+        app.state.seconds.update(seconds)
+        prompt_tokens = tokens - 100 * len(seconds)
+        prefix = _prompt_prefix(body)
+        prefix_tokens = len(prefix) // 4
+        cached_tokens = 0
+        if prefix_tokens >= prompt_cache_min_tokens:
+            if prefix in state['prefixes']:
+                cached_tokens = min(prompt_tokens, prefix_tokens // 128 * 128)
+            state['prefixes'].add(prefix)
+        app.state.stats['cached_tokens'] += cached_tokens
+
+        analyses = [_frame_analysis(second, profile.get('noise_rate', 0.0)) for second in seconds]
+        if (body.get('response_format') or {}).get('type') == 'json_schema':
+            app.state.stats['structured'] += 1
+            content = json.dumps({"frames": analyses} if batched else analyses[0])
+        elif random.random() < malformed_rate:
+            app.state.stats['malformed'] += 1
+            content = f"The frame shows someone {analyses[0]['overall_action']}. {{\"overall_action\": \"{analyses[0]['overall_action']}\", \"description\": "
+        else:
+            content = f"```json\n{json.dumps(analyses if batched else analyses[0])}\n```"
+        return {
+            "id": f"chatcmpl-mock-{next(ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'gpt-4o'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 100 * len(seconds), "total_tokens": tokens,
+                      "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        }
+
+    def new_file(filename, content, purpose):
+        file_id = f"file-mock-{next(ids)}"
+        files[file_id] = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                          "filename": filename, "purpose": purpose, "content": content}
+        return {key: value for key, value in files[file_id].items() if key != "content"}
+
+    def find_file(file_id):
+        if file_id not in files:
+            raise HTTPException(status_code=404, detail="No such file")
+        return files[file_id]
+
+    async def run_batch(batch):
+        """Answer a batch's requests after batch_latency seconds and write its output and error files."""
+        requests = [json.loads(line) for line in files[batch["input_file_id"]]["content"].decode("utf-8").splitlines() if line.strip()]
+        batch.update(status="in_progress", in_progress_at=int(time.time()))
+        batch["request_counts"]["total"] = len(requests)
+        await asyncio.sleep(batch_latency)
+        if batch["status"] != "in_progress":
+            return
+        answered = len(requests) if batch_expire_fraction is None else int(len(requests) * batch_expire_fraction)
+        outputs, errors = [], []
+        for number, request in enumerate(requests):
+            line = {"id": f"batch_req_mock_{next(ids)}", "custom_id": request["custom_id"], "response": None, "error": None}
+            if number >= answered:
+                line["error"] = {"code": "batch_expired", "message": "This request could not be executed before the completion window expired."}
+                errors.append(line)
+            elif random.random() < error_rate:
+                line["response"] = {"status_code": 500, "request_id": f"req_mock_{next(ids)}",
+                                    "body": {"error": {"message": "The server had an error (injected)", "type": "server_error", "param": None, "code": "server_error"}}}
+                errors.append(line)
+            else:
+                line["response"] = {"status_code": 200, "request_id": f"req_mock_{next(ids)}", "body": completion(request["body"])}
+                outputs.append(line)
+        app.state.stats['batch_requests'] += len(requests)
+        app.state.stats['batch_expired'] += len(requests) - answered
+        for kind, lines in (("output", outputs), ("error", errors)):
+            if lines:
+                content = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+                batch[f"{kind}_file_id"] = new_file(f"batch_{batch['id']}_{kind}.jsonl", content, "batch_output")["id"]
+        batch["request_counts"].update(completed=len(outputs), failed=len(errors))
+        if answered < len(requests):
+            batch.update(status="expired", expired_at=int(time.time()))
+        else:
+            batch.update(status="completed", completed_at=int(time.time()))
+
+    @app.post("/v1/files")
+    async def create_file(request: Request):
+        form = await request.form()
+        upload = form["file"]
+        app.state.stats['files'] += 1
+        return new_file(upload.filename, await upload.read(), form.get("purpose", "batch"))
+
+    @app.get("/v1/files/{file_id}/content")
+    async def file_content(file_id: str):
+        return Response(content=find_file(file_id)["content"], media_type="application/octet-stream")
+
+    @app.delete("/v1/files/{file_id}")
+    async def delete_file(file_id: str):
+        find_file(file_id)
+        del files[file_id]
+        app.state.stats['files_deleted'] += 1
+        return {"id": file_id, "object": "file", "deleted": True}
+
+    @app.post("/v1/batches")
+    async def create_batch(request: Request):
+        body = await request.json()
+        find_file(body["input_file_id"])
+        batch_id = f"batch_mock_{next(ids)}"
+        batch = batches[batch_id] = {
+            "id": batch_id, "object": "batch", "endpoint": body["endpoint"], "errors": None,
+            "input_file_id": body["input_file_id"], "completion_window": body["completion_window"],
+            "status": "validating", "output_file_id": None, "error_file_id": None,
+            "created_at": int(time.time()), "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": body.get("metadata"),
+        }
+        app.state.stats['batches'] += 1
+        batch["task"] = asyncio.create_task(run_batch(batch))
+        return {key: value for key, value in batch.items() if key != "task"}
+
+    def find_batch(batch_id):
+        if batch_id not in batches:
+            raise HTTPException(status_code=404, detail="No such batch")
+        return batches[batch_id]
+
+    @app.get("/v1/batches/{batch_id}")
+    async def retrieve_batch(batch_id: str):
+        app.state.stats['batch_polls'] += 1
+        return {key: value for key, value in find_batch(batch_id).items() if key != "task"}
+
+    @app.post("/v1/batches/{batch_id}/cancel")
+    async def cancel_batch(batch_id: str):
+        batch = find_batch(batch_id)
+        if batch["status"] in ("validating", "in_progress"):
+            batch["task"].cancel()
+            batch.update(status="cancelled", cancelled_at=int(time.time()))
+        return {key: value for key, value in batch.items() if key != "task"}
+
+    return app
+
+
+def _health_summary(content):
+    """A Dust-style health summary of the INPUT_JSON frames in a user message."""
+    try:
+        payload = json.loads(content.split("INPUT_JSON:", 1)[1])
+    except (IndexError, ValueError):
+        payload = {}
+    actions = collections.Counter()
+    for frame in payload.get("data", []):
+        actions[frame.get("overall_action", "unknown")] += 1
+    for segment in payload.get("timeline", []):
+        actions[segment.get("action", "unknown")] += segment.get("frames", 1)
+    total = sum(actions.values()) or 1
+    return {
+        "health_score": {"method": "mock", "score": round(100 * actions.get("sport", 0) / total)},
+        "components": {action: round(count / total, 3) for action, count in sorted(actions.items())},
+        "risk_percentages": {},
+        "alerts": {"clinician_followup": False, "reasons": []},
+        "tips": [{
+            "category": "activity",
+            "action": "Mock tip",
+            "how_to": f"Based on {sum(actions.values())} frames",
+            "expected_impact": "none",
+            "confidence": 1.0
+        }]
+    }
+
+
+def create_dust_app(latency=2.0, token_delay=0.02, chunk_size=40, error=None, error_rate=0.0):
+    """
+    A mock of the Dust assistant conversation API, enough for api.send_to_dust:
+    - POST conversations creates a conversation with the user message and an agent message; with
+      blocking=True it answers once the agent is done, otherwise right away with status "created",
+    - GET .../messages/{mId}/events streams the answer as Server-Sent Events (generation_tokens
+      chunks every token_delay seconds after latency seconds, then agent_message_success),
+    - GET conversations/{cId} shows the agent message's progress, for polling,
+    - POST conversations/{cId}/cancel stops the generation.
+    The answer is a fenced JSON health summary of the INPUT_JSON frames. If error is set, the
+    agent fails with that message instead, and error_rate of the other answers fail at random.
+    app.state.stats counts conversations, event streams, polls, cancellations and failed answers;
+    app.state.connections the client connections seen.
+    """
+    app = FastAPI(title="Mock Dust API")
+    conversations = {}
+    app.state.stats = collections.Counter()
+    count_connections(app)
+
+    async def generate(conversation):
+        """Produce the agent message, filling conversation["events"] as it goes."""
+        agent = conversation["agent"]
+        events = conversation["events"]
+        try:
+            await asyncio.sleep(latency)
+            if error or random.random() < error_rate:
+                app.state.stats['failed'] += 1
+                agent["status"] = "failed"
+                agent["error"] = {"code": "mock_error", "message": error or "The agent failed (injected)"}
+                events.append({"type": "agent_error", "messageId": agent["sId"], "error": agent["error"]})
+                return
+            answer = f"```json\n{json.dumps(_health_summary(conversation['user']['content']), indent=2)}\n```"
+            for start in range(0, len(answer), chunk_size):
+                events.append({"type": "generation_tokens", "classification": "tokens", "messageId": agent["sId"],
+                               "text": answer[start:start + chunk_size]})
+                await asyncio.sleep(token_delay)
+            agent["content"] = answer
+            agent["status"] = "succeeded"
+            events.append({"type": "agent_message_success", "messageId": agent["sId"], "message": dict(agent)})
+        except asyncio.CancelledError:
+            agent["status"] = "cancelled"
+            events.append({"type": "agent_generation_cancelled", "messageId": agent["sId"]})
+
+    def conversation_body(conversation):
+        return {"conversation": {
+            "sId": conversation["sId"],
+            "title": conversation["title"],
+            "content": [[conversation["user"]], [conversation["agent"]]]
+        }}
+
+    def find(conversation_id):
+        conversation = conversations.get(conversation_id)
+        if conversation is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        return conversation
+
+    @app.post("/api/v1/w/{workspace_id}/assistant/conversations")
+    async def create_conversation(workspace_id: str, request: Request):
+        body = await request.json()
+        app.state.stats['conversations'] += 1
+        number = app.state.stats['conversations']
+        conversation = {
+            "sId": f"conv{number}",
+            "title": body.get("title"),
+            "user": {"type": "user_message", "sId": f"user{number}", "content": body["message"]["content"]},
+            "agent": {"type": "agent_message", "sId": f"agent{number}", "status": "created", "content": None, "error": None},
+            "events": [],
+        }
+        conversations[conversation["sId"]] = conversation
+        conversation["task"] = asyncio.create_task(generate(conversation))
+        if body.get("blocking"):
+            await conversation["task"]
+        return conversation_body(conversation)
+
+    @app.get("/api/v1/w/{workspace_id}/assistant/conversations/{conversation_id}")
+    async def get_conversation(workspace_id: str, conversation_id: str):
+        app.state.stats['polls'] += 1
+        return conversation_body(find(conversation_id))
+
+    @app.get("/api/v1/w/{workspace_id}/assistant/conversations/{conversation_id}/messages/{message_id}/events")
+    async def message_events(workspace_id: str, conversation_id: str, message_id: str):
+        conversation = find(conversation_id)
+        app.state.stats['event_streams'] += 1
+
+        async def events():
+            sent = 0
+            while True:
+                while sent < len(conversation["events"]):
+                    event = conversation["events"][sent]
+                    sent += 1
+                    yield f"data: {json.dumps({'eventId': f'{conversation_id}-{sent}', 'data': event})}\n\n"
+                if conversation["task"].done() and sent == len(conversation["events"]):
+                    yield "data: done\n\n"
+                    return
+                await asyncio.sleep(0.01)
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/api/v1/w/{workspace_id}/assistant/conversations/{conversation_id}/cancel")
+    async def cancel(workspace_id: str, conversation_id: str, request: Request):
+        conversation = find(conversation_id)
+        body = await request.json()
+        if conversation["agent"]["sId"] in body.get("messageIds", []):
+            app.state.stats['cancelled'] += 1
+            conversation["task"].cancel()
+        return {"success": True}
+
+    return app
+
+
+def make_self_signed_cert(directory, host="127.0.0.1"):
+    """Write a self-signed certificate for host with the openssl CLI; returns (certfile, keyfile)."""
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-keyout", keyfile, "-out", certfile, "-subj", f"/CN={host}",
+         "-addext", f"subjectAltName=IP:{host}"],
+        check=True, capture_output=True
+    )
+    return certfile, keyfile
+
+
+class BackgroundServer:
+    """
+    Run an ASGI app with uvicorn in a background thread, e.g. from a benchmark:
+
+        with BackgroundServer(create_openai_app(), port=8001) as server:
+            ... server.url ...
+    """
+
+    def __init__(self, app, host="127.0.0.1", port=8001, ssl_certfile=None, ssl_keyfile=None):
+        self.app = app
+        self.url = f"{'https' if ssl_certfile else 'http'}://{host}:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(
+            app, host=host, port=port, log_level="warning",
+            ssl_certfile=ssl_certfile, ssl_keyfile=ssl_keyfile
+        ))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError(f"Mock server failed to start on {self.url}")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local mock servers for the external APIs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    openai_parser = subparsers.add_parser("openai", help="Rate-limited mock of the OpenAI chat completions API")
+    openai_parser.add_argument("--host", default="127.0.0.1")
+    openai_parser.add_argument("--port", type=int, default=8001)
+    openai_parser.add_argument("--latency", type=float, default=0.5, help="Seconds per request")
+    openai_parser.add_argument("--jitter", type=float, default=0.2, help="Random +/- seconds added to the latency")
+    openai_parser.add_argument("--max-concurrency", type=int, default=8, help="Simultaneous requests above this get 429")
+    openai_parser.add_argument("--rpm", type=int, default=600, help="Requests per minute above this get 429")
+    openai_parser.add_argument("--tpm", type=int, default=1_000_000, help="Tokens per minute above this get 429")
+    openai_parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failed at random with 429 or 500")
+    openai_parser.add_argument("--prompt-cache-min-tokens", type=int, default=1024, help="Shortest repeated prompt prefix reported as cached tokens")
+    openai_parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of answers given as prose with broken JSON (not with structured outputs)")
+    openai_parser.add_argument("--batch-latency", type=float, default=1.0, help="Seconds before a Batch API batch is answered")
+    openai_parser.add_argument("--batch-expire-fraction", type=float, default=None, help="Make batches expire after answering this fraction of their requests")
+
+    dust_parser = subparsers.add_parser("dust", help="Mock of the Dust assistant conversation API")
+    dust_parser.add_argument("--host", default="127.0.0.1")
+    dust_parser.add_argument("--port", type=int, default=8002)
+    dust_parser.add_argument("--latency", type=float, default=2.0, help="Seconds before the agent starts answering")
+    dust_parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between streamed answer chunks")
+    dust_parser.add_argument("--error", default=None, help="Make the agent fail with this message")
+    dust_parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of answers failed at random")
+
+    args = parser.parse_args(argv)
+    if args.command == "openai":
+        app = create_openai_app(
+            latency=args.latency, jitter=args.jitter, max_concurrency=args.max_concurrency,
+            rpm=args.rpm, tpm=args.tpm, error_rate=args.error_rate, malformed_rate=args.malformed_rate,
+            prompt_cache_min_tokens=args.prompt_cache_min_tokens, batch_latency=args.batch_latency,
+            batch_expire_fraction=args.batch_expire_fraction
+        )
+        print(f"[MOCK] OpenAI mock on http://{args.host}:{args.port}/v1")
+        uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    elif args.command == "dust":
+        app = create_dust_app(latency=args.latency, token_delay=args.token_delay, error=args.error, error_rate=args.error_rate)
+        print(f"[MOCK] Dust mock on http://{args.host}:{args.port}")
+        uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+import os
+import json
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import openai
+
+# Configuration
+BATCH_DIR = os.getenv("BATCH_DIR", os.path.join(".cache", "batches"))  # Request files, downloaded results and state of batch runs
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "60"))  # Seconds between batch status checks
+BATCH_COMPLETION_WINDOW = "24h"  # The only completion window the Batch API offers
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_MAX_REQUESTS = 50_000  # Requests per batch allowed by the Batch API
+BATCH_MAX_FILE_BYTES = 190 * 1024 * 1024  # Input file size per batch, below the Batch API's 200 MB limit
+BATCH_MAX_ATTEMPTS = 3  # Times a request is submitted before it is given up
+
+FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+def is_answered(outcome: Optional[Dict]) -> bool:
+    """Whether a line of a batch's output or error file holds a successful (HTTP 200) response."""
+    return bool(outcome) and (outcome.get('response') or {}).get('status_code') == 200
+
+class BatchRun:
+    """
+    One offline run through the OpenAI Batch API, kept in batch_dir/<key>/ so it outlives the
+    process: the requests as JSONL input files ("shards" of at most BATCH_MAX_REQUESTS requests
+    and BATCH_MAX_FILE_BYTES), the uploaded file and batch of each shard, the downloaded output
+    and error files, and manifest.json tying them together. The manifest is saved after every
+    step, so running the same run again picks up where it stopped: submitted shards are polled
+    instead of submitted again, downloaded results are not downloaded again, and the requests a
+    batch left unanswered (expired, cancelled or failed) can be resubmitted in new shards.
+    """
+
+    def __init__(self, key: str, batch_dir: str = BATCH_DIR):
+        self.dir = os.path.join(batch_dir, key)
+        self.path = os.path.join(self.dir, "manifest.json")
+        self.manifest = {"created_at": datetime.now(timezone.utc).isoformat(), "videos": [], "shards": [], "attempts": {}, "done": False}
+
+    @property
+    def shards(self) -> List[Dict]:
+        return self.manifest['shards']
+
+    def load(self) -> bool:
+        """Read the manifest of an earlier run with the same key; False if there is none."""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        return True
+
+    def save(self):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def add_requests(self, requests: Iterable[Tuple[str, Dict]]) -> int:
+        """
+        Write (custom_id, chat completion body) requests to new shards, starting another one when
+        a shard is full. Returns the number of requests written.
+        """
+        os.makedirs(self.dir, exist_ok=True)
+        attempts = self.manifest['attempts']
+        written = 0
+        shard = None
+        f = None
+        try:
+            for custom_id, body in requests:
+                line = (json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}, ensure_ascii=False) + "\n").encode("utf-8")
+                if shard is None or shard['requests'] >= BATCH_MAX_REQUESTS or shard['bytes'] + len(line) > BATCH_MAX_FILE_BYTES:
+                    if f is not None:
+                        f.close()
+                    shard = {"input": f"input-{len(self.shards)}.jsonl", "requests": 0, "bytes": 0, "status": "new"}
+                    self.shards.append(shard)
+                    f = open(os.path.join(self.dir, shard['input']), "wb")
+                f.write(line)
+                shard['requests'] += 1
+                shard['bytes'] += len(line)
+                attempts[custom_id] = attempts.get(custom_id, 0) + 1
+                written += 1
+        finally:
+            if f is not None:
+                f.close()
+        self.save()
+        return written
+
+    def submit(self, client, metadata: Optional[Dict[str, str]] = None, verbose=True):
+        """Upload the shards that are not uploaded yet and create a batch for each."""
+        for shard in self.shards:
+            if shard.get('batch_id'):
+                continue
+            if not shard.get('input_file_id'):
+                with open(os.path.join(self.dir, shard['input']), "rb") as f:
+                    shard['input_file_id'] = client.files.create(file=f, purpose="batch").id
+                self.save()
+            batch = client.batches.create(
+                input_file_id=shard['input_file_id'], endpoint=BATCH_ENDPOINT,
+                completion_window=BATCH_COMPLETION_WINDOW, metadata=metadata
+            )
+            shard['batch_id'] = batch.id
+            shard['status'] = batch.status
+            self.save()
+            if verbose:
+                print(f"[BATCH] Submitted {shard['input']} ({shard['requests']} requests, {shard['bytes'] / (1024 * 1024):.1f} MB) as batch {batch.id}")
+
+    def finished(self) -> bool:
+        """Whether every shard's batch has reached a final status."""
+        return bool(self.shards) and all(shard['status'] in FINAL_STATUSES for shard in self.shards)
+
+    def poll(self, client, interval: float = BATCH_POLL_INTERVAL, wait=True, verbose=True) -> bool:
+        """
+        Refresh the status of the submitted batches, every interval seconds until all of them
+        are finished, or only once without wait. Returns whether all of them are finished.
+        """
+        while True:
+            for shard in self.shards:
+                if not shard.get('batch_id') or shard['status'] in FINAL_STATUSES:
+                    continue
+                batch = client.batches.retrieve(shard['batch_id'])
+                counts = batch.request_counts
+                shard.update(
+                    status=batch.status, output_file_id=batch.output_file_id, error_file_id=batch.error_file_id,
+                    completed=counts.completed if counts else 0, failed=counts.failed if counts else 0
+                )
+            self.save()
+            if verbose:
+                print(f"[BATCH] " + ", ".join(
+                    f"{shard.get('batch_id')} {shard['status']} ({shard.get('completed', 0)}/{shard['requests']})" for shard in self.shards))
+            if self.finished() or not wait:
+                return self.finished()
+            time.sleep(interval)
+
+    def download(self, client, verbose=True):
+        """Download the output and error files of finished batches that are not downloaded yet."""
+        for index, shard in enumerate(self.shards):
+            if shard['status'] not in FINAL_STATUSES:
+                continue
+            for kind in ('output', 'error'):
+                file_id = shard.get(f"{kind}_file_id")
+                if not file_id or shard.get(kind):
+                    continue
+                name = f"{kind}-{index}.jsonl"
+                path = os.path.join(self.dir, name)
+                with open(f"{path}.tmp", "wb") as f:
+                    f.write(client.files.content(file_id).content)
+                os.replace(f"{path}.tmp", path)
+                shard[kind] = name
+                self.save()
+                if verbose:
+                    print(f"[BATCH] Downloaded the {kind} file of batch {shard['batch_id']} to '{path}'")
+
+    def outcomes(self) -> Dict[str, Dict]:
+        """
+        The downloaded output or error line of each request, by custom_id. A successful response
+        wins over errors of other attempts of the same request.
+        """
+        outcomes = {}
+        for shard in self.shards:
+            for kind in ('error', 'output'):
+                if not shard.get(kind):
+                    continue
+                with open(os.path.join(self.dir, shard[kind]), encoding="utf-8") as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        outcome = json.loads(line)
+                        custom_id = outcome.get('custom_id')
+                        if not is_answered(outcomes.get(custom_id)):
+                            outcomes[custom_id] = outcome
+        return outcomes
+
+    def resubmittable(self, custom_ids: Iterable[str]) -> List[str]:
+        """The custom_ids that have not been submitted BATCH_MAX_ATTEMPTS times yet."""
+        attempts = self.manifest['attempts']
+        return [custom_id for custom_id in custom_ids if attempts.get(custom_id, 0) < BATCH_MAX_ATTEMPTS]
+
+    def resubmit(self, custom_ids: Iterable[str]) -> int:
+        """
+        Write the requests of custom_ids that may be submitted again to new shards (submit sends
+        them). Returns how many were written.
+        """
+        wanted = set(self.resubmittable(custom_ids))
+
+        def requests():
+            for shard in list(self.shards):
+                path = os.path.join(self.dir, shard['input'])
+                if not wanted or not os.path.exists(path):
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        request = json.loads(line)
+                        if request['custom_id'] in wanted:
+                            wanted.discard(request['custom_id'])
+                            yield request['custom_id'], request['body']
+
+        return self.add_requests(requests()) if wanted else 0
+
+    def cleanup(self, client, verbose=True):
+        """
+        Once every request is answered: delete the uploaded input files and the local request
+        files (they hold the frames). The manifest and the downloaded results stay, so the run's
+        results can be read again without cost.
+        """
+        for shard in self.shards:
+            if shard.get('input_file_id'):
+                try:
+                    client.files.delete(shard['input_file_id'])
+                except openai.OpenAIError as e:
+                    if verbose:
+                        print(f"[BATCH] WARNING: Could not delete uploaded file {shard['input_file_id']}: {e}")
+                shard['input_file_id'] = None
+            path = os.path.join(self.dir, shard['input'])
+            if os.path.exists(path):
+                os.unlink(path)
+        self.manifest['done'] = True
+        self.save()
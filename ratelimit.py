@@ -0,0 +1,327 @@
+import os
+import re
+import time
+import random
+import asyncio
+import threading
+from typing import Dict, Optional
+
+import openai
+
+import metrics
+import tracing
+
+# Configuration
+OPENAI_RPM = os.getenv("OPENAI_RPM")  # Requests per minute to stay under until the API reports its own limit
+OPENAI_TPM = os.getenv("OPENAI_TPM")  # Tokens per minute, likewise
+MAX_RETRIES = 5  # Retries per request for rate limits, timeouts and server errors
+RETRY_BASE_DELAY = 0.5  # Seconds; backoff doubles per attempt, with full jitter
+RETRY_MAX_DELAY = 30.0  # Cap on a single backoff delay
+AIMD_DECREASE_FACTOR = 0.5  # Concurrency limit is multiplied by this on a 429
+MIN_CONCURRENCY = 1
+DEFAULT_TOKENS_PER_FRAME = 1000  # Token estimate per frame until real usage has been seen
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse an x-ratelimit-reset-* header value such as "1s", "6m0s", "20ms" or "0.5s" into seconds.
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        matched = True
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total if matched else None
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Delay requested by a retry-after-ms or retry-after header, in seconds."""
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at per_minute / 60 per second, holding at most per_minute.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount can be taken (0 if it can be taken now)."""
+        self._refill(now)
+        # A request larger than the whole bucket goes through once the bucket is full
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def sync(self, limit: Optional[float], remaining: Optional[float], now: float):
+        """Adopt the limit and remaining count reported by the API."""
+        self._refill(now)
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+
+class RateLimiter:
+    """
+    Client-side scheduler for OpenAI requests, shared by all workers of a run (or of a server).
+
+    - Concurrency is adjusted with AIMD: the limit grows by about one request per round of
+      successful requests and is halved when the API answers 429.
+    - Requests-per-minute and tokens-per-minute token buckets are kept in step with the
+      x-ratelimit-* response headers, so requests wait locally instead of being rejected.
+    - A retry-after on a 429 pauses all requests until it has passed.
+    Safe to use from threads and from async code at the same time.
+    """
+
+    def __init__(self, initial_concurrency: int, max_concurrency: int, min_concurrency: int = MIN_CONCURRENCY,
+                 rpm: Optional[float] = OPENAI_RPM, tpm: Optional[float] = OPENAI_TPM):
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self.requests = TokenBucket(float(rpm)) if rpm else None
+        self.tokens = TokenBucket(float(tpm)) if tpm else None
+        self.tokens_per_frame = float(DEFAULT_TOKENS_PER_FRAME)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.peak_limit = self.limit
+        self.rate_limited = 0
+        self.retries = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._async_waiters = []  # (loop, future) of async callers waiting for a slot
+
+    def estimate_tokens(self, frames: int = 1) -> float:
+        return self.tokens_per_frame * frames
+
+    def _try_acquire(self, tokens: float):
+        """Take a slot if possible. Returns (started, None) or (None, seconds to wait or None for a free slot)."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return None, self.paused_until - now
+        if self.in_flight >= int(self.limit):
+            return None, None
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        if wait > 0:
+            return None, wait
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(tokens)
+        self.in_flight += 1
+        return now, None
+
+    def acquire(self, tokens: float) -> float:
+        """Block until a request may be sent. Returns its start time, to pass to release."""
+        with self._cond:
+            while True:
+                started, wait = self._try_acquire(tokens)
+                if started is not None:
+                    return started
+                self._cond.wait(timeout=wait)
+
+    async def acquire_async(self, tokens: float) -> float:
+        """
+        Async version of acquire; waits without blocking the event loop. A caller waiting for a
+        free slot is woken by release; one waiting for a pause or a bucket to refill also sleeps
+        until then at most.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                started, wait = self._try_acquire(tokens)
+                if started is not None:
+                    return started
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await asyncio.wait({waiter}, timeout=wait)
+            finally:
+                with self._cond:
+                    if (loop, waiter) in self._async_waiters:
+                        self._async_waiters.remove((loop, waiter))
+                waiter.cancel()
+
+    def _wake_async_waiters(self):
+        """Wake the async callers of acquire_async (their loops may run in other threads); call with the lock held."""
+        for loop, waiter in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, waiter)
+            except RuntimeError:  # The waiter's loop is closed
+                pass
+        self._async_waiters.clear()
+
+    def release(self, started: float, headers=None, rate_limited: bool = False, success: bool = False):
+        """
+        Give the slot back and learn from the outcome: headers update the buckets, a 429 halves
+        the concurrency limit (once per window of requests started before the last decrease)
+        and a success grows it.
+        """
+        with self._cond:
+            was_full = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            now = time.monotonic()
+            if headers:
+                self._update_from_headers(headers, now)
+            if rate_limited:
+                self.rate_limited += 1
+                if started >= self._last_decrease:
+                    self.limit = max(self.min_concurrency, self.limit * AIMD_DECREASE_FACTOR)
+                    self._last_decrease = now
+                retry_after = retry_after_seconds(headers)
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+            elif success and was_full:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                self.peak_limit = max(self.peak_limit, self.limit)
+            self._cond.notify_all()
+            self._wake_async_waiters()
+
+    def _update_from_headers(self, headers, now: float):
+        def number(name):
+            try:
+                return float(headers.get(name)) if headers.get(name) is not None else None
+            except ValueError:
+                return None
+        for kind in ("requests", "tokens"):
+            limit = number(f"x-ratelimit-limit-{kind}")
+            remaining = number(f"x-ratelimit-remaining-{kind}")
+            if not limit and remaining is None:
+                continue
+            bucket = getattr(self, kind)
+            if bucket is None and limit:
+                bucket = TokenBucket(limit)
+                setattr(self, kind, bucket)
+            if bucket:
+                bucket.sync(limit, remaining, now)
+            # Nothing left in this window: hold every request until the API says it resets
+            reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            if remaining is not None and remaining <= 0 and reset:
+                self.paused_until = max(self.paused_until, now + reset)
+
+    def record_usage(self, total_tokens: Optional[int], frames: int = 1):
+        """Fold a response's token usage into the per-frame token estimate."""
+        if total_tokens:
+            with self._cond:
+                self.tokens_per_frame = 0.8 * self.tokens_per_frame + 0.2 * total_tokens / frames
+
+    def count_retry(self):
+        with self._cond:
+            self.retries += 1
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                'concurrency_limit': self.limit,
+                'peak_concurrency_limit': self.peak_limit,
+                'rate_limited': self.rate_limited,
+                'retries': self.retries,
+            }
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+def is_transient(error) -> bool:
+    """Whether an API error may go away on its own: a rate limit (not a quota), a timeout, a connection or a server error."""
+    if isinstance(error, openai.RateLimitError):
+        return getattr(error, 'code', None) != 'insufficient_quota'
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return isinstance(error, openai.APIConnectionError)
+
+def _retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """Backoff before retrying after error, or None if the error is not worth retrying."""
+    if not is_transient(error):
+        return None
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    response = getattr(error, 'response', None)
+    retry_after = retry_after_seconds(response.headers if response is not None else None)
+    return max(delay, retry_after or 0)
+
+def _error_headers(error: Exception):
+    response = getattr(error, 'response', None)
+    return response.headers if response is not None else None
+
+def create_completion(client, request: Dict, limiter: RateLimiter, frames: int = 1, max_retries: int = MAX_RETRIES):
+    """
+    client.chat.completions.create(**request) scheduled by limiter, retrying rate limits, timeouts
+    and server errors with jittered exponential backoff.
+    """
+    attempt = 0
+    while True:
+        with tracing.span("rate_limit_wait"):
+            started = limiter.acquire(limiter.estimate_tokens(frames))
+        try:
+            with tracing.span("openai_request", attempt=attempt), metrics.OPENAI_IN_FLIGHT.track_inprogress():
+                raw = client.chat.completions.with_raw_response.create(**request)
+        except Exception as e:
+            limiter.release(started, _error_headers(e), rate_limited=isinstance(e, openai.RateLimitError))
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt >= max_retries:
+                raise
+            attempt += 1
+            limiter.count_retry()
+            time.sleep(delay)
+            continue
+        limiter.release(started, raw.headers, success=True)
+        response = raw.parse()
+        usage = getattr(response, 'usage', None)
+        limiter.record_usage(usage.total_tokens if usage else None, frames)
+        return response
+
+async def create_completion_async(client, request: Dict, limiter: RateLimiter, frames: int = 1, max_retries: int = MAX_RETRIES):
+    """
+    Async version of create_completion for an AsyncOpenAI client.
+    """
+    attempt = 0
+    while True:
+        with tracing.span("rate_limit_wait"):
+            started = await limiter.acquire_async(limiter.estimate_tokens(frames))
+        try:
+            with tracing.span("openai_request", attempt=attempt), metrics.OPENAI_IN_FLIGHT.track_inprogress():
+                raw = await client.chat.completions.with_raw_response.create(**request)
+        except asyncio.CancelledError:
+            limiter.release(started)
+            raise
+        except Exception as e:
+            limiter.release(started, _error_headers(e), rate_limited=isinstance(e, openai.RateLimitError))
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt >= max_retries:
+                raise
+            attempt += 1
+            limiter.count_retry()
+            await asyncio.sleep(delay)
+            continue
+        limiter.release(started, raw.headers, success=True)
+        response = raw.parse()
+        usage = getattr(response, 'usage', None)
+        limiter.record_usage(usage.total_tokens if usage else None, frames)
+        return response
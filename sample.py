@@ -1,15 +1,32 @@
 import cv2
+import numpy as np
 import base64
 import os
 import sys
 import time
+import argparse
 import json
+import math
 import re
-from openai import OpenAI
+import queue
+import asyncio
+import threading
+import collections
+import functools
+import multiprocessing
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from openai.types.chat import ChatCompletion
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from typing import List, Tuple, Dict, Optional
 from prompt import PROMPT
+from cache import FrameCache, FRAME_CACHE_DIR, FRAME_CACHE_MAX_MB, perceptual_hash, frame_cache_key, video_cache_key
+from ratelimit import RateLimiter, create_completion, create_completion_async, is_transient
+from checkpoint import RunCheckpoint, CHECKPOINT_DIR, file_sha256
+from openai_batch import BatchRun, BATCH_DIR, BATCH_POLL_INTERVAL, is_answered
+import clients
+import ffmpeg_pipe
+import metrics
+import tracing
 import os
 from dotenv import load_dotenv
 
@@ -20,13 +37,47 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 SUPPORTED_FORMATS = ['.mp4', '.mov', '.avi', '.mkv', '.flv', '.wmv', '.m4v']
 
 # Configuration
-MAX_WORKERS = 5  # Number of parallel API calls
+MAX_WORKERS = 5  # Number of parallel API calls to start with
+MAX_CONCURRENCY = 20  # Upper bound the adaptive concurrency limit may grow to
+OPENAI_MODEL = "gpt-4o"  # Vision model used for frame analysis
+ROUTING_MODEL = os.getenv("ROUTING_MODEL") or None  # Cheaper model frames go to first, escalating to OPENAI_MODEL (see ModelRouter)
+BATCH_SIZE = 1  # Frames per OpenAI request (1 = one request per frame)
 
-def extract_frames(video_path, fps=1, verbose=True):
+# Frame encoding
+MAX_FRAME_DIMENSION = None  # Downscale frames so the longer side is at most this many pixels (None = full resolution)
+JPEG_QUALITY = 95  # JPEG quality 0-100 (95 is the OpenCV default)
+IMAGE_DETAIL = "auto"  # OpenAI image detail level
+IMAGE_DETAILS = ['low', 'high', 'auto']
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "").lower() in ("1", "true", "yes")  # Ask for answers in the prompt's JSON schema (response_format json_schema)
+REASK_BUDGET = int(os.getenv("REASK_BUDGET", "50"))  # With structured outputs, re-ask requests per run for frames that still failed after the main pass (0 = no re-ask pass)
+REASK_ATTEMPTS = 2  # Times a frame may be re-asked
+PARSE_ERROR = 'Failed to parse JSON from response'
+STREAM_QUEUE_SIZE = 16  # Max frames buffered between pipeline stages in streaming mode
+
+# Frame sampling engines (see _decode_frames)
+SAMPLERS = ['read', 'grab', 'seek']
+DEFAULT_SAMPLER = 'grab'
+
+# Parallel decoding (see iter_frames_parallel)
+DECODE_WORKERS = 1  # Processes decoding time ranges of the video (1 = decode in this process)
+DECODE_CHUNKS_PER_WORKER = 4  # Time ranges per worker, so a slow range does not leave the others idle
+
+# Decode backends (see iter_frames_ffmpeg); the ffmpeg ones need the ffmpeg binary (FFMPEG_BINARY)
+DECODE_BACKENDS = ['opencv', 'ffmpeg', 'ffmpeg-mjpeg']
+DECODE_BACKEND = os.getenv("DECODE_BACKEND", "opencv")
+
+# Adaptive (scene-change-aware) sampling
+ADAPTIVE_CHANGE_THRESHOLD = 0.03  # Mean abs. difference (0-1) of downscaled frames below which a frame is skipped
+ADAPTIVE_MAX_SKIP = 30  # Always re-analyze after this many consecutive skipped seconds
+SCENE_SIGNATURE_SIZE = (32, 32)  # Size of the grayscale thumbnail frames are compared on
+
+def _open_video(video_path, fps=1, sampler=DEFAULT_SAMPLER, verbose=True):
     """
-    Extract frames from video at specified frames per second.
-    Returns a list of (frame_number, frame_image) tuples.
+    Open a video file and read its properties.
+    Returns (cap, video_fps, total_frames, duration).
     """
+    if sampler not in SAMPLERS:
+        raise ValueError(f"Unknown sampler: {sampler}. Supported: {', '.join(SAMPLERS)}")
     if verbose:
         print(f"[INFO] Opening video file: {video_path}")
     cap = cv2.VideoCapture(video_path)
@@ -36,60 +87,340 @@ def extract_frames(video_path, fps=1, verbose=True):
     video_fps = cap.get(cv2.CAP_PROP_FPS)
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     duration = total_frames / video_fps if video_fps > 0 else 0
-    frame_interval = int(video_fps / fps) if video_fps > 0 else 1  # Calculate frame interval
     
     if verbose:
         print(f"[INFO] Video properties:")
         print(f"  - FPS: {video_fps:.2f}")
         print(f"  - Total frames: {total_frames}")
         print(f"  - Duration: {duration:.2f} seconds")
-        print(f"  - Frame extraction interval: {frame_interval} frames (1 frame per second)")
+        print(f"  - Frame sampling: every {1 / fps:.2f} seconds by timestamp ({sampler} sampler)")
+    
+    return cap, video_fps, total_frames, duration
+
+def probe_video(video_path, fps=1) -> Dict:
+    """
+    Read a video's properties without decoding it.
+    Returns a dict with video_fps, total_frames, duration, width, height and expected_samples (at fps).
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Error opening video file: {video_path}")
+    video_fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    duration = total_frames / video_fps if video_fps > 0 else 0
+    return {
+        'video_fps': video_fps,
+        'total_frames': total_frames,
+        'duration': duration,
+        'width': width,
+        'height': height,
+        'expected_samples': _expected_sample_count(duration, fps)
+    }
+
+def _expected_sample_count(duration, fps=1):
+    """Number of samples the timestamp-based samplers produce for a video of this duration."""
+    if duration <= 0:
+        return None
+    return int(math.ceil(duration * fps - 1e-9))
+
+def _frame_timestamp(cap, frame_index, video_fps):
+    """
+    Presentation time in seconds of the frame most recently grabbed from cap.
+    Falls back to frame_index / video_fps when the backend does not report positions.
+    """
+    pos_msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+    if pos_msec > 0 or frame_index == 0:
+        return pos_msec / 1000
+    return frame_index / video_fps if video_fps > 0 else 0
+
+def _decode_frames(cap, video_fps, total_frames, fps=1, sampler=DEFAULT_SAMPLER, verbose=True, start_sample=0, end_sample=None):
+    """
+    Generator that samples frames from an opened capture and yields (frame_number, frame_image)
+    tuples, one per 1/fps seconds of video. Releases the capture when exhausted or closed.
+    start_sample / end_sample restrict it to the samples [start_sample, end_sample) (the rest of
+    the video if end_sample is None); the capture is first moved to just before start_sample.
     
-    frames = []
-    frame_count = 0
-    extracted_count = 0
+    Samplers:
+      - "read": decode every frame with cap.read() and keep the sampled ones
+      - "grab": cap.grab() every frame, but only cap.retrieve() (decode to BGR) the kept ones
+      - "seek": jump to each sample time with CAP_PROP_POS_MSEC; fastest for sparse rates
+    
+    Frames are chosen by timestamp (the first frame at or after k / fps seconds, within half a
+    frame), so sampling does not drift on non-integer frame rates such as 29.97 fps.
+    """
+    interval = 1.0 / fps
+    tolerance = 0.5 / video_fps if video_fps > 0 else 0
+    duration = total_frames / video_fps if video_fps > 0 else 0
+    frame_index = 0
+    extracted_count = start_sample
+    if start_sample > 0 and sampler != 'seek':
+        # Start a frame early, so the first frame of the range is never skipped
+        frame_index = max(0, int(start_sample * interval * video_fps) - 1)
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
     
     if verbose:
         print(f"[INFO] Extracting frames...")
-        pbar = tqdm(total=total_frames, desc="Extracting frames", unit="frame")
+        if sampler == 'seek':
+            pbar = tqdm(total=_expected_sample_count(duration, fps), desc="Extracting frames", unit="frame")
+        else:
+            pbar = tqdm(total=total_frames, desc="Extracting frames", unit="frame")
     else:
         pbar = None
     
     try:
-        while True:
-            ret, frame = cap.read()
+        if sampler == 'seek':
+            while end_sample is None or extracted_count < end_sample:
+                target_time = extracted_count * interval
+                if duration > 0 and target_time >= duration:
+                    break
+                cap.set(cv2.CAP_PROP_POS_MSEC, target_time * 1000)
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                yield extracted_count, frame
+                extracted_count += 1
+                if pbar is not None:
+                    pbar.set_postfix({"extracted": extracted_count})
+                    pbar.update(1)
+            return
+        
+        while end_sample is None or extracted_count < end_sample:
+            if sampler == 'read':
+                ret, frame = cap.read()
+            else:
+                ret = cap.grab()
             if not ret:
                 break
             
-            # Extract frame at 1 second intervals
-            if frame_count % frame_interval == 0:
-                frames.append((extracted_count, frame))
+            # Keep the first frame at or after the next sample time
+            timestamp = _frame_timestamp(cap, frame_index, video_fps)
+            if timestamp + tolerance >= extracted_count * interval:
+                if sampler == 'grab':
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                yield extracted_count, frame
                 extracted_count += 1
-                if verbose and pbar:
+                if verbose and pbar is not None:
                     pbar.set_postfix({"extracted": extracted_count})
             
-            frame_count += 1
-            if pbar:
+            frame_index += 1
+            if pbar is not None:
                 pbar.update(1)
     finally:
-        if pbar:
+        if pbar is not None:
             pbar.close()
-    
+        cap.release()
+
+def iter_frames(video_path, fps=1, sampler=DEFAULT_SAMPLER, verbose=True):
+    """
+    Lazily extract frames from video at specified frames per second.
+    Yields (frame_number, frame_image) tuples as they are decoded.
+    """
+    cap, video_fps, total_frames, _ = _open_video(video_path, fps=fps, sampler=sampler, verbose=verbose)
+    return _decode_frames(cap, video_fps, total_frames, fps=fps, sampler=sampler, verbose=verbose)
+
+def _decode_range(video_path, fps, sampler, start_sample, end_sample):
+    """Decode the samples [start_sample, end_sample) of a video, in a worker process of iter_frames_parallel."""
+    cap, video_fps, total_frames, _ = _open_video(video_path, fps=fps, sampler=sampler, verbose=False)
+    return list(_decode_frames(cap, video_fps, total_frames, fps=fps, sampler=sampler, verbose=False,
+                               start_sample=start_sample, end_sample=end_sample))
+
+def iter_frames_parallel(video_path, fps=1, sampler=DEFAULT_SAMPLER, workers=DECODE_WORKERS, chunks=None, verbose=True):
+    """
+    Like iter_frames, but decodes in a pool of worker processes: the samples are split into chunks
+    consecutive ranges (default: workers x DECODE_CHUNKS_PER_WORKER), and each range is decoded by
+    a worker with its own capture, moved to the start of the range. Ranges are split on sample
+    numbers, so no frame is decoded twice or missed at a boundary, and frames are yielded in
+    order. At most 2 x workers ranges are decoded ahead of the consumer.
+    """
+    cap, video_fps, total_frames, duration = _open_video(video_path, fps=fps, sampler=sampler, verbose=verbose)
     cap.release()
+    expected = _expected_sample_count(duration, fps)
+    if workers <= 1 or not expected:
+        yield from iter_frames(video_path, fps=fps, sampler=sampler, verbose=False)
+        return
+    chunks = max(1, min(chunks or workers * DECODE_CHUNKS_PER_WORKER, expected))
+    bounds = [expected * i // chunks for i in range(chunks)] + [None]  # The last range runs to the end of the video
+    if verbose:
+        print(f"[INFO] Decoding {chunks} time ranges in {workers} processes...")
+    
+    pbar = tqdm(total=expected, desc="Extracting frames", unit="frame", disable=not verbose)
+    # Spawned workers: forking a process that runs threads (e.g. the API server) is not safe
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    pending = collections.deque()
+    try:
+        for i in range(chunks):
+            pending.append(executor.submit(_decode_range, video_path, fps, sampler, bounds[i], bounds[i + 1]))
+            if len(pending) > 2 * workers:
+                for item in pending.popleft().result():
+                    pbar.update(1)
+                    yield item
+        while pending:
+            for item in pending.popleft().result():
+                pbar.update(1)
+                yield item
+    finally:
+        pbar.close()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def _check_decode_backend(backend):
+    if backend not in DECODE_BACKENDS:
+        raise ValueError(f"Unknown decode backend: {backend}. Supported: {', '.join(DECODE_BACKENDS)}")
+    if backend != 'opencv' and not ffmpeg_pipe.ffmpeg_available():
+        raise ValueError(f"Decode backend {backend} needs ffmpeg ({ffmpeg_pipe.FFMPEG_BINARY} not found); install it or set FFMPEG_BINARY")
+
+def iter_frames_ffmpeg(video_path, fps=1, max_dimension=None, buffers=None, verbose=True):
+    """
+    Like iter_frames, but decoded by an ffmpeg subprocess: its filter graph picks the frames (by
+    the same timestamp rule as the samplers) and downscales them to max_dimension, so only the
+    kept frames, at their final size, ever reach Python. Each frame is read from the pipe into its
+    own array, or with buffers into a reused ring of that many arrays (see ffmpeg_pipe.iter_raw_frames).
+    """
+    info = probe_video(video_path, fps)
+    if verbose:
+        print(f"[INFO] Decoding {video_path} with ffmpeg ({info['width']}x{info['height']}, {info['video_fps']:.2f} FPS, every {1 / fps:.2f} seconds)")
+    frames = ffmpeg_pipe.iter_raw_frames(video_path, info['width'], info['height'], info['video_fps'], fps=fps,
+                                         max_dimension=max_dimension, limit=info['expected_samples'], buffers=buffers)
+    yield from tqdm(frames, total=info['expected_samples'], desc="Extracting frames", unit="frame", disable=not verbose)
+
+def iter_encoded_frames_ffmpeg(video_path, fps=1, max_dimension=None, jpeg_quality=JPEG_QUALITY, verbose=True):
+    """
+    Like iter_frames_ffmpeg, but ffmpeg also JPEG-encodes the frames, so no pixels are handled
+    in Python at all. Yields (second, frame_base64, size_kb, None) tuples like the encoding stage.
+    jpeg_quality is mapped to ffmpeg's MJPEG quantizer scale, so sizes differ a little from OpenCV's.
+    """
+    info = probe_video(video_path, fps)
+    if verbose:
+        print(f"[INFO] Decoding and JPEG-encoding {video_path} with ffmpeg ({info['width']}x{info['height']}, {info['video_fps']:.2f} FPS, every {1 / fps:.2f} seconds)")
+    images = ffmpeg_pipe.iter_jpeg_frames(video_path, info['width'], info['height'], info['video_fps'], fps=fps, max_dimension=max_dimension,
+                                          jpeg_quality=jpeg_quality, limit=info['expected_samples'])
+    for second, image in tqdm(images, total=info['expected_samples'], desc="Extracting frames", unit="frame", disable=not verbose):
+        frame_base64 = base64.b64encode(image).decode('utf-8')
+        yield second, frame_base64, len(frame_base64) / 1024, None
+
+def extract_frames(video_path, fps=1, sampler=DEFAULT_SAMPLER, verbose=True, workers=DECODE_WORKERS, backend='opencv', max_dimension=None):
+    """
+    Extract frames from video at specified frames per second.
+    Returns a list of (frame_number, frame_image) tuples.
+    With workers > 1, time ranges of the video are decoded in parallel (see iter_frames_parallel).
+    With backend="ffmpeg", ffmpeg samples and downscales (to max_dimension) the frames instead
+    (see iter_frames_ffmpeg); sampler and workers are then not used.
+    """
+    _check_decode_backend(backend)
+    if backend != 'opencv':
+        frames = list(iter_frames_ffmpeg(video_path, fps=fps, max_dimension=max_dimension, verbose=verbose))
+        if verbose:
+            print(f"[INFO] Successfully extracted {len(frames)} frames")
+        return frames, probe_video(video_path, fps)['video_fps']
+    if workers > 1:
+        frames = list(iter_frames_parallel(video_path, fps=fps, sampler=sampler, workers=workers, verbose=verbose))
+        if verbose:
+            print(f"[INFO] Successfully extracted {len(frames)} frames")
+        return frames, probe_video(video_path, fps)['video_fps']
+    cap, video_fps, total_frames, _ = _open_video(video_path, fps=fps, sampler=sampler, verbose=verbose)
+    frames = list(_decode_frames(cap, video_fps, total_frames, fps=fps, sampler=sampler, verbose=verbose))
     if verbose:
         print(f"[INFO] Successfully extracted {len(frames)} frames")
     return frames, video_fps
 
-def encode_frame_to_base64(frame):
+def frame_signature(frame):
+    """
+    Cheap scene signature for change detection: a small grayscale thumbnail of the frame as float32.
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, SCENE_SIGNATURE_SIZE, interpolation=cv2.INTER_AREA)
+    return small.astype(np.float32)
+
+def frame_difference(signature_a, signature_b) -> float:
+    """
+    Mean absolute pixel difference between two frame signatures, scaled to 0-1.
+    """
+    return float(np.mean(np.abs(signature_a - signature_b))) / 255.0
+
+def skip_similar_frames(frames, skipped, threshold=ADAPTIVE_CHANGE_THRESHOLD, max_skip=ADAPTIVE_MAX_SKIP):
+    """
+    Filter an iterable of (second, frame) tuples down to the frames whose scene changed.
+    A frame is skipped when it differs less than threshold from the last frame that was kept,
+    unless max_skip frames in a row have already been skipped. Every skipped second is recorded
+    in the skipped dict as {skipped_second: kept_second} so its labels can be inherited later.
+    """
+    last_signature = None
+    last_second = None
+    skipped_in_row = 0
+    try:
+        for second, frame in frames:
+            signature = frame_signature(frame)
+            if (last_signature is not None and skipped_in_row < max_skip
+                    and frame_difference(signature, last_signature) < threshold):
+                skipped[second] = last_second
+                skipped_in_row += 1
+                continue
+            last_signature = signature
+            last_second = second
+            skipped_in_row = 0
+            yield second, frame
+    finally:
+        close = getattr(frames, 'close', None)
+        if close:
+            close()
+
+def fill_skipped_results(results: List[Dict], skipped: Dict[int, int]) -> List[Dict]:
+    """
+    Add a result for every second skipped by skip_similar_frames, inheriting the labels of the
+    frame it was skipped in favour of, so there is still one entry per second.
+    """
+    by_second = {result['second']: result for result in results}
+    for second, source_second in skipped.items():
+        source = by_second.get(source_second, {})
+        parsed_json = source.get('parsed_json')
+        inherited = {
+            'second': second,
+            'frame_index': None,
+            'analysis': source.get('analysis', ''),
+            'parsed_json': dict(parsed_json, second=second) if parsed_json else None,
+            'success': source.get('success', False),
+            'elapsed_time': 0,
+            'tokens_used': 0,
+            'inherited_from': source_second
+        }
+        if not inherited['success']:
+            inherited['error'] = source.get('error', f"Frame at {source_second}s was not analyzed")
+        results.append(inherited)
+    return results
+
+def resize_frame(frame, max_dimension=None):
+    """
+    Downscale a frame so its longer side is at most max_dimension pixels, keeping the aspect ratio.
+    Frames that are already small enough are returned unchanged.
+    """
+    if not max_dimension:
+        return frame
+    height, width = frame.shape[:2]
+    scale = max_dimension / max(height, width)
+    if scale >= 1:
+        return frame
+    new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(frame, new_size, interpolation=cv2.INTER_AREA)
+
+def encode_frame_to_base64(frame, max_dimension=MAX_FRAME_DIMENSION, jpeg_quality=JPEG_QUALITY):
     """
     Encode OpenCV frame (numpy array) to base64 string.
+    The frame is first downscaled to max_dimension (if set) and JPEG-encoded at jpeg_quality.
     """
+    start = time.perf_counter()
+    frame = resize_frame(frame, max_dimension)
+    
     # Encode frame to JPEG
-    _, buffer = cv2.imencode('.jpg', frame)
+    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)])
     
     # Convert to base64
     frame_base64 = base64.b64encode(buffer).decode('utf-8')
     size_kb = len(frame_base64) / 1024
+    metrics.ENCODE_SECONDS.observe(time.perf_counter() - start)
     return frame_base64, size_kb
 
 def parse_json_from_response(text: str) -> Optional[Dict]:
@@ -116,6 +447,64 @@ def parse_json_from_response(text: str) -> Optional[Dict]:
     except json.JSONDecodeError:
         return None
 
+def parse_json_array_from_response(text: str) -> Optional[List[Dict]]:
+    """
+    Extract and parse a JSON array of objects from the API response (used for batched requests).
+    Handles arrays wrapped in markdown code blocks or surrounded by extra text.
+    """
+    if not text:
+        return None
+    
+    # Try to find a JSON array in markdown code blocks
+    json_match = re.search(r'```(?:json)?\s*(\[.*?\])\s*```', text, re.DOTALL)
+    if json_match:
+        text = json_match.group(1)
+    else:
+        # Try to find a JSON array directly
+        json_match = re.search(r'\[.*\]', text, re.DOTALL)
+        if json_match:
+            text = json_match.group(0)
+    
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(parsed, list):
+        return None
+    return [entry for entry in parsed if isinstance(entry, dict)]
+
+@functools.lru_cache(maxsize=16)
+def response_schema(prompt: str = PROMPT) -> Dict:
+    """
+    JSON schema of the object the prompt asks for, read from the fields of its JSON template:
+    "<integer>" becomes an integer, "<one of: a, b>" one of those strings and anything else a
+    string. Prompts without a template get the schema of PROMPT, whose fields
+    validate_json_structure expects.
+    """
+    template = re.search(r'\{(.*?)\}', prompt, re.DOTALL)
+    fields = re.findall(r'"(\w+)"\s*:\s*"?<([^>]*)>"?', template.group(1)) if template else []
+    if not fields:
+        return response_schema(PROMPT) if prompt != PROMPT else {"type": "object"}
+    properties = {}
+    for name, placeholder in fields:
+        if placeholder == 'integer':
+            properties[name] = {"type": "integer"}
+        elif placeholder.startswith('one of:'):
+            properties[name] = {"type": "string", "enum": [value.strip() for value in placeholder[len('one of:'):].split(',')]}
+        else:
+            properties[name] = {"type": "string"}
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+def response_format(prompt: str, batch: bool = False) -> Dict:
+    """
+    The response_format of a structured output request for the prompt: one object per frame, or
+    for a batch {"frames": [...]} (the schema's top level must be an object).
+    """
+    schema = response_schema(prompt)
+    if batch:
+        schema = {"type": "object", "properties": {"frames": {"type": "array", "items": schema}}, "required": ["frames"], "additionalProperties": False}
+    return {"type": "json_schema", "json_schema": {"name": "frame_analyses" if batch else "frame_analysis", "strict": True, "schema": schema}}
+
 def validate_json_structure(data: Dict, second: int) -> Dict:
     """
     Validate and ensure the JSON has the required structure.
@@ -151,83 +540,978 @@ def validate_json_structure(data: Dict, second: int) -> Dict:
     
     return result
 
-def analyze_frame_with_openai(args):
+def _frame_request(prompt, frame_base64, second, detail=IMAGE_DETAIL, model=OPENAI_MODEL, structured=False):
     """
-    Call OpenAI Vision API to analyze a frame.
-    Args: tuple of (client, frame_base64, prompt, second, frame_index)
+    Build the chat.completions.create keyword arguments for analyzing a single frame.
+    The prompt goes first, unchanged, as the system message and the frame's second and image
+    last, so every request of a run starts with the same prefix for OpenAI's prompt caching.
+    With structured, the answer is constrained to the prompt's JSON schema.
     """
-    client, frame_base64, prompt, second, frame_index = args
-    start_time = time.time()
-    
-    # Inject the second number into the prompt
-    prompt_with_second = prompt.replace("<integer>", str(second)) if "<integer>" in prompt else f"{prompt}\n\nNote: This frame is from second {second} of the video. Include this second number in your JSON response."
-    
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt_with_second
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{frame_base64}"
-                            }
+    request = {
+        'model': model,
+        'messages': [
+            {"role": "system", "content": prompt},
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": f"This frame is from second {second} of the video. Use {second} as \"second\" in your JSON response."
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{frame_base64}",
+                            "detail": detail
                         }
-                    ]
-                }
-            ],
-            max_tokens=1000  # Increased for more detailed descriptions
-        )
-        elapsed = time.time() - start_time
-        analysis_text = response.choices[0].message.content
-        tokens_used = None
-        if hasattr(response, 'usage') and response.usage:
-            tokens_used = response.usage.total_tokens
-        
-        # Parse JSON from response
-        parsed_json = parse_json_from_response(analysis_text)
-        
-        if parsed_json:
-            validated_json = validate_json_structure(parsed_json, second)
-            return {
-                'second': second,
-                'frame_index': frame_index,
-                'analysis': analysis_text,
-                'parsed_json': validated_json,
-                'success': True,
-                'elapsed_time': elapsed,
-                'tokens_used': tokens_used
-            }
-        else:
-            # If JSON parsing failed, return error
-            return {
-                'second': second,
-                'frame_index': frame_index,
-                'analysis': analysis_text,
-                'parsed_json': None,
-                'success': False,
-                'elapsed_time': elapsed,
-                'error': 'Failed to parse JSON from response',
-                'tokens_used': tokens_used
+                    }
+                ]
             }
-    except Exception as e:
-        elapsed = time.time() - start_time
+        ],
+        'max_tokens': 1000  # Increased for more detailed descriptions
+    }
+    if structured:
+        request['response_format'] = response_format(prompt)
+    return request
+
+def _usage(response) -> Tuple[Optional[int], int, int]:
+    """
+    (total_tokens, prompt_tokens, cached_tokens) of a chat completion, cached_tokens being the
+    prompt tokens served from OpenAI's prompt cache (0 when usage.prompt_tokens_details is missing).
+    """
+    usage = getattr(response, 'usage', None)
+    if not usage:
+        return None, 0, 0
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = getattr(details, 'cached_tokens', None) or 0
+    metrics.OPENAI_TOKENS.inc(usage.total_tokens or 0)
+    metrics.OPENAI_CACHED_TOKENS.inc(cached_tokens)
+    return usage.total_tokens, usage.prompt_tokens or 0, cached_tokens
+
+def _frame_result(response, second, frame_index, elapsed) -> Dict:
+    """
+    Turn a chat completion for a single frame into a result dict.
+    """
+    analysis_text = response.choices[0].message.content
+    tokens_used, prompt_tokens, cached_tokens = _usage(response)
+    metrics.OPENAI_ANSWERS.labels("frame").inc()
+    
+    # Parse JSON from response
+    parsed_json = parse_json_from_response(analysis_text)
+    
+    if parsed_json:
+        validated_json = validate_json_structure(parsed_json, second)
+        return {
+            'second': second,
+            'frame_index': frame_index,
+            'analysis': analysis_text,
+            'parsed_json': validated_json,
+            'success': True,
+            'elapsed_time': elapsed,
+            'tokens_used': tokens_used,
+            'prompt_tokens': prompt_tokens,
+            'cached_tokens': cached_tokens
+        }
+    else:
+        # If JSON parsing failed, return error
+        metrics.PARSE_FAILURES.labels("frame").inc()
         return {
             'second': second,
             'frame_index': frame_index,
-            'analysis': f"Error analyzing frame: {str(e)}",
+            'analysis': analysis_text,
             'parsed_json': None,
             'success': False,
             'elapsed_time': elapsed,
-            'error': str(e)
+            'error': PARSE_ERROR,
+            'tokens_used': tokens_used,
+            'prompt_tokens': prompt_tokens,
+            'cached_tokens': cached_tokens
         }
 
+def _frame_error_result(error, second, frame_index, elapsed) -> Dict:
+    """
+    Result dict for a frame whose API call raised.
+    """
+    return {
+        'second': second,
+        'frame_index': frame_index,
+        'analysis': f"Error analyzing frame: {str(error)}",
+        'parsed_json': None,
+        'success': False,
+        'elapsed_time': elapsed,
+        'error': str(error),
+        'transient': is_transient(error)
+    }
+
+def _trace_result(span, result):
+    """Record a frame result's outcome on its tracing span."""
+    span.set(success=result['success'], elapsed_time=result.get('elapsed_time'), tokens_used=result.get('tokens_used'), cached_tokens=result.get('cached_tokens'))
+    return result
+
+def _create_completion(client, request, limiter=None, frames=1):
+    """
+    Send a chat completion request, through the rate limiter (with retries) if one is given.
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        if limiter is None:
+            with tracing.span("openai_request"), metrics.OPENAI_IN_FLIGHT.track_inprogress():
+                response = client.chat.completions.create(**request)
+        else:
+            response = create_completion(client, request, limiter, frames)
+        outcome = "success"
+        return response
+    finally:
+        metrics.OPENAI_REQUEST_SECONDS.labels(outcome).observe(time.perf_counter() - start)
+
+async def _create_completion_async(client, request, limiter=None, frames=1):
+    """
+    Async version of _create_completion for an AsyncOpenAI client.
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        if limiter is None:
+            with tracing.span("openai_request"), metrics.OPENAI_IN_FLIGHT.track_inprogress():
+                response = await client.chat.completions.create(**request)
+        else:
+            response = await create_completion_async(client, request, limiter, frames)
+        outcome = "success"
+        return response
+    finally:
+        metrics.OPENAI_REQUEST_SECONDS.labels(outcome).observe(time.perf_counter() - start)
+
+def analyze_frame_with_openai(args):
+    """
+    Call OpenAI Vision API to analyze a frame.
+    Args: tuple of (client, frame_base64, prompt, second, frame_index, detail[, limiter[, model[, structured]]])
+    With a RateLimiter, the call waits for a free slot and is retried on rate limits and
+    transient errors before the frame is given up as failed. With structured, the answer is
+    constrained to the prompt's JSON schema (see response_format).
+    """
+    client, frame_base64, prompt, second, frame_index, detail, *rest = args
+    limiter = rest[0] if rest else None
+    model = rest[1] if len(rest) > 1 else OPENAI_MODEL
+    structured = rest[2] if len(rest) > 2 else False
+    with tracing.span("openai_frame", second=second, frame_index=frame_index, model=model, structured=structured) as span:
+        start_time = time.time()
+        try:
+            response = _create_completion(client, _frame_request(prompt, frame_base64, second, detail, model, structured), limiter)
+            return _trace_result(span, _frame_result(response, second, frame_index, time.time() - start_time))
+        except Exception as e:
+            return _trace_result(span, _frame_error_result(e, second, frame_index, time.time() - start_time))
+
+async def analyze_frame_with_openai_async(client, frame_base64, prompt, second, frame_index, detail=IMAGE_DETAIL, limiter=None, model=OPENAI_MODEL, structured=False):
+    """
+    Async version of analyze_frame_with_openai for an AsyncOpenAI client.
+    """
+    with tracing.span("openai_frame", second=second, frame_index=frame_index, model=model, structured=structured) as span:
+        start_time = time.time()
+        try:
+            response = await _create_completion_async(client, _frame_request(prompt, frame_base64, second, detail, model, structured), limiter)
+            return _trace_result(span, _frame_result(response, second, frame_index, time.time() - start_time))
+        except Exception as e:
+            return _trace_result(span, _frame_error_result(e, second, frame_index, time.time() - start_time))
+
+def build_batch_prompt(prompt: str) -> str:
+    """
+    Turn the single-frame prompt into one asking for a JSON array with one entry per frame.
+    It does not depend on the frames, so batched requests share it as a cacheable prefix.
+    """
+    return (
+        f"{prompt}\n\n"
+        f"You are given several frames from the same video, one per second, in order. Each image is preceded by its second. "
+        f"Analyze every frame on its own and respond with a JSON array containing exactly one object per frame, "
+        f"in the same order, each in the format above with \"second\" set to that frame's second."
+    )
+
+def _batch_request(frames, prompt, detail=IMAGE_DETAIL, model=OPENAI_MODEL, structured=False):
+    """
+    Build the chat.completions.create keyword arguments for a batch of
+    (second, frame_index, frame_base64) frames, laid out like _frame_request.
+    """
+    seconds = [second for second, _, _ in frames]
+    content = [{"type": "text", "text": f"{len(frames)} frames, seconds {', '.join(str(second) for second in seconds)}:"}]
+    for second, _, frame_base64 in frames:
+        content.append({"type": "text", "text": f"Second {second}:"})
+        content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/jpeg;base64,{frame_base64}",
+                "detail": detail
+            }
+        })
+    request = {
+        'model': model,
+        'messages': [{"role": "system", "content": build_batch_prompt(prompt)}, {"role": "user", "content": content}],
+        'max_tokens': 1000 * len(frames)
+    }
+    if structured:
+        request['response_format'] = response_format(prompt, batch=True)
+    return request
+
+def _batch_results(response, frames, elapsed) -> List[Optional[Dict]]:
+    """
+    Split a batched chat completion back into per-frame result dicts, aligned with frames.
+    Frames the response did not answer are None.
+    """
+    seconds = [second for second, _, _ in frames]
+    analysis_text = response.choices[0].message.content
+    tokens_used, prompt_tokens, cached_tokens = _usage(response)
+    metrics.OPENAI_ANSWERS.labels("batch").inc()
+    
+    entries = parse_json_array_from_response(analysis_text)
+    if not entries:
+        metrics.PARSE_FAILURES.labels("batch").inc()
+        return [None] * len(frames)
+    
+    # Match entries to frames by their "second" field, or by position if that does not line up
+    by_second = {}
+    for entry in entries:
+        try:
+            by_second.setdefault(int(entry.get('second')), entry)
+        except (TypeError, ValueError):
+            continue
+    if not all(second in by_second for second in seconds) and len(entries) == len(frames):
+        by_second = dict(zip(seconds, entries))
+    
+    answered = sum(1 for second in seconds if second in by_second)
+    results = []
+    for second, frame_index, _ in frames:
+        entry = by_second.get(second)
+        if entry is None:
+            results.append(None)
+            continue
+        results.append({
+            'second': second,
+            'frame_index': frame_index,
+            'analysis': json.dumps(entry, ensure_ascii=False),
+            'parsed_json': validate_json_structure(entry, second),
+            'success': True,
+            'elapsed_time': elapsed,
+            'tokens_used': round(tokens_used / answered) if tokens_used else None,
+            'prompt_tokens': round(prompt_tokens / answered),
+            'cached_tokens': round(cached_tokens / answered),
+            'batch_size': len(frames)
+        })
+    return results
+
+def _trace_batch_results(span, results):
+    """Record how many frames of a batch were answered, and its tokens, on its tracing span."""
+    answered = [result for result in results if result is not None]
+    span.set(answered=len(answered), elapsed_time=answered[0]['elapsed_time'] if answered else None,
+             tokens_used=sum(result.get('tokens_used') or 0 for result in answered),
+             cached_tokens=sum(result.get('cached_tokens') or 0 for result in answered))
+    return results
+
+def analyze_frames_batch_with_openai(args):
+    """
+    Call OpenAI Vision API once for several consecutive frames.
+    Args: tuple of (client, frames, prompt, detail[, limiter[, model[, structured]]]) where frames is
+    a list of (second, frame_index, frame_base64) tuples.
+    Returns a list aligned with frames: a result dict (same shape as analyze_frame_with_openai)
+    for every frame the response answered, and None for frames that need a single-frame call.
+    """
+    client, frames, prompt, detail, *rest = args
+    limiter = rest[0] if rest else None
+    model = rest[1] if len(rest) > 1 else OPENAI_MODEL
+    structured = rest[2] if len(rest) > 2 else False
+    with tracing.span("openai_batch", seconds=[second for second, _, _ in frames], model=model, structured=structured) as span:
+        start_time = time.time()
+        try:
+            response = _create_completion(client, _batch_request(frames, prompt, detail, model, structured), limiter, len(frames))
+        except Exception:
+            return [None] * len(frames)
+        return _trace_batch_results(span, _batch_results(response, frames, time.time() - start_time))
+
+async def analyze_frames_batch_with_openai_async(client, frames, prompt, detail=IMAGE_DETAIL, limiter=None, model=OPENAI_MODEL, structured=False):
+    """
+    Async version of analyze_frames_batch_with_openai for an AsyncOpenAI client.
+    """
+    with tracing.span("openai_batch", seconds=[second for second, _, _ in frames], model=model, structured=structured) as span:
+        start_time = time.time()
+        try:
+            response = await _create_completion_async(client, _batch_request(frames, prompt, detail, model, structured), limiter, len(frames))
+        except Exception:
+            return [None] * len(frames)
+        return _trace_batch_results(span, _batch_results(response, frames, time.time() - start_time))
+
+_STREAM_END = object()
+
+def _queue_put(q, item, stop_event):
+    """Put an item on a bounded queue, giving up once stop_event is set."""
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _queue_get(q, stop_event):
+    """Get an item from a queue, returning _STREAM_END once stop_event is set."""
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _STREAM_END
+
+def stream_encoded_frames(frame_iter, queue_size=STREAM_QUEUE_SIZE, with_hash=False, max_dimension=MAX_FRAME_DIMENSION, jpeg_quality=JPEG_QUALITY, encoded=False):
+    """
+    Run decoding and base64 encoding in background threads connected by bounded queues.
+    Yields (second, frame_base64, size_kb, frame_hash) tuples as soon as each frame is encoded, so at most
+    ~2 * queue_size frames are held in memory regardless of video length.
+    frame_hash is the frame's perceptual hash when with_hash is set, otherwise None.
+    With encoded=True, frame_iter already yields those tuples (e.g. iter_encoded_frames_ffmpeg)
+    and they are only read ahead.
+    Exceptions raised while decoding or encoding are re-raised in the consuming thread.
+    """
+    frame_queue = queue.Queue(maxsize=queue_size)
+    encoded_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    
+    def decode_stage():
+        with tracing.span("decode") as span:
+            decode_frames(span)
+    
+    def decode_frames(span):
+        decode_time = 0.0  # Time spent decoding, not waiting for room in the queue
+        decoded = 0
+        try:
+            frames = iter(frame_iter)
+            while True:
+                start = time.perf_counter()
+                item = next(frames, _STREAM_END)
+                decode_time += time.perf_counter() - start
+                if item is _STREAM_END:
+                    break
+                decoded += 1
+                if not _queue_put(frame_queue, item, stop_event):
+                    return
+            _queue_put(frame_queue, _STREAM_END, stop_event)
+        except Exception as e:
+            _queue_put(frame_queue, e, stop_event)
+        finally:
+            metrics.EXTRACT_SECONDS.observe(decode_time)
+            metrics.FRAMES_EXTRACTED.inc(decoded)
+            close = getattr(frame_iter, 'close', None)
+            if close:
+                close()
+            span.set(frames=decoded, decode_seconds=round(decode_time, 3))
+    
+    def encode_stage():
+        with tracing.span("encode", encoded=encoded):
+            encode_frames()
+    
+    def encode_frames():
+        while True:
+            item = _queue_get(frame_queue, stop_event)
+            if item is _STREAM_END or isinstance(item, Exception):
+                _queue_put(encoded_queue, item, stop_event)
+                return
+            if encoded:
+                if not _queue_put(encoded_queue, item, stop_event):
+                    return
+                continue
+            second, frame = item
+            try:
+                frame_base64, size_kb = encode_frame_to_base64(frame, max_dimension, jpeg_quality)
+                frame_hash = perceptual_hash(frame) if with_hash else None
+            except Exception as e:
+                _queue_put(encoded_queue, e, stop_event)
+                return
+            if not _queue_put(encoded_queue, (second, frame_base64, size_kb, frame_hash), stop_event):
+                return
+    
+    threads = [
+        threading.Thread(target=tracing.bind(decode_stage), name="frame-decoder", daemon=True),
+        threading.Thread(target=tracing.bind(encode_stage), name="frame-encoder", daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    
+    try:
+        while True:
+            item = encoded_queue.get()
+            if item is _STREAM_END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+
+def _result_from_cache(cached: Dict, second: int, frame_index: int) -> Dict:
+    """Re-target a cached frame result at the second it is now used for."""
+    parsed_json = cached.get('parsed_json')
+    return dict(
+        cached,
+        second=second,
+        frame_index=frame_index,
+        parsed_json=dict(parsed_json, second=second) if parsed_json else None,
+        elapsed_time=0,
+        tokens_used=0,
+        prompt_tokens=0,
+        cached_tokens=0,
+        cached=True
+    )
+
+def _new_stats() -> Dict:
+    """Counters accumulated while analyzing the frames of one video."""
+    return {
+        'successful_calls': 0,
+        'failed_calls': 0,
+        'total_tokens': 0,
+        'total_api_time': 0,
+        'total_size_kb': 0,
+        'cache_hits': 0,
+        'cache_misses': 0,
+        'batch_requests': 0,
+        'batch_fallbacks': 0,
+        'resumed': 0,
+        'tiers': {},  # Per model with a ModelRouter: calls, failed, total_time, tokens
+        'escalations': {},  # Frames escalated to the larger model, by reason
+        'prompt_tokens': 0,
+        'cached_tokens': 0,  # Prompt tokens served from OpenAI's prompt cache
+        'answers': 0,  # Frame answers received from the API (parsed or not)
+        'parse_failures': 0,
+        'reasks': 0,  # Requests of the re-ask pass
+        'reasks_recovered': 0,
+    }
+
+ESCALATION_REASONS = ['failed', 'unknown', 'neighbors']
+
+class ModelRouter:
+    """
+    Tiered model routing for one run: every frame goes to fast_model first and is re-sent to model
+    when the fast answer failed (API error or unparseable JSON), was downgraded to "unknown" by
+    validate_json_structure, or disagrees (overall_action) with both neighboring analyzed frames.
+    A fast answer is held back until both its neighbors have answers, so every frame is reported
+    once. on_result, on_known and finish return the actions for the caller to carry out:
+    ("record", item, result) or ("escalate", item, None), item being (second, position, frame_base64, cache_key).
+    """
+    
+    def __init__(self, fast_model: str, model: str = OPENAI_MODEL):
+        if fast_model == model:
+            raise ValueError(f"The routing model must differ from the escalation model ({model})")
+        self.fast_model = fast_model
+        self.model = model
+        self.labels = {}  # Position -> overall_action of the frame's answer so far (None if it failed)
+        self.held = {}  # Position -> (item, result): fast answers waiting for their neighbors
+        self.escalated = {}  # Position -> (reason, fast result) of frames sent to the larger model
+        self.last = None  # Position of the last frame, once the frame source is exhausted
+        self.tiers = {name: {'calls': 0, 'failed': 0, 'total_time': 0.0, 'tokens': 0} for name in (fast_model, model)}
+        self.escalations = {reason: 0 for reason in ESCALATION_REASONS}
+    
+    def on_result(self, item, model, result):
+        """A frame answered by model."""
+        position = item[1]
+        tier = self.tiers[model]
+        tier['calls'] += 1
+        tier['failed'] += not result['success']
+        tier['total_time'] += result.get('elapsed_time') or 0
+        tier['tokens'] += result.get('tokens_used') or 0
+        result = dict(result, model=model)
+        if model == self.fast_model:
+            if not result['success']:
+                return self._escalate(item, result, 'failed')
+            if result['parsed_json']['overall_action'] == 'unknown':
+                return self._escalate(item, result, 'unknown')
+            self.held[position] = (item, result)
+            self.labels[position] = result['parsed_json']['overall_action']
+            return self._decide(position - 1, position, position + 1)
+        
+        reason, fast_result = self.escalated.pop(position)
+        if not result['success'] and fast_result['success']:
+            # The larger model failed outright; the fast answer is better than none
+            result = dict(fast_result, escalated=reason, escalation_error=result.get('error'))
+        else:
+            result['escalated'] = reason
+            result['tokens_used'] = (result.get('tokens_used') or 0) + (fast_result.get('tokens_used') or 0)
+        self.labels[position] = result['parsed_json']['overall_action'] if result['success'] else None
+        return [('record', item, result)] + self._decide(position - 1, position + 1)
+    
+    def on_known(self, position, result):
+        """A frame answered without an API call (frame cache hit or resumed)."""
+        self.labels[position] = (result.get('parsed_json') or {}).get('overall_action') if result.get('success') else None
+        return self._decide(position - 1, position + 1)
+    
+    def finish(self, frames):
+        """The frame source is exhausted after frames frames."""
+        self.last = frames - 1
+        return self._decide(self.last)
+    
+    def flush(self):
+        """Record answers still held back (only possible if a neighbor never got an answer)."""
+        held, self.held = self.held, {}
+        return [('record', item, result) for item, result in held.values()]
+    
+    def stats(self) -> Dict:
+        return {'tiers': self.tiers, 'escalations': self.escalations}
+    
+    def _escalate(self, item, result, reason):
+        self.escalated[item[1]] = (reason, result)
+        self.escalations[reason] += 1
+        metrics.MODEL_ESCALATIONS.labels(reason).inc()
+        return [('escalate', item, None)]
+    
+    def _decide(self, *positions):
+        actions = []
+        for position in positions:
+            if position not in self.held:
+                continue
+            if not ((position == 0 or position - 1 in self.labels) and (position == self.last or position + 1 in self.labels)):
+                continue
+            item, result = self.held.pop(position)
+            label = self.labels[position]
+            previous = self.labels.get(position - 1)
+            following = self.labels.get(position + 1) if position != self.last else None
+            if previous is not None and following is not None and label != previous and label != following:
+                del self.labels[position]
+                actions += self._escalate(item, result, 'neighbors')
+            else:
+                actions.append(('record', item, result))
+        return actions
+
+class ReaskPass:
+    """
+    The re-ask pass of one run with structured outputs: frames whose result still failed (an
+    unparseable answer, or a transient API error the rate limiter's retries did not get past) are
+    held back instead of recorded, and once the main pass is done requested again on their own.
+    Other errors (e.g. an invalid API key or request) would fail again and are recorded as they
+    are. Each frame is re-asked at most attempts times, and the run at most budget times; frames
+    left over are recorded as failed.
+    """
+    
+    def __init__(self, budget: int = REASK_BUDGET, attempts: int = REASK_ATTEMPTS):
+        self.budget = budget
+        self.attempts = attempts
+        self.tries = {}  # Position -> times the frame was re-asked
+        self.waiting = []  # Items to re-ask in the next round
+    
+    def defer(self, item, result) -> bool:
+        """Hold a failed frame back for re-asking; False if its result is to be recorded as is."""
+        position = item[1]
+        if result['success'] or self.budget <= 0 or self.tries.get(position, 0) >= self.attempts:
+            return False
+        if result.get('error') != PARSE_ERROR and not result.get('transient'):
+            return False
+        self.budget -= 1
+        self.tries[position] = self.tries.get(position, 0) + 1
+        self.waiting.append(item)
+        return True
+    
+    def take(self) -> List:
+        """The frames to re-ask in the next round."""
+        waiting, self.waiting = self.waiting, []
+        return waiting
+
+def _count_answer(stats, result, reask=False):
+    """Count a frame's outcome for the parse failure rate and, for a re-ask, its recovery."""
+    parse_failure = result.get('error') == PARSE_ERROR
+    stats['answers'] += result['success'] or parse_failure
+    stats['parse_failures'] += parse_failure
+    if reask:
+        stats['reasks'] += 1
+        stats['reasks_recovered'] += result['success']
+        metrics.REASKS.labels("recovered" if result['success'] else "failed").inc()
+
+def _trace_stats(span, stats):
+    """Record the counters of a run on its tracing span."""
+    span.set(**{name: stats[name] for name in ('successful_calls', 'failed_calls', 'total_tokens', 'cache_hits', 'resumed', 'batch_requests', 'parse_failures', 'reasks', 'cached_tokens')})
+
+def _lookup_cached_result(cache, stats, frame_hash, prompt, cache_settings, second, frame_index):
+    """
+    Look a frame up in the frame cache.
+    Returns (cached_result, cache_key); cached_result is None on a miss, cache_key is None
+    when caching is off.
+    """
+    if cache is None or frame_hash is None:
+        return None, None
+    cache_key = frame_cache_key(frame_hash, prompt, OPENAI_MODEL, cache_settings)
+    cached = cache.get(cache_key)
+    if cached is None:
+        stats['cache_misses'] += 1
+        return None, cache_key
+    stats['cache_hits'] += 1
+    return _result_from_cache(cached, second, frame_index), cache_key
+
+def _save_result(writer, save, *args):
+    """
+    Call save(*args) (a frame cache or run checkpoint write), on writer (a single-thread executor,
+    so writes keep their order) if given.
+    """
+    if writer is None:
+        save(*args)
+    else:
+        writer.submit(save, *args).add_done_callback(_report_save_error)
+
+def _report_save_error(future):
+    if future.exception() is not None:
+        print(f"[WARNING] Failed to save a frame result: {future.exception()}")
+
+def _record_result(results, stats, result, cache=None, cache_key=None, pbar=None, verbose=True, on_result=None, checkpoint=None, writer=None):
+    """
+    Add a finished frame result to results, update the counters and the progress bar, store
+    successful results in the frame cache and the run checkpoint (through writer if given) and
+    pass the result to the on_result callback.
+    """
+    results.append(result)
+    if on_result:
+        on_result(result)
+    metrics.FRAMES.labels("success" if result['success'] else "failed").inc()
+    if result.get('elapsed_time') is not None:
+        metrics.FRAME_SECONDS.observe(result['elapsed_time'])
+    
+    if result['success']:
+        if cache_key:
+            _save_result(writer, cache.put, cache_key, result)
+        if checkpoint:
+            _save_result(writer, checkpoint.append, result)
+        stats['successful_calls'] += 1
+        if result.get('tokens_used'):
+            stats['total_tokens'] += result['tokens_used']
+        stats['prompt_tokens'] += result.get('prompt_tokens') or 0
+        stats['cached_tokens'] += result.get('cached_tokens') or 0
+        stats['total_api_time'] += result['elapsed_time']
+        if verbose and pbar is not None:
+            pbar.set_postfix({
+                "success": stats['successful_calls'],
+                "failed": stats['failed_calls'],
+                "avg_time": f"{stats['total_api_time']/stats['successful_calls']:.2f}s" if stats['successful_calls'] > 0 else "0s"
+            })
+    else:
+        stats['failed_calls'] += 1
+        if verbose and pbar is not None:
+            pbar.set_postfix({
+                "success": stats['successful_calls'],
+                "failed": stats['failed_calls']
+            })
+    
+    if pbar is not None:
+        pbar.update(1)
+
+def _reuse_result(results, result, pbar=None, on_result=None, checkpoint=None, status="cached", writer=None):
+    """Add a result that needed no API call (resumed, or a frame cache hit) to results and to the run checkpoint if given."""
+    metrics.FRAMES.labels(status).inc()
+    results.append(result)
+    if on_result:
+        on_result(result)
+    if checkpoint:
+        _save_result(writer, checkpoint.append, result)
+    if pbar is not None:
+        pbar.update(1)
+
+def _exception_result(second, error) -> Dict:
+    """Result dict for a frame whose worker raised unexpectedly."""
+    return {
+        'second': second,
+        'analysis': f"Exception: {str(error)}",
+        'success': False,
+        'error': str(error)
+    }
+
+def _analyze_encoded_frames(executor, client, encoded_frames, prompt, max_in_flight=None, total=None, cache=None, detail=IMAGE_DETAIL, cache_settings="", batch_size=1, on_result=None, limiter=None, checkpoint=None, resumed=None, router=None, structured=False, reask_budget=REASK_BUDGET, verbose=True):
+    """
+    Submit encoded frames to the executor and collect the results as they complete.
+    encoded_frames is any iterable of (second, frame_base64, size_kb, frame_hash) tuples. When
+    max_in_flight is set, at most that many frames are submitted but unfinished at any time, which
+    keeps a streaming source from being drained faster than the API can keep up.
+    With a FrameCache, frames whose result is cached are answered without an API call and new
+    successful results are stored; cache_settings is mixed into the cache key so results produced
+    with different encoding settings are kept apart.
+    With batch_size > 1, consecutive frames are sent together in one request; frames a batch
+    could not answer are resubmitted as single-frame calls.
+    on_result, if given, is called with every frame result as soon as it is available.
+    With a RateLimiter, workers only send a request when the limiter has a free slot, so the
+    executor may be sized for the limiter's maximum concurrency.
+    With a RunCheckpoint, successful results are saved to it as they arrive; seconds in resumed
+    ({second: result} from an earlier run) are taken from there instead of being analyzed.
+    With a ModelRouter, frames go to its fast model first and are escalated as it decides.
+    With structured, answers are constrained to the prompt's JSON schema, and frames that still
+    failed are re-asked after the main pass, up to reask_budget requests (see ReaskPass).
+    Returns (results, stats).
+    """
+    results = []
+    stats = _new_stats()
+    reasks = ReaskPass(reask_budget if structured else 0)
+    pending = {}  # future -> (list of (second, frame_index, frame_base64, cache_key) it answers, model, re-ask)
+    in_flight = 0
+    pbar = tqdm(total=total, desc="Analyzing frames", unit="frame", disable=not verbose)
+    
+    def submit(items, model=None, reask=False):
+        nonlocal in_flight
+        model = model or (router.fast_model if router else OPENAI_MODEL)
+        if len(items) == 1:
+            second, idx, frame_base64, _ = items[0]
+            args = (client, frame_base64, prompt, second, idx, detail, limiter, model, structured)
+            future = executor.submit(tracing.bind(analyze_frame_with_openai, queued="executor_queue"), args)
+        else:
+            frames = [(second, idx, frame_base64) for second, idx, frame_base64, _ in items]
+            future = executor.submit(tracing.bind(analyze_frames_batch_with_openai, queued="executor_queue"), (client, frames, prompt, detail, limiter, model, structured))
+            stats['batch_requests'] += 1
+        pending[future] = (items, model, reask)
+        in_flight += len(items)
+    
+    def record(item, result):
+        if not reasks.defer(item, result):
+            _record_result(results, stats, result, cache, item[3], pbar, verbose, on_result, checkpoint)
+    
+    def handle(actions):
+        for action, item, result in actions:
+            if action == 'escalate':
+                submit([item], router.model)
+            else:
+                record(item, result)
+    
+    def finish(item, model, result, reask=False):
+        _count_answer(stats, result, reask)
+        if reask:
+            record(item, dict(result, reasked=reasks.tries[item[1]], **({'model': model} if router else {})))
+        elif router is None:
+            record(item, result)
+        else:
+            handle(router.on_result(item, model, result))
+    
+    def collect(future):
+        nonlocal in_flight
+        items, model, reask = pending.pop(future)
+        in_flight -= len(items)
+        try:
+            outcome = future.result()
+        except Exception as e:
+            for item in items:
+                if verbose:
+                    print(f"\n[ERROR] Exception processing frame at {item[0]}s: {e}")
+                finish(item, model, _exception_result(item[0], e), reask)
+            return
+        
+        if isinstance(outcome, dict):
+            outcome = [outcome]
+        for item, result in zip(items, outcome):
+            if result is None:
+                # The batch did not answer this frame; ask for it on its own
+                stats['batch_fallbacks'] += 1
+                submit([item], model)
+            else:
+                finish(item, model, result, reask)
+    
+    def wait_for_capacity():
+        while max_in_flight and in_flight >= max_in_flight:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                collect(future)
+    
+    def drain():
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                collect(future)
+    
+    try:
+        batch = []
+        frames = 0
+        for idx, (second, frame_base64, size_kb, frame_hash) in enumerate(encoded_frames):
+            frames += 1
+            stats['total_size_kb'] += size_kb
+            if resumed and second in resumed:
+                stats['resumed'] += 1
+                _reuse_result(results, resumed[second], pbar, on_result, status="resumed")
+                if router:
+                    handle(router.on_known(idx, resumed[second]))
+                continue
+            cached, cache_key = _lookup_cached_result(cache, stats, frame_hash, prompt, cache_settings, second, idx)
+            if cached is not None:
+                _reuse_result(results, cached, pbar, on_result, checkpoint)
+                if router:
+                    handle(router.on_known(idx, cached))
+                continue
+            batch.append((second, idx, frame_base64, cache_key))
+            if len(batch) >= batch_size:
+                wait_for_capacity()
+                submit(batch)
+                batch = []
+        if batch:
+            submit(batch)
+        if router:
+            handle(router.finish(frames))
+        
+        drain()
+        if router:
+            handle(router.flush())
+        
+        # Re-ask pass: the frames that still failed, one request each
+        items = reasks.take()
+        while items:
+            for item in items:
+                submit([item], router.model if router else OPENAI_MODEL, reask=True)
+            drain()
+            items = reasks.take()
+        if router:
+            stats.update(router.stats())
+    finally:
+        for future in pending:
+            future.cancel()
+        pbar.close()
+    
+    return results, stats
+
+async def _aiter_in_thread(iterable):
+    """
+    Iterate a blocking iterable (e.g. stream_encoded_frames) from async code, fetching each item
+    in a worker thread so the event loop is never blocked by decoding or encoding.
+    """
+    iterator = iter(iterable)
+    try:
+        while True:
+            item = await asyncio.to_thread(next, iterator, _STREAM_END)
+            if item is _STREAM_END:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close:
+            try:
+                close()
+            except ValueError:
+                pass  # Still executing in its worker thread; it stops at the next item
+
+async def _analyze_encoded_frames_async(client, encoded_frames, prompt, max_concurrency=MAX_WORKERS, max_in_flight=None, total=None, cache=None, detail=IMAGE_DETAIL, cache_settings="", batch_size=1, on_result=None, limiter=None, checkpoint=None, resumed=None, router=None, structured=False, reask_budget=REASK_BUDGET, verbose=True):
+    """
+    Async version of _analyze_encoded_frames: one task per request on the event loop, with at most
+    max_concurrency requests to OpenAI outstanding at a time (asyncio.Semaphore), fewer when the
+    RateLimiter's current limit is lower. Frame cache lookups run in a thread and frame cache and
+    checkpoint writes on a writer thread, so SQLite commits and file writes never block the loop.
+    encoded_frames may be a regular or an async iterable.
+    Returns (results, stats).
+    """
+    results = []
+    stats = _new_stats()
+    reasks = ReaskPass(reask_budget if structured else 0)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks = {}  # task -> number of frames it answers
+    writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-writer") if cache is not None or checkpoint else None
+    pbar = tqdm(total=total, desc="Analyzing frames", unit="frame", disable=not verbose)
+    
+    async def run(items, model=None, reask=False):
+        model = model or (router.fast_model if router else OPENAI_MODEL)
+        try:
+            async with semaphore:
+                if len(items) == 1:
+                    second, idx, frame_base64, _ = items[0]
+                    outcome = [await analyze_frame_with_openai_async(client, frame_base64, prompt, second, idx, detail, limiter, model, structured)]
+                else:
+                    frames = [(second, idx, frame_base64) for second, idx, frame_base64, _ in items]
+                    stats['batch_requests'] += 1
+                    outcome = await analyze_frames_batch_with_openai_async(client, frames, prompt, detail, limiter, model, structured)
+        except Exception as e:
+            for item in items:
+                if verbose:
+                    print(f"\n[ERROR] Exception processing frame at {item[0]}s: {e}")
+                finish(item, model, _exception_result(item[0], e), reask)
+            return
+        
+        for item, result in zip(items, outcome):
+            if result is None:
+                # The batch did not answer this frame; ask for it on its own
+                stats['batch_fallbacks'] += 1
+                await run([item], model)
+            else:
+                finish(item, model, result, reask)
+    
+    def record(item, result):
+        if not reasks.defer(item, result):
+            _record_result(results, stats, result, cache, item[3], pbar, verbose, on_result, checkpoint, writer)
+    
+    def handle(actions):
+        for action, item, result in actions:
+            if action == 'escalate':
+                spawn([item], router.model)
+            else:
+                record(item, result)
+    
+    def finish(item, model, result, reask=False):
+        _count_answer(stats, result, reask)
+        if reask:
+            record(item, dict(result, reasked=reasks.tries[item[1]], **({'model': model} if router else {})))
+        elif router is None:
+            record(item, result)
+        else:
+            handle(router.on_result(item, model, result))
+    
+    def spawn(items, model=None, reask=False):
+        task = asyncio.ensure_future(run(items, model, reask))
+        tasks[task] = len(items)
+        task.add_done_callback(lambda done: tasks.pop(done, None))
+    
+    async def submit(items):
+        while max_in_flight and sum(tasks.values()) >= max_in_flight:
+            await asyncio.wait(list(tasks), return_when=asyncio.FIRST_COMPLETED)
+        spawn(items)
+    
+    if not hasattr(encoded_frames, '__aiter__'):
+        encoded_frames = _aiter_in_thread(encoded_frames)
+    
+    try:
+        batch = []
+        idx = 0
+        async for second, frame_base64, size_kb, frame_hash in encoded_frames:
+            stats['total_size_kb'] += size_kb
+            if resumed and second in resumed:
+                stats['resumed'] += 1
+                _reuse_result(results, resumed[second], pbar, on_result, status="resumed")
+                if router:
+                    handle(router.on_known(idx, resumed[second]))
+                idx += 1
+                continue
+            if cache is not None:
+                cached, cache_key = await asyncio.to_thread(_lookup_cached_result, cache, stats, frame_hash, prompt, cache_settings, second, idx)
+            else:
+                cached, cache_key = None, None
+            if cached is not None:
+                _reuse_result(results, cached, pbar, on_result, checkpoint, writer=writer)
+                if router:
+                    handle(router.on_known(idx, cached))
+            else:
+                batch.append((second, idx, frame_base64, cache_key))
+                if len(batch) >= batch_size:
+                    await submit(batch)
+                    batch = []
+            idx += 1
+        if batch:
+            await submit(batch)
+        if router:
+            handle(router.finish(idx))
+        
+        while tasks:
+            await asyncio.wait(list(tasks))
+        if router:
+            handle(router.flush())
+        
+        # Re-ask pass: the frames that still failed, one request each
+        items = reasks.take()
+        while items:
+            for item in items:
+                spawn([item], router.model if router else OPENAI_MODEL, reask=True)
+            while tasks:
+                await asyncio.wait(list(tasks))
+            items = reasks.take()
+        if router:
+            stats.update(router.stats())
+    finally:
+        for task in tasks:
+            task.cancel()
+        if writer is not None:
+            # Wait for the queued writes, so the checkpoint and the cache are complete when the run returns
+            await asyncio.to_thread(writer.shutdown)
+        pbar.close()
+    
+    return results, stats
+
 def is_supported_video_format(file_path):
     """
     Check if the video file format is supported.
@@ -264,11 +1548,25 @@ def save_json_results(results: List[Dict], video_path: str, output_dir: str = "o
         print(f"[WARNING] Failed to save {filename}: {e}")
         return 0, output_dir, None
 
-def process_video(video_path, prompt="What is happening in this image? Describe the scene, actions, and any notable details.", max_workers=MAX_WORKERS, verbose=True):
+def _cache_settings(max_dimension, jpeg_quality, detail, routing_model=None) -> str:
+    """Settings mixed into frame cache and checkpoint keys, so results made with other settings are kept apart."""
+    settings = f"{max_dimension}:{jpeg_quality}:{detail}"
+    return f"{settings}:{routing_model}" if routing_model else settings
+
+def _checkpoint_settings(cache_settings, sampler, adaptive, change_threshold, batch_size, structured_output) -> str:
     """
-    Main function to process video: extract frames and analyze with OpenAI.
+    Settings mixed into run checkpoint keys on top of the frame cache's: those that change which
+    seconds are analyzed or how they are asked, so a resumed run never reuses results made with others.
     """
-    start_time = time.time()
+    skipping = f"adaptive={change_threshold}" if adaptive else "all"
+    return f"{cache_settings}:{sampler}:{skipping}:batch={batch_size}:structured={bool(structured_output)}"
+
+def _start_run(video_path, prompt, max_workers, max_concurrency, batch_size, max_dimension, jpeg_quality, detail, verbose=True, routing_model=None, structured_output=False, reask_budget=REASK_BUDGET):
+    """
+    Validate the inputs of a run and print its header.
+    """
+    if detail not in IMAGE_DETAILS:
+        raise ValueError(f"Unknown image detail: {detail}. Supported: {', '.join(IMAGE_DETAILS)}")
     
     if verbose:
         print("="*60)
@@ -292,19 +1590,91 @@ def process_video(video_path, prompt="What is happening in this image? Describe
     if verbose:
         print(f"[INFO] Processing video: {video_path}")
         print(f"[INFO] Prompt: {prompt}")
-        print(f"[INFO] Using {max_workers} parallel workers for API calls\n")
+        print(f"[INFO] Starting with {max_workers} parallel API calls, adapting up to {max_concurrency} to the rate limits")
+        if batch_size > 1:
+            print(f"[INFO] Batching up to {batch_size} frames per request")
+        if routing_model:
+            print(f"[INFO] Model routing: {routing_model} first, escalating to {OPENAI_MODEL}")
+        if structured_output:
+            print(f"[INFO] Structured outputs: answers constrained to the prompt's JSON schema")
+        if structured_output and reask_budget > 0:
+            print(f"[INFO] Re-asking frames that still fail: up to {reask_budget} requests, {REASK_ATTEMPTS} per frame")
+        print(f"[INFO] Frame encoding: max dimension {max_dimension or 'full'}, JPEG quality {jpeg_quality}, detail {detail}\n")
+
+def _prepare_encoded_frames(video_path, max_workers=MAX_WORKERS, streaming=False, queue_size=STREAM_QUEUE_SIZE, sampler=DEFAULT_SAMPLER, adaptive=False, change_threshold=ADAPTIVE_CHANGE_THRESHOLD, with_hash=False, max_dimension=MAX_FRAME_DIMENSION, jpeg_quality=JPEG_QUALITY, batch_size=BATCH_SIZE, decode_workers=DECODE_WORKERS, decode_backend=DECODE_BACKEND, verbose=True):
+    """
+    Set up the frame source of a run.
+    Returns (encoded_frames, expected_frames, max_in_flight, skipped): encoded_frames is a list
+    (phased mode) or a lazy iterator fed by background threads (streaming mode), and skipped is
+    the {skipped_second: analyzed_second} dict filled by adaptive sampling.
+    With decode_backend="ffmpeg-mjpeg", frames come out of ffmpeg as JPEGs, unless adaptive
+    sampling or the frame cache needs their pixels, in which case raw ffmpeg frames are used.
+    """
+    _check_decode_backend(decode_backend)
+    skipped = {}
+    mjpeg = decode_backend == 'ffmpeg-mjpeg' and not adaptive and not with_hash
+    if decode_backend == 'ffmpeg-mjpeg' and not mjpeg and verbose:
+        print("[INFO] Adaptive sampling / frame cache need decoded frames: using raw ffmpeg frames instead of MJPEG")
+    if decode_backend != 'opencv' and decode_workers > 1 and verbose:
+        print("[INFO] Decoding in one ffmpeg process (--decode-workers only applies to the opencv backend; FFMPEG_THREADS sets ffmpeg's threads)")
+    if streaming:
+        # Decode, encode and analyze concurrently; bounded queues keep memory flat
+        if verbose:
+            print(f"[INFO] Streaming mode: queue size {queue_size}, up to {max_workers * batch_size + queue_size} frames in flight\n")
+        if mjpeg:
+            encoded_frames = stream_encoded_frames(
+                iter_encoded_frames_ffmpeg(video_path, fps=1, max_dimension=max_dimension, jpeg_quality=jpeg_quality, verbose=False),
+                queue_size=queue_size, encoded=True
+            )
+            return encoded_frames, probe_video(video_path)['expected_samples'], max_workers * batch_size + queue_size, skipped
+        if decode_backend != 'opencv':
+            expected_frames = probe_video(video_path)['expected_samples']
+            # At most queue_size frames are queued, one is being encoded and one read, so this ring (one to spare) never overwrites a live frame
+            frame_source = iter_frames_ffmpeg(video_path, fps=1, max_dimension=max_dimension, buffers=queue_size + 3, verbose=False)
+        elif decode_workers > 1:
+            expected_frames = probe_video(video_path)['expected_samples']
+            if verbose:
+                print(f"[INFO] Decoding time ranges of the video in {decode_workers} processes")
+            frame_source = iter_frames_parallel(video_path, fps=1, sampler=sampler, workers=decode_workers, verbose=False)
+        else:
+            cap, video_fps, total_frames, duration = _open_video(video_path, fps=1, sampler=sampler, verbose=verbose)
+            expected_frames = _expected_sample_count(duration, fps=1)
+            frame_source = _decode_frames(cap, video_fps, total_frames, fps=1, sampler=sampler, verbose=False)
+        if adaptive:
+            frame_source = skip_similar_frames(frame_source, skipped, threshold=change_threshold)
+            expected_frames = None
+        encoded_frames = stream_encoded_frames(
+            frame_source, queue_size=queue_size, with_hash=with_hash,
+            max_dimension=max_dimension, jpeg_quality=jpeg_quality
+        )
+        return encoded_frames, expected_frames, max_workers * batch_size + queue_size, skipped
+    
+    if mjpeg:
+        start = time.perf_counter()
+        with tracing.span("extract", backend=decode_backend) as span:
+            encoded_frames = list(iter_encoded_frames_ffmpeg(video_path, fps=1, max_dimension=max_dimension, jpeg_quality=jpeg_quality, verbose=verbose))
+            span.set(frames=len(encoded_frames))
+        metrics.EXTRACT_SECONDS.observe(time.perf_counter() - start)
+        metrics.FRAMES_EXTRACTED.inc(len(encoded_frames))
+        if verbose:
+            print(f"[INFO] Encoded {len(encoded_frames)} frames (Total size: {sum(item[2] for item in encoded_frames):.2f} KB)\n")
+            print(f"[INFO] Preparing {len(encoded_frames)} API calls...")
+        return encoded_frames, len(encoded_frames), None, skipped
     
     # Extract frames
-    frames, video_fps = extract_frames(video_path, fps=1, verbose=verbose)
+    start = time.perf_counter()
+    with tracing.span("extract", backend=decode_backend, decode_workers=decode_workers) as span:
+        frames, video_fps = extract_frames(video_path, fps=1, sampler=sampler, verbose=verbose, workers=decode_workers,
+                                           backend=decode_backend, max_dimension=max_dimension)
+        span.set(frames=len(frames))
+    metrics.EXTRACT_SECONDS.observe(time.perf_counter() - start)
+    metrics.FRAMES_EXTRACTED.inc(len(frames))
     if verbose:
         print(f"\n[INFO] Extracted {len(frames)} frames from video (FPS: {video_fps:.2f})\n")
-    
-    # Initialize OpenAI client
-    if verbose:
-        print("[INFO] Initializing OpenAI client...")
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    if verbose:
-        print("[INFO] OpenAI client initialized\n")
+    if adaptive:
+        frames = list(skip_similar_frames(frames, skipped, threshold=change_threshold))
+        if verbose:
+            print(f"[INFO] Adaptive sampling: {len(frames)} frames changed enough to analyze, {len(skipped)} skipped\n")
     
     # Encode all frames to base64
     if verbose:
@@ -312,86 +1682,37 @@ def process_video(video_path, prompt="What is happening in this image? Describe
     encoded_frames = []
     total_size = 0
     pbar = tqdm(total=len(frames), desc="Encoding frames", unit="frame", disable=not verbose)
-    for second, frame in frames:
-        frame_base64, size_kb = encode_frame_to_base64(frame)
-        encoded_frames.append((second, frame_base64, size_kb))
-        total_size += size_kb
-        pbar.update(1)
+    with tracing.span("encode", frames=len(frames)):
+        for second, frame in frames:
+            frame_base64, size_kb = encode_frame_to_base64(frame, max_dimension, jpeg_quality)
+            frame_hash = perceptual_hash(frame) if with_hash else None
+            encoded_frames.append((second, frame_base64, size_kb, frame_hash))
+            total_size += size_kb
+            pbar.update(1)
     pbar.close()
+    del frames
     
     if verbose:
         print(f"[INFO] Encoded {len(encoded_frames)} frames (Total size: {total_size:.2f} KB)\n")
-    
-    # Prepare arguments for parallel processing
-    if verbose:
         print(f"[INFO] Preparing {len(encoded_frames)} API calls...")
-    api_args = [
-        (client, frame_base64, prompt, second, idx)
-        for idx, (second, frame_base64, _) in enumerate(encoded_frames)
-    ]
-    
-    # Process frames in parallel with progress bar
-    if verbose:
-        print(f"[INFO] Making parallel API calls with {max_workers} workers...")
-    results = []
-    successful_calls = 0
-    failed_calls = 0
-    total_tokens = 0
-    total_api_time = 0
-    
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        future_to_frame = {
-            executor.submit(analyze_frame_with_openai, args): args[3]  # args[3] is 'second'
-            for args in api_args
-        }
-        
-        # Process completed tasks with progress bar
-        pbar = tqdm(total=len(future_to_frame), desc="Analyzing frames", unit="frame", disable=not verbose)
-        try:
-            for future in as_completed(future_to_frame):
-                second = future_to_frame[future]
-                try:
-                    result = future.result()
-                    results.append(result)
-                    
-                    if result['success']:
-                        successful_calls += 1
-                        if result.get('tokens_used'):
-                            total_tokens += result['tokens_used']
-                        total_api_time += result['elapsed_time']
-                        if verbose:
-                            pbar.set_postfix({
-                                "success": successful_calls,
-                                "failed": failed_calls,
-                                "avg_time": f"{total_api_time/successful_calls:.2f}s" if successful_calls > 0 else "0s"
-                            })
-                    else:
-                        failed_calls += 1
-                        if verbose:
-                            pbar.set_postfix({
-                                "success": successful_calls,
-                                "failed": failed_calls
-                            })
-                except Exception as e:
-                    failed_calls += 1
-                    if verbose:
-                        print(f"\n[ERROR] Exception processing frame at {second}s: {e}")
-                    results.append({
-                        'second': second,
-                        'analysis': f"Exception: {str(e)}",
-                        'success': False,
-                        'error': str(e)
-                    })
-                    if verbose:
-                        pbar.set_postfix({
-                            "success": successful_calls,
-                            "failed": failed_calls
-                        })
-                
-                pbar.update(1)
-        finally:
-            pbar.close()
+    return encoded_frames, len(encoded_frames), None, skipped
+
+def _finish_run(results, stats, skipped, video_path, start_time, streaming=False, adaptive=False, cache=None, batch_size=BATCH_SIZE, limiter=None, checkpoint=None, verbose=True):
+    """
+    Fill in skipped seconds, sort and save the results, and print the run summary.
+    The run checkpoint is deleted once every frame succeeded and the results are saved; otherwise
+    it is kept so a resumed run only retries the failed seconds.
+    """
+    successful_calls = stats['successful_calls']
+    failed_calls = stats['failed_calls']
+    total_tokens = stats['total_tokens']
+    total_api_time = stats['total_api_time']
+    metrics.VIDEO_SECONDS.observe(time.time() - start_time)
+    if streaming and verbose:
+        print(f"[INFO] Streamed {len(results)} frames (Total size: {stats['total_size_kb']:.2f} KB)")
+    analyzed_frames = len(results)
+    if skipped:
+        fill_skipped_results(results, skipped)
     
     # Sort results by second
     results.sort(key=lambda x: x['second'])
@@ -399,54 +1720,467 @@ def process_video(video_path, prompt="What is happening in this image? Describe
     # Save JSON results locally
     if verbose:
         print(f"\n[INFO] Saving JSON results...")
-    saved_count, output_dir, filepath = save_json_results(results, video_path)
+    with tracing.span("save_results", frames=len(results)):
+        saved_count, output_dir, filepath = save_json_results(results, video_path)
     if verbose:
         if filepath:
             print(f"[INFO] Saved {saved_count} results to '{filepath}'")
         else:
             print(f"[WARNING] Failed to save JSON file")
+    if checkpoint is not None:
+        if filepath and failed_calls == 0:
+            checkpoint.remove()
+        else:
+            checkpoint.close()
+            if verbose:
+                print(f"[INFO] Kept checkpoint '{checkpoint.path}'; run again with resume to retry the failed frames")
     
     # Print summary
     if verbose:
         elapsed_total = time.time() - start_time
         print(f"\n[INFO] Processing complete!")
         print(f"  - Total time: {elapsed_total:.2f} seconds")
-        print(f"  - Successful API calls: {successful_calls}/{len(results)}")
-        print(f"  - Failed API calls: {failed_calls}/{len(results)}")
+        print(f"  - Successful API calls: {successful_calls}/{analyzed_frames - stats['cache_hits'] - stats['resumed']}")
+        print(f"  - Failed API calls: {failed_calls}/{analyzed_frames - stats['cache_hits'] - stats['resumed']}")
+        if stats['resumed']:
+            print(f"  - Frames resumed from checkpoint: {stats['resumed']}")
+        if adaptive:
+            print(f"  - Frames skipped (scene unchanged): {len(skipped)}/{len(results)}")
         print(f"  - Results saved to JSON: {saved_count}/{len(results)}")
         if successful_calls > 0:
             print(f"  - Average API call time: {total_api_time/successful_calls:.2f} seconds")
             print(f"  - Total tokens used: {total_tokens}")
             print(f"  - Estimated cost: ${total_tokens * 0.01 / 1000:.4f} (assuming $0.01 per 1K tokens)")
+        if stats['prompt_tokens']:
+            print(f"  - Prompt tokens from OpenAI's prompt cache: {stats['cached_tokens']}/{stats['prompt_tokens']} ({stats['cached_tokens'] / stats['prompt_tokens']:.1%})")
+        if cache is not None:
+            print(f"  - Frame cache: {stats['cache_hits']} hits, {stats['cache_misses']} misses")
+        if batch_size > 1:
+            print(f"  - Batched requests: {stats['batch_requests']} (up to {batch_size} frames each), single-frame fallbacks: {stats['batch_fallbacks']}")
+        if stats['tiers']:
+            for model, tier in stats['tiers'].items():
+                average = f", avg {tier['total_time'] / tier['calls']:.2f}s" if tier['calls'] else ""
+                print(f"  - Model {model}: {tier['calls']} frame calls ({tier['failed']} failed){average}, {tier['tokens']} tokens")
+            escalations = stats['escalations']
+            print(f"  - Escalated to {OPENAI_MODEL}: {sum(escalations.values())} frames ("
+                  + ", ".join(f"{reason} {count}" for reason, count in escalations.items()) + ")")
+        if stats['answers']:
+            print(f"  - Unparseable answers: {stats['parse_failures']}/{stats['answers']} ({stats['parse_failures'] / stats['answers']:.1%})")
+        if stats['reasks']:
+            print(f"  - Re-asked frames: {stats['reasks']} requests, {stats['reasks_recovered']} recovered")
+        if limiter is not None:
+            limiter_stats = limiter.stats()
+            print(f"  - Rate limits: {limiter_stats['rate_limited']} rate-limited responses, {limiter_stats['retries']} retries")
+            print(f"  - Concurrency limit: ended at {limiter_stats['concurrency_limit']:.1f} (peak {limiter_stats['peak_concurrency_limit']:.1f})")
     # Silent mode: no output (for API usage)
     
     return results
 
+def _open_checkpoint(video_path, prompt, settings, checkpoint_dir=None, resume=False, verbose=True):
+    """
+    Set up the run checkpoint when checkpoint_dir is given or resume is set.
+    Returns (checkpoint, resumed): resumed maps the seconds an earlier run finished to their results.
+    """
+    if checkpoint_dir is None and not resume:
+        return None, {}
+    checkpoint = RunCheckpoint(video_path, prompt, OPENAI_MODEL, settings, checkpoint_dir or CHECKPOINT_DIR)
+    resumed = checkpoint.load() if resume else {}
+    checkpoint.open(resume=resume)
+    if verbose:
+        print(f"[INFO] Checkpointing frame results to '{checkpoint.path}'")
+        if resume:
+            print(f"[INFO] Resuming: {len(resumed)} frames already analyzed\n")
+    return checkpoint, resumed
+
+def process_video(video_path, prompt="What is happening in this image? Describe the scene, actions, and any notable details.", max_workers=MAX_WORKERS, verbose=True, streaming=False, queue_size=STREAM_QUEUE_SIZE, sampler=DEFAULT_SAMPLER, adaptive=False, change_threshold=ADAPTIVE_CHANGE_THRESHOLD, cache: Optional[FrameCache] = None, max_dimension=MAX_FRAME_DIMENSION, jpeg_quality=JPEG_QUALITY, detail=IMAGE_DETAIL, batch_size=BATCH_SIZE, on_result=None, max_concurrency=MAX_CONCURRENCY, rate_limiter: Optional[RateLimiter] = None, checkpoint_dir: Optional[str] = None, resume=False, decode_workers=DECODE_WORKERS, decode_backend=DECODE_BACKEND, routing_model=ROUTING_MODEL, structured_output=STRUCTURED_OUTPUT, reask_budget=REASK_BUDGET):
+    """
+    Main function to process video: extract frames and analyze with OpenAI.
+    With streaming=True, frames are decoded, encoded and sent to the API as they become
+    available instead of in three separate passes over the whole video; peak memory then
+    depends on queue_size rather than on the video length.
+    With adaptive=True, frames that barely differ from the last analyzed frame are not sent to
+    the API; their seconds inherit that frame's labels in the returned results.
+    With a FrameCache, each frame is looked up by perceptual hash, prompt and model before it is
+    submitted to the executor, and only cache misses are sent to the API.
+    max_dimension, jpeg_quality and detail control the size of each frame sent to the API and the
+    image detail level requested, which together determine payload size and image-token cost.
+    With batch_size > 1, that many consecutive frames are sent in one request; frames whose
+    batch reply cannot be parsed are retried with single-frame requests.
+    on_result, if given, is called with each frame result as soon as it is available (e.g. for
+    progress reporting); results for skipped seconds are only added at the end.
+    API calls are scheduled by a RateLimiter: concurrency starts at max_workers and is adjusted
+    between 1 and max_concurrency (AIMD on 429s), requests wait for the requests/tokens per
+    minute budget reported by the API, and rate-limited or failed calls are retried with jittered
+    backoff. Pass rate_limiter to share one limiter between several runs (e.g. all requests of a
+    server using one API key); the run itself still makes at most max_concurrency calls at a time.
+    With checkpoint_dir, each successful frame result is appended to a checkpoint file (keyed by
+    the video's content hash, prompt, model and the settings of _checkpoint_settings) as soon as it arrives. With
+    resume=True (checkpoint_dir defaults to CHECKPOINT_DIR), the seconds found in the checkpoint of
+    an earlier, interrupted run are reused and only the missing ones are sent to the API.
+    With decode_workers > 1, time ranges of the video are decoded in that many processes
+    (see iter_frames_parallel). decode_backend="ffmpeg" / "ffmpeg-mjpeg" decodes (and with
+    ffmpeg-mjpeg, JPEG-encodes) the frames in an ffmpeg subprocess instead of OpenCV (see
+    iter_frames_ffmpeg).
+    With routing_model, frames are analyzed by that (cheaper) model first and only re-sent to
+    OPENAI_MODEL when its answer is unusable or suspicious (see ModelRouter).
+    With structured_output, answers are constrained to the prompt's JSON schema (see
+    response_format), and frames that still failed after all that are re-asked on their own, up
+    to reask_budget requests per run (see ReaskPass).
+    """
+    start_time = time.time()
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    limiter = rate_limiter or RateLimiter(max_workers, max(max_workers, max_concurrency))
+    # A shared limiter bounds the calls of all its runs together; this run makes at most max_concurrency of them
+    run_concurrency = min(limiter.max_concurrency, max(max_workers, max_concurrency))
+    _start_run(video_path, prompt, max_workers, run_concurrency, batch_size, max_dimension, jpeg_quality, detail, verbose, routing_model, structured_output, reask_budget)
+    router = ModelRouter(routing_model) if routing_model else None
+    
+    # Shared OpenAI client: its connection pool is reused across videos (retries are handled by the rate limiter)
+    if verbose:
+        print("[INFO] Initializing OpenAI client...")
+    client = clients.get_openai_client()
+    if verbose:
+        print("[INFO] OpenAI client initialized\n")
+    
+    cache_settings = _cache_settings(max_dimension, jpeg_quality, detail, routing_model)
+    checkpoint_settings = _checkpoint_settings(cache_settings, sampler, adaptive, change_threshold, batch_size, structured_output)
+    checkpoint, resumed = _open_checkpoint(video_path, prompt, checkpoint_settings, checkpoint_dir, resume, verbose)
+    try:
+        encoded_frames, expected_frames, max_in_flight, skipped = _prepare_encoded_frames(
+            video_path, max_workers=run_concurrency, streaming=streaming, queue_size=queue_size,
+            sampler=sampler, adaptive=adaptive, change_threshold=change_threshold,
+            with_hash=cache is not None, max_dimension=max_dimension, jpeg_quality=jpeg_quality,
+            batch_size=batch_size, decode_workers=decode_workers, decode_backend=decode_backend, verbose=verbose
+        )
+        
+        # Process frames in parallel with progress bar; the limiter decides how many threads call the API
+        if verbose:
+            print(f"[INFO] Making parallel API calls with up to {run_concurrency} workers...")
+        with ThreadPoolExecutor(max_workers=run_concurrency) as executor:
+            with tracing.span("analyze_frames", streaming=streaming, batch_size=batch_size) as span:
+                results, stats = _analyze_encoded_frames(
+                    executor, client, encoded_frames, prompt,
+                    max_in_flight=max_in_flight, total=expected_frames, cache=cache, detail=detail,
+                    cache_settings=cache_settings, batch_size=batch_size,
+                    on_result=on_result, limiter=limiter, checkpoint=checkpoint, resumed=resumed, router=router,
+                    structured=structured_output, reask_budget=reask_budget, verbose=verbose
+                )
+                _trace_stats(span, stats)
+        
+        return _finish_run(
+            results, stats, skipped, video_path, start_time, streaming=streaming,
+            adaptive=adaptive, cache=cache, batch_size=batch_size, limiter=limiter, checkpoint=checkpoint, verbose=verbose
+        )
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+async def process_video_async(video_path, prompt="What is happening in this image? Describe the scene, actions, and any notable details.", max_workers=MAX_WORKERS, verbose=True, streaming=False, queue_size=STREAM_QUEUE_SIZE, sampler=DEFAULT_SAMPLER, adaptive=False, change_threshold=ADAPTIVE_CHANGE_THRESHOLD, cache: Optional[FrameCache] = None, max_dimension=MAX_FRAME_DIMENSION, jpeg_quality=JPEG_QUALITY, detail=IMAGE_DETAIL, batch_size=BATCH_SIZE, on_result=None, max_concurrency=MAX_CONCURRENCY, rate_limiter: Optional[RateLimiter] = None, checkpoint_dir: Optional[str] = None, resume=False, decode_workers=DECODE_WORKERS, decode_backend=DECODE_BACKEND, routing_model=ROUTING_MODEL, structured_output=STRUCTURED_OUTPUT, reask_budget=REASK_BUDGET):
+    """
+    Async version of process_video built on AsyncOpenAI, for use inside an event loop.
+    Same arguments and results; requests are tasks on the event loop instead of thread pool
+    workers, gated by the same RateLimiter. Decoding, encoding and saving run in worker
+    threads so the event loop is never blocked.
+    """
+    start_time = time.time()
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    limiter = rate_limiter or RateLimiter(max_workers, max(max_workers, max_concurrency))
+    # A shared limiter bounds the calls of all its runs together; this run makes at most max_concurrency of them
+    run_concurrency = min(limiter.max_concurrency, max(max_workers, max_concurrency))
+    _start_run(video_path, prompt, max_workers, run_concurrency, batch_size, max_dimension, jpeg_quality, detail, verbose, routing_model, structured_output, reask_budget)
+    router = ModelRouter(routing_model) if routing_model else None
+    
+    cache_settings = _cache_settings(max_dimension, jpeg_quality, detail, routing_model)
+    checkpoint_settings = _checkpoint_settings(cache_settings, sampler, adaptive, change_threshold, batch_size, structured_output)
+    checkpoint, resumed = await asyncio.to_thread(_open_checkpoint, video_path, prompt, checkpoint_settings, checkpoint_dir, resume, verbose)
+    try:
+        encoded_frames, expected_frames, max_in_flight, skipped = await asyncio.to_thread(
+            _prepare_encoded_frames,
+            video_path, max_workers=run_concurrency, streaming=streaming, queue_size=queue_size,
+            sampler=sampler, adaptive=adaptive, change_threshold=change_threshold,
+            with_hash=cache is not None, max_dimension=max_dimension, jpeg_quality=jpeg_quality,
+            batch_size=batch_size, decode_workers=decode_workers, decode_backend=decode_backend, verbose=verbose
+        )
+        
+        if verbose:
+            print(f"[INFO] Making up to {run_concurrency} concurrent API calls...")
+        # The server's shared client if there is one, else a client for this run only
+        shared_client = clients.get_async_openai_client()
+        client = shared_client or clients.make_async_openai_client()
+        try:
+            with tracing.span("analyze_frames", streaming=streaming, batch_size=batch_size) as span:
+                results, stats = await _analyze_encoded_frames_async(
+                    client, encoded_frames, prompt, max_concurrency=run_concurrency,
+                    max_in_flight=max_in_flight, total=expected_frames, cache=cache, detail=detail,
+                    cache_settings=cache_settings, batch_size=batch_size,
+                    on_result=on_result, limiter=limiter, checkpoint=checkpoint, resumed=resumed, router=router,
+                    structured=structured_output, reask_budget=reask_budget, verbose=verbose
+                )
+                _trace_stats(span, stats)
+        finally:
+            if client is not shared_client:
+                await client.close()
+        
+        return await asyncio.to_thread(
+            _finish_run, results, stats, skipped, video_path, start_time, streaming=streaming,
+            adaptive=adaptive, cache=cache, batch_size=batch_size, limiter=limiter, checkpoint=checkpoint, verbose=verbose
+        )
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+def list_videos(path: str) -> List[str]:
+    """
+    The video at path, or the supported videos in a directory (sorted by name).
+    """
+    if not os.path.isdir(path):
+        return [path]
+    return [os.path.join(path, name) for name in sorted(os.listdir(path)) if is_supported_video_format(name)]
+
+def _batch_api_result(outcome, second, frame_index) -> Dict:
+    """
+    Turn the Batch API's output or error line for a frame's request into a result dict, like
+    the answer of a regular call (elapsed_time is None: batch answers have no per-call time).
+    """
+    if outcome is None:
+        return _frame_error_result("No answer from the batch", second, frame_index, None)
+    response = outcome.get('response') or {}
+    if is_answered(outcome):
+        return _frame_result(ChatCompletion.construct(**response['body']), second, frame_index, None)
+    error = outcome.get('error') or (response.get('body') or {}).get('error') or {}
+    code = error.get('code') or response.get('status_code')
+    return _frame_error_result(f"{code}: {error.get('message')}", second, frame_index, None)
+
+def _batch_api_results(run: BatchRun) -> List[List[Dict]]:
+    """The results of each video of a batch run, in order of seconds."""
+    outcomes = run.outcomes()
+    return [
+        [_batch_api_result(outcomes.get(f"{video_index}-{second}"), second, frame_index)
+         for frame_index, second in enumerate(video['seconds'])]
+        for video_index, video in enumerate(run.manifest['videos'])
+    ]
+
+def process_videos_batch(video_paths: List[str], prompt=PROMPT, sampler=DEFAULT_SAMPLER, max_dimension=MAX_FRAME_DIMENSION, jpeg_quality=JPEG_QUALITY, detail=IMAGE_DETAIL, structured_output=STRUCTURED_OUTPUT, batch_dir=BATCH_DIR, poll_interval=BATCH_POLL_INTERVAL, wait=True, verbose=True) -> Optional[Dict[str, List[Dict]]]:
+    """
+    Offline analysis of one or many videos through the OpenAI Batch API, at half the price of
+    regular calls and outside their rate limits, with answers within 24 hours.
+    The per-frame requests of all videos are written to JSONL files and submitted as batches;
+    once the batches finish, their results are downloaded, turned into per-frame results and
+    saved per video like process_video's.
+    The run is kept in batch_dir under a key of the videos' content, the prompt, the model and
+    the settings, so calling this again with the same arguments resumes it: batches still
+    running are polled, and requests that an expired, cancelled or failed batch left unanswered
+    are submitted again (up to BATCH_MAX_ATTEMPTS times). With wait=False the batches are only
+    submitted or checked once.
+    Returns the results by video path, or None while batches are still running.
+    """
+    if detail not in IMAGE_DETAILS:
+        raise ValueError(f"Unknown image detail: {detail}. Supported: {', '.join(IMAGE_DETAILS)}")
+    if not video_paths:
+        raise ValueError("No videos to analyze")
+    for video_path in video_paths:
+        if not os.path.exists(video_path):
+            raise FileNotFoundError(f"Video file not found: {video_path}")
+    
+    if verbose:
+        print("="*60)
+        print("VIDEO ANALYSIS WITH THE OPENAI BATCH API")
+        print("="*60)
+    
+    client = clients.get_openai_client()
+    hashes = [file_sha256(video_path) for video_path in video_paths]
+    settings = f"{_cache_settings(max_dimension, jpeg_quality, detail)}:{sampler}:{structured_output}"
+    run = BatchRun(video_cache_key(",".join(hashes), prompt, OPENAI_MODEL, settings), batch_dir)
+    
+    if run.load():
+        if verbose:
+            print(f"[BATCH] Resuming batch run '{run.dir}'")
+    else:
+        videos = run.manifest['videos'] = [{'path': video_path, 'sha256': digest, 'seconds': []} for video_path, digest in zip(video_paths, hashes)]
+        
+        def requests():
+            for video_index, video in enumerate(videos):
+                if verbose:
+                    print(f"[BATCH] Writing the frames of {video['path']}")
+                for second, frame in iter_frames(video['path'], sampler=sampler, verbose=False):
+                    frame_base64, _ = encode_frame_to_base64(frame, max_dimension, jpeg_quality)
+                    video['seconds'].append(second)
+                    yield f"{video_index}-{second}", _frame_request(prompt, frame_base64, second, detail, OPENAI_MODEL, structured_output)
+        
+        written = run.add_requests(requests())
+        if verbose:
+            print(f"[BATCH] Wrote {written} requests for {len(videos)} video(s) to {len(run.shards)} file(s) in '{run.dir}'")
+    
+    if run.finished() and not run.manifest['done']:
+        # An earlier round finished with unanswered requests: submit them again
+        run.download(client, verbose)
+        outcomes = run.outcomes()
+        unanswered = [f"{video_index}-{second}" for video_index, video in enumerate(run.manifest['videos']) for second in video['seconds']
+                      if not is_answered(outcomes.get(f"{video_index}-{second}"))]
+        resubmitted = run.resubmit(unanswered)
+        if verbose and resubmitted:
+            print(f"[BATCH] Resubmitting {resubmitted} unanswered requests")
+    
+    run.submit(client, metadata={"videos": str(len(video_paths)), "model": OPENAI_MODEL}, verbose=verbose)
+    if not run.poll(client, poll_interval, wait, verbose):
+        if verbose:
+            print(f"[BATCH] Batches are still running; run the same command again to check on them")
+        return None
+    run.download(client, verbose)
+    
+    results_by_video = {}
+    stats = _new_stats()
+    unanswered = []
+    for video_index, (video, results) in enumerate(zip(run.manifest['videos'], _batch_api_results(run))):
+        for result in results:
+            if result['success']:
+                stats['successful_calls'] += 1
+                stats['total_tokens'] += result.get('tokens_used') or 0
+                stats['prompt_tokens'] += result.get('prompt_tokens') or 0
+                stats['cached_tokens'] += result.get('cached_tokens') or 0
+            else:
+                stats['failed_calls'] += 1
+                unanswered.append(f"{video_index}-{result['second']}")
+        saved_count, _, filepath = save_json_results(results, video['path'])
+        results_by_video[video['path']] = results
+        if verbose:
+            print(f"[INFO] {video['path']}: {saved_count}/{len(results)} frames saved to '{filepath}'")
+    
+    retryable = run.resubmittable(unanswered)
+    if not retryable and not run.manifest['done']:
+        run.cleanup(client, verbose)
+    
+    if verbose:
+        total = stats['successful_calls'] + stats['failed_calls']
+        print(f"\n[INFO] Processing complete!")
+        print(f"  - Successful frames: {stats['successful_calls']}/{total}")
+        print(f"  - Failed frames: {stats['failed_calls']}/{total}")
+        print(f"  - Batches: {len(run.shards)} ({sum(shard['requests'] for shard in run.shards)} requests submitted)")
+        if stats['successful_calls'] > 0:
+            print(f"  - Total tokens used: {stats['total_tokens']}")
+            print(f"  - Estimated cost: ${stats['total_tokens'] * 0.005 / 1000:.4f} (assuming $0.01 per 1K tokens, halved by the Batch API)")
+        if stats['prompt_tokens']:
+            print(f"  - Prompt tokens from OpenAI's prompt cache: {stats['cached_tokens']}/{stats['prompt_tokens']} ({stats['cached_tokens'] / stats['prompt_tokens']:.1%})")
+        if retryable:
+            print(f"[INFO] {len(retryable)} frames are unanswered; run the same command again to resubmit them")
+    
+    return results_by_video
+
+def parse_args(argv=None):
+    """
+    Parse command line arguments. The original positional form
+    `python sample.py <video_path> [prompt] [max_workers]` keeps working.
+    """
+    parser = argparse.ArgumentParser(
+        description="Analyze a video frame by frame with the OpenAI Vision API.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join([
+            "Examples:",
+            "  python sample.py video.mp4",
+            "  python sample.py video.mov",
+            "  python sample.py video.mp4 'What is the person doing in this frame?'",
+            "  python sample.py video.mp4 'Describe the scene' 10",
+            "  python sample.py video.mp4 --stream",
+            "  python sample.py video.mp4 --resume      # resumable; run it again to continue",
+            "  python sample.py videos/ --batch-api",
+            "",
+            f"Supported formats: {', '.join(SUPPORTED_FORMATS)}",
+            f"Default max_workers (parallel API calls to start with): {MAX_WORKERS}",
+        ])
+    )
+    parser.add_argument("video_path", help="Path to the video file (with --batch-api, also a directory of videos)")
+    parser.add_argument("prompt", nargs="?", default=PROMPT, help="Prompt sent with every frame (default: prompt.PROMPT)")
+    parser.add_argument("max_workers", nargs="?", default=None, help=f"Number of parallel API calls to start with (default: {MAX_WORKERS})")
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY, help=f"Upper bound for the adaptive number of parallel API calls; set it to max_workers for a fixed number (default: {MAX_CONCURRENCY})")
+    parser.add_argument("--stream", action="store_true", help="Stream frames through decode/encode/analyze instead of running each phase over the whole video")
+    parser.add_argument("--sampler", choices=SAMPLERS, default=DEFAULT_SAMPLER, help=f"Frame sampling engine (default: {DEFAULT_SAMPLER})")
+    parser.add_argument("--decode-backend", choices=DECODE_BACKENDS, default=DECODE_BACKEND, help=f"Frame decoder: OpenCV, or an ffmpeg subprocess with in-filter sampling and scaling, returning raw frames or JPEGs (default: {DECODE_BACKEND})")
+    parser.add_argument("--decode-workers", type=int, default=DECODE_WORKERS, help=f"Processes decoding time ranges of the video in parallel (default: {DECODE_WORKERS})")
+    parser.add_argument("--adaptive", action="store_true", help="Skip frames that barely differ from the last analyzed frame and reuse its labels")
+    parser.add_argument("--change-threshold", type=float, default=ADAPTIVE_CHANGE_THRESHOLD, help=f"Scene change threshold (0-1) for --adaptive (default: {ADAPTIVE_CHANGE_THRESHOLD})")
+    parser.add_argument("--max-dimension", type=int, default=MAX_FRAME_DIMENSION, help="Downscale frames so the longer side is at most this many pixels (default: full resolution)")
+    parser.add_argument("--jpeg-quality", type=int, default=JPEG_QUALITY, help=f"JPEG quality 0-100 (default: {JPEG_QUALITY})")
+    parser.add_argument("--detail", choices=IMAGE_DETAILS, default=IMAGE_DETAIL, help=f"OpenAI image detail level (default: {IMAGE_DETAIL})")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help=f"Frames per OpenAI request (default: {BATCH_SIZE})")
+    parser.add_argument("--routing-model", default=ROUTING_MODEL, help=f"Cheaper model frames go to first; only unusable or suspicious answers are re-sent to {OPENAI_MODEL} (default: ROUTING_MODEL, unset = {OPENAI_MODEL} only)")
+    parser.add_argument("--structured-output", action="store_true", default=STRUCTURED_OUTPUT, help="Constrain answers to the prompt's JSON schema (default: STRUCTURED_OUTPUT)")
+    parser.add_argument("--reask-budget", type=int, default=REASK_BUDGET, help=f"With --structured-output, requests for re-asking frames that still failed after the main pass; 0 turns it off (default: {REASK_BUDGET})")
+    parser.add_argument("--cache", action="store_true", help="Reuse per-frame results from the on-disk frame cache")
+    parser.add_argument("--cache-dir", default=FRAME_CACHE_DIR, help=f"Frame cache directory (default: {FRAME_CACHE_DIR})")
+    parser.add_argument("--cache-max-mb", type=float, default=FRAME_CACHE_MAX_MB, help=f"Frame cache size limit in MB (default: {FRAME_CACHE_MAX_MB:g})")
+    parser.add_argument("--queue-size", type=int, default=STREAM_QUEUE_SIZE, help=f"Frames buffered between stages in streaming mode (default: {STREAM_QUEUE_SIZE})")
+    parser.add_argument("--resume", action="store_true", help="Checkpoint frame results, reusing those of an earlier, interrupted run of the same video and settings")
+    parser.add_argument("--checkpoint-dir", default=None, help=f"Checkpoint frame results as they arrive, in this directory (default: off; {CHECKPOINT_DIR} with --resume)")
+    parser.add_argument("--no-checkpoint", action="store_true", help="Do not checkpoint frame results, even with --checkpoint-dir")
+    parser.add_argument("--batch-api", action="store_true", help="Analyze offline through the OpenAI Batch API (half price, answers within 24h); run the same command again to resume")
+    parser.add_argument("--batch-dir", default=BATCH_DIR, help=f"Where batch runs keep their request and result files (default: {BATCH_DIR})")
+    parser.add_argument("--poll-interval", type=float, default=BATCH_POLL_INTERVAL, help=f"Seconds between batch status checks (default: {BATCH_POLL_INTERVAL:g})")
+    parser.add_argument("--no-wait", action="store_true", help="With --batch-api, submit or check the batches once instead of waiting for them to finish")
+    parser.add_argument("--trace", action="store_true", help=f"Write a trace of the run's stages and API calls to {tracing.TRACE_DIR} (Chrome trace format; without it, TRACE_SAMPLE_RATE applies)")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python sample.py <video_path> [prompt] [max_workers]")
-        print("Example: python sample.py video.mp4")
-        print("Example: python sample.py video.mov")
-        print("Example: python sample.py video.mp4 'What is the person doing in this frame?'")
-        print("Example: python sample.py video.mp4 'Describe the scene' 10")
-        print(f"\nSupported formats: {', '.join(SUPPORTED_FORMATS)}")
-        print(f"Default max_workers (parallel API calls): {MAX_WORKERS}")
-        sys.exit(1)
+    args = parse_args()
+    video_path = args.video_path
+    prompt = args.prompt
     
-    video_path = sys.argv[1]
-    prompt = sys.argv[2] if len(sys.argv) > 2 else PROMPT
+    if args.batch_api:
+        try:
+            process_videos_batch(
+                list_videos(video_path),
+                prompt,
+                sampler=args.sampler,
+                max_dimension=args.max_dimension,
+                jpeg_quality=args.jpeg_quality,
+                detail=args.detail,
+                structured_output=args.structured_output,
+                batch_dir=args.batch_dir,
+                poll_interval=args.poll_interval,
+                wait=not args.no_wait
+            )
+        except Exception as e:
+            print(f"\n[ERROR] {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
+        sys.exit(0)
     
     try:
         # Parse max_workers if provided
         max_workers = MAX_WORKERS
-        if len(sys.argv) > 3:
+        if args.max_workers is not None:
             try:
-                max_workers = int(sys.argv[3])
+                max_workers = int(args.max_workers)
                 print(f"[INFO] Using {max_workers} parallel workers (from command line)")
             except ValueError:
                 print(f"[WARNING] Invalid max_workers value, using default: {MAX_WORKERS}")
         
-        results = process_video(video_path, prompt, max_workers=max_workers)
+        with tracing.traced("process_video", sample_rate=1.0 if args.trace else None, video=video_path):
+            results = process_video(
+                video_path,
+                prompt,
+                max_workers=max_workers,
+                streaming=args.stream,
+                queue_size=args.queue_size,
+                sampler=args.sampler,
+                decode_workers=args.decode_workers,
+                decode_backend=args.decode_backend,
+                adaptive=args.adaptive,
+                change_threshold=args.change_threshold,
+                cache=FrameCache(args.cache_dir, args.cache_max_mb) if args.cache else None,
+                max_dimension=args.max_dimension,
+                jpeg_quality=args.jpeg_quality,
+                detail=args.detail,
+                batch_size=args.batch_size,
+                routing_model=args.routing_model,
+                structured_output=args.structured_output,
+                reask_budget=args.reask_budget,
+                max_concurrency=args.max_concurrency,
+                checkpoint_dir=None if args.no_checkpoint else args.checkpoint_dir,
+                resume=args.resume and not args.no_checkpoint
+            )
         
         print("\n" + "="*60)
         print("ANALYSIS SUMMARY")
@@ -454,6 +2188,8 @@ if __name__ == "__main__":
         for result in results:
             status = "✓" if result.get('success', False) else "✗"
             print(f"\n[{status}] Second {result['second']}:")
+            if result.get('inherited_from') is not None:
+                print(f"  (Scene unchanged, labels from second {result['inherited_from']})")
             if result.get('elapsed_time'):
                 print(f"  (API call took {result['elapsed_time']:.2f}s)")
             if result.get('tokens_used'):
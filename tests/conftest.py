@@ -0,0 +1,26 @@
+import os
+import socket
+import sys
+
+import pytest
+
+# The modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def free_port():
+    """A TCP port nothing listens on, for a mock server."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def make_video(tmp_path):
+    """Write a small synthetic video (see benchmark.make_synthetic_video); returns its path."""
+    from benchmark import make_synthetic_video
+
+    def make(name="video.mp4", seconds=20):
+        return make_synthetic_video(str(tmp_path / name), seconds=seconds, fps=10, width=320, height=240)
+    return make
@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import dust
+from dust import DustClient, DustError, DustTimeout
+from mock_servers import BackgroundServer, create_dust_app
+
+MESSAGE = {
+    "content": 'INPUT_JSON:\n{"data": [{"second": 0, "overall_action": "sport"}, {"second": 1, "overall_action": "work"}]}',
+    "mentions": [{"configurationId": "agent"}],
+}
+
+
+@pytest.fixture(autouse=True)
+def fast_polls(monkeypatch):
+    monkeypatch.setattr(dust, "DUST_POLL_INTERVAL", 0.05)
+
+
+def ask(server, mode, deadline, client_timeout=5.0):
+    async def run():
+        async with httpx.AsyncClient(timeout=client_timeout) as http:
+            return await DustClient(http, server.url, "key", "w").ask(MESSAGE, title="test", deadline=deadline, mode=mode)
+    return asyncio.run(run())
+
+
+def wait_for_stat(app, key, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not app.state.stats[key] and time.monotonic() < end:
+        time.sleep(0.01)
+    return app.state.stats[key]
+
+
+@pytest.mark.parametrize("mode", dust.DUST_MODES)
+def test_answer(mode, free_port):
+    app = create_dust_app(latency=0.05, token_delay=0)
+    with BackgroundServer(app, port=free_port) as server:
+        data = ask(server, mode, deadline=5)
+    message = dust.find_agent_message(data["conversation"])
+    assert message["status"] == "succeeded"
+    assert '"health_score"' in message["content"]
+    assert app.state.stats["event_streams" if mode == "stream" else "polls"] >= 1
+    assert app.state.stats["cancelled"] == 0
+
+
+@pytest.mark.parametrize("mode", dust.DUST_MODES)
+def test_deadline_cancels_agent_message(mode, free_port):
+    # The client's own read timeout is shorter than the deadline; the deadline must still decide
+    app = create_dust_app(latency=10)
+    with BackgroundServer(app, port=free_port) as server:
+        start = time.monotonic()
+        with pytest.raises(DustTimeout):
+            ask(server, mode, deadline=0.5, client_timeout=0.2)
+        assert time.monotonic() - start < 3
+        assert wait_for_stat(app, "cancelled") == 1
+
+
+def test_agent_error_is_not_a_timeout(free_port):
+    app = create_dust_app(latency=0.05, error="agent exploded")
+    with BackgroundServer(app, port=free_port) as server:
+        with pytest.raises(DustError, match="agent exploded") as excinfo:
+            ask(server, "stream", deadline=5)
+    assert not isinstance(excinfo.value, DustTimeout)
+
+
+class TimeoutTransport(httpx.AsyncHTTPTransport):
+    """Times out connecting for the agent message event streams."""
+
+    async def handle_async_request(self, request):
+        if request.url.path.endswith("/events"):
+            raise httpx.ConnectTimeout("connect timed out", request=request)
+        return await super().handle_async_request(request)
+
+
+def test_transport_timeout_is_not_the_deadline(free_port):
+    async def run(server):
+        async with httpx.AsyncClient(transport=TimeoutTransport()) as http:
+            return await DustClient(http, server.url, "key", "w").ask(MESSAGE, title="test", deadline=5, mode="stream")
+
+    app = create_dust_app(latency=10)
+    with BackgroundServer(app, port=free_port) as server:
+        with pytest.raises(DustError, match="Dust API timed out.*ConnectTimeout") as excinfo:
+            asyncio.run(run(server))
+        assert wait_for_stat(app, "cancelled") == 1
+    assert not isinstance(excinfo.value, DustTimeout)
+
+
+def test_analyze_answers_504_on_deadline(free_port, monkeypatch, tmp_path):
+    class ShortDeadline(DustClient):
+        async def ask(self, message, title, **kwargs):
+            return await super().ask(message, title, deadline=0.5, mode="stream")
+
+    async def analyze(video_path, options, cache_key):
+        return await api.send_to_dust({"data": [], "total_frames": 0})
+
+    app = create_dust_app(latency=10)
+    with BackgroundServer(app, port=free_port) as server:
+        monkeypatch.setattr(api, "DustClient", ShortDeadline)
+        monkeypatch.setattr(api, "analyze_and_summarize_cached", analyze)
+        monkeypatch.setattr(api, "DUST_API_BASE", server.url)
+        monkeypatch.setattr(api, "API_KEY", "key")
+        monkeypatch.setattr(api, "WORKSPACE_ID", "w")
+        monkeypatch.setattr(api, "HEALTH_AGENT_ID", "agent")
+        response = TestClient(api.app).post("/analyze", files={"file": ("video.mp4", b"not a video", "video/mp4")})
+        assert response.status_code == 504
+        assert wait_for_stat(app, "cancelled") == 1
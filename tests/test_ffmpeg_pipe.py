@@ -0,0 +1,41 @@
+import time
+
+import numpy as np
+import pytest
+
+import ffmpeg_pipe
+import sample
+
+pytestmark = pytest.mark.skipif(not ffmpeg_pipe.ffmpeg_available(), reason="ffmpeg is not installed")
+
+
+def raw_frames(video_path, **options):
+    info = sample.probe_video(video_path)
+    return ffmpeg_pipe.iter_raw_frames(video_path, info['width'], info['height'], info['video_fps'], max_dimension=160, **options)
+
+
+def test_ring_reuses_its_buffers(make_video):
+    video_path = make_video(seconds=8)
+    expected = [(second, frame) for second, frame in raw_frames(video_path)]
+    ring = [(second, frame, frame.copy()) for second, frame in raw_frames(video_path, buffers=3)]
+    assert len(ring) == len(expected) == 8
+    for (second, frame), (ring_second, _, copy) in zip(expected, ring):
+        assert second == ring_second
+        assert np.array_equal(frame, copy)
+    assert len({id(frame) for _, frame, _ in ring}) == 3
+    assert ring[0][1] is ring[3][1]
+
+
+def test_streamed_ffmpeg_frames_match_phased(make_video, monkeypatch):
+    video_path = make_video(seconds=12)
+    options = dict(decode_backend='ffmpeg', max_dimension=160, verbose=False)
+    phased, _, _, _ = sample._prepare_encoded_frames(video_path, **options)
+    encode = sample.encode_frame_to_base64
+
+    def slow_encode(*args):
+        time.sleep(0.02)  # Lets the decoder fill the queue, so a too small ring would overwrite queued frames
+        return encode(*args)
+
+    monkeypatch.setattr(sample, "encode_frame_to_base64", slow_encode)
+    streamed, _, _, _ = sample._prepare_encoded_frames(video_path, streaming=True, queue_size=1, **options)
+    assert list(streamed) == phased
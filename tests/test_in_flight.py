@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+import pytest
+
+import api
+
+FRAMES = 5
+
+
+@pytest.fixture
+def fake_analysis(monkeypatch):
+    """Replace the OpenAI and Dust steps with fakes that count their calls."""
+    calls = {'frames': 0, 'dust': 0, 'cancelled': 0}
+
+    async def analyze_frames(video_path, options, on_result=None):
+        calls['frames'] += 1
+        results = []
+        try:
+            for second in range(FRAMES):
+                await asyncio.sleep(0.05)
+                result = {'second': second, 'success': True, 'parsed_json': {'second': second, 'overall_action': "eating"}}
+                results.append(result)
+                if on_result:
+                    on_result(result)
+        except asyncio.CancelledError:
+            calls['cancelled'] += 1
+            raise
+        return results
+
+    async def summarize_with_dust(results, payload_format=None):
+        calls['dust'] += 1
+        return {'frames': len(results)}
+
+    monkeypatch.setattr(api, "analyze_frames", analyze_frames)
+    monkeypatch.setattr(api, "summarize_with_dust", summarize_with_dust)
+    monkeypatch.setattr(api, "VIDEO_CACHE", None)
+    return calls
+
+
+@pytest.fixture
+def upload(tmp_path):
+    """A new file standing in for an uploaded video (the analysis deletes it)."""
+    count = 0
+
+    def make():
+        nonlocal count
+        count += 1
+        path = tmp_path / f"upload-{count}.mp4"
+        path.write_bytes(b"not a video")
+        return str(path)
+    return make
+
+
+async def collect(stream):
+    return [json.loads(line) for line in [chunk async for chunk in stream]]
+
+
+def test_concurrent_streams_share_one_analysis(fake_analysis, upload):
+    async def run():
+        first = asyncio.ensure_future(collect(api.stream_analysis(upload(), {}, "ndjson", "key")))
+        await asyncio.sleep(0.12)  # The second request joins after a few frames
+        second = asyncio.ensure_future(collect(api.stream_analysis(upload(), {}, "ndjson", "key")))
+        return await asyncio.gather(first, second)
+
+    first, second = asyncio.run(run())
+    assert fake_analysis['frames'] == 1 and fake_analysis['dust'] == 1
+    for events in (first, second):
+        assert [event['data']['second'] for event in events if event['event'] == "frame"] == list(range(FRAMES))
+        assert events[-1] == {'event': "summary", 'data': {'frames': FRAMES}}
+    assert not api.IN_FLIGHT
+
+
+def test_stream_and_plain_request_share_one_analysis(fake_analysis, upload):
+    async def run():
+        stream = asyncio.ensure_future(collect(api.stream_analysis(upload(), {}, "ndjson", "key")))
+        await asyncio.sleep(0.05)
+        return await asyncio.gather(stream, api.analyze_and_summarize_cached(upload(), {}, "key"))
+
+    events, dust_response = asyncio.run(run())
+    assert fake_analysis['frames'] == 1
+    assert dust_response == events[-1]['data'] == {'frames': FRAMES}
+
+
+def test_disconnect_of_the_last_stream_cancels_the_analysis(fake_analysis, upload):
+    async def run():
+        stream = api.stream_analysis(upload(), {}, "ndjson", "key")
+        await stream.__anext__()  # start
+        await stream.__anext__()  # first frame
+        await stream.aclose()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert fake_analysis['cancelled'] == 1 and fake_analysis['dust'] == 0
+    assert not api.IN_FLIGHT
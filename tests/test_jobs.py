@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+import jobs
+from jobs import JobQueue, JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    yield store
+    store.close()
+
+
+def run_job(store, handler, tmp_path):
+    video_path = tmp_path / "upload.mp4"
+    video_path.write_bytes(b"not a video")
+    job = store.create(str(video_path), {})
+
+    async def run():
+        queue = JobQueue(store, handler, workers=1)
+        await queue.start()
+        queue.submit(job["id"])
+        await queue._queue.join()
+        await queue.stop()
+
+    asyncio.run(run())
+    return store.get(job["id"])
+
+
+def test_progress_is_saved_periodically(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_PROGRESS_INTERVAL", 0.05)
+    updates = []
+    update = store.update
+    monkeypatch.setattr(store, "update", lambda job_id, **fields: (updates.append(fields), update(job_id, **fields)))
+
+    async def handler(job, on_result):
+        for second in range(100):
+            on_result({'second': second, 'success': second % 10 != 0})
+            if second % 20 == 19:
+                await asyncio.sleep(0.1)
+        return {'answer': 42}
+
+    job = run_job(store, handler, tmp_path)
+    assert job["status"] == jobs.COMPLETED and job["result"] == {'answer': 42}
+    assert (job["frames_done"], job["frames_failed"]) == (100, 10)
+    progress_writes = [fields for fields in updates if set(fields) == {"frames_done", "frames_failed"}]
+    # A few writes while the job runs, not one per frame
+    assert 1 <= len(progress_writes) <= 10
+    assert not (tmp_path / "upload.mp4").exists()
+
+
+def test_failed_job_keeps_its_progress(store, tmp_path):
+    async def handler(job, on_result):
+        on_result({'second': 0, 'success': True})
+        raise RuntimeError("Dust is down")
+
+    job = run_job(store, handler, tmp_path)
+    assert job["status"] == jobs.FAILED and job["error"] == "Dust is down"
+    assert job["frames_done"] == 1
+
+
+def test_cancelled_job_is_requeued_with_its_upload(store, tmp_path):
+    video_path = tmp_path / "upload.mp4"
+    video_path.write_bytes(b"not a video")
+    job = store.create(str(video_path), {})
+    started = None
+
+    async def handler(job, on_result):
+        started.set()
+        await asyncio.sleep(60)
+
+    async def run():
+        nonlocal started
+        started = asyncio.Event()
+        queue = JobQueue(store, handler, workers=1)
+        await queue.start()
+        queue.submit(job["id"])
+        await started.wait()
+        await queue.stop()
+
+    asyncio.run(run())
+    assert store.get(job["id"])["status"] == jobs.QUEUED
+    assert video_path.exists()
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+
+import api
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_metrics_endpoint():
+    client = TestClient(api.app)
+    client.get("/")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'video_analysis_http_requests_total{method="GET",route="/",status="200"}' in response.text
+    assert "# TYPE video_analysis_frame_seconds histogram" in response.text
+    assert 'video_analysis_frame_seconds_bucket{le="600.0"}' in response.text
+
+
+def test_multiprocess_mode_sums_over_processes(tmp_path):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+    increment = "import metrics; metrics.FRAMES.labels('success').inc(3)"
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", increment], cwd=ROOT, env=env, check=True)
+    output = subprocess.run([sys.executable, "-c", "import sys, metrics; sys.stdout.write(metrics.render().decode())"],
+                            cwd=ROOT, env=env, check=True, capture_output=True, text=True).stdout
+    assert 'video_analysis_frames_total{status="success"} 6.0' in output
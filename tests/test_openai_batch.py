@@ -0,0 +1,147 @@
+import json
+import os
+
+import pytest
+from openai import OpenAI
+
+import clients
+import openai_batch
+import sample
+from mock_servers import BackgroundServer, create_openai_app
+from openai_batch import BatchRun
+
+SECONDS = 6
+
+
+@pytest.fixture
+def videos(make_video):
+    return [make_video("a.mp4", seconds=SECONDS), make_video("b.mp4", seconds=SECONDS)]
+
+
+@pytest.fixture
+def mock_openai(free_port, monkeypatch, tmp_path):
+    """
+    Start a mock OpenAI server with the given options (replacing the one started before, like a
+    service recovering from an outage) and point the shared sync client at it.
+    """
+    monkeypatch.chdir(tmp_path)
+    servers = []
+
+    def start(**options):
+        while servers:
+            servers.pop().__exit__(None, None, None)
+        app = create_openai_app(batch_latency=0.05, **options)
+        server = BackgroundServer(app, port=free_port).__enter__()
+        servers.append(server)
+        monkeypatch.setattr(clients, "_openai_client", OpenAI(api_key="test", base_url=f"{server.url}/v1", max_retries=0))
+        return app
+    yield start
+    while servers:
+        servers.pop().__exit__(None, None, None)
+
+
+def run_batch(videos, tmp_path):
+    return sample.process_videos_batch(videos, batch_dir=str(tmp_path / "batches"), poll_interval=0.05, verbose=False)
+
+
+def load_run(tmp_path) -> BatchRun:
+    (key,) = os.listdir(tmp_path / "batches")
+    run = BatchRun(key, str(tmp_path / "batches"))
+    assert run.load()
+    return run
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_batch_limits_match_the_api():
+    assert openai_batch.BATCH_MAX_REQUESTS == 50_000
+    assert openai_batch.BATCH_MAX_FILE_BYTES <= 200 * 1024 * 1024
+
+
+def test_requests_are_split_by_count_and_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(openai_batch, "BATCH_MAX_REQUESTS", 3)
+    monkeypatch.setattr(openai_batch, "BATCH_MAX_FILE_BYTES", 1000)
+    run = BatchRun("split", str(tmp_path))
+    requests = [(f"r{number}", {"model": "m", "padding": "x" * (50 if number < 6 else 300)}) for number in range(10)]
+    assert run.add_requests(requests) == 10
+
+    custom_ids = []
+    for shard in run.shards:
+        path = os.path.join(run.dir, shard["input"])
+        lines = read_jsonl(path)
+        assert len(lines) == shard["requests"] <= 3
+        assert os.path.getsize(path) == shard["bytes"] <= 1000
+        assert all(line["method"] == "POST" and line["url"] == openai_batch.BATCH_ENDPOINT for line in lines)
+        custom_ids += [line["custom_id"] for line in lines]
+    assert custom_ids == [custom_id for custom_id, _ in requests]
+    assert [shard["requests"] for shard in run.shards] == [3, 3, 2, 2]  # The last four are too big for three per file
+
+
+def test_results_are_saved_per_video(videos, mock_openai, tmp_path):
+    app = mock_openai()
+    results = run_batch(videos, tmp_path)
+
+    assert app.state.stats["batches"] == 1
+    for video in videos:
+        assert [result["second"] for result in results[video]] == list(range(SECONDS))
+        assert all(result["success"] for result in results[video])
+        with open(tmp_path / "output" / f"{os.path.splitext(os.path.basename(video))[0]}.json", encoding="utf-8") as f:
+            saved = json.load(f)
+        assert [frame["second"] for frame in saved] == list(range(SECONDS))
+        assert saved == [result["parsed_json"] for result in results[video]]
+    run = load_run(tmp_path)
+    assert run.manifest["done"]
+    assert not any(name.startswith("input-") for name in os.listdir(run.dir))  # Request files cleaned up
+
+
+def test_expired_batch_resumes_without_resubmitting_answers(videos, mock_openai, tmp_path):
+    mock_openai(batch_expire_fraction=0.5)
+    first = run_batch(videos, tmp_path)
+    answered = {f"{index}-{result['second']}" for index, video in enumerate(videos) for result in first[video] if result["success"]}
+    assert len(answered) == SECONDS  # Half of the 2 * SECONDS requests
+
+    app = mock_openai()
+    second = run_batch(videos, tmp_path)
+    run = load_run(tmp_path)
+    resubmitted = [line["custom_id"] for line in read_jsonl(os.path.join(run.dir, "output-1.jsonl"))]
+    assert app.state.stats["batch_requests"] == len(resubmitted) == SECONDS
+    assert not answered & set(resubmitted)
+    for video in videos:
+        assert all(result["success"] for result in second[video])
+        # Answers from the first round are kept, not replaced
+        for result in first[video]:
+            if result["success"]:
+                assert second[video][result["frame_index"]]["analysis"] == result["analysis"]
+
+
+def test_gives_up_after_max_attempts(videos, mock_openai, tmp_path):
+    app = mock_openai(batch_expire_fraction=0.0)
+    for _ in range(openai_batch.BATCH_MAX_ATTEMPTS + 1):
+        results = run_batch(videos, tmp_path)
+
+    assert app.state.stats["batches"] == openai_batch.BATCH_MAX_ATTEMPTS
+    assert app.state.stats["batch_requests"] == openai_batch.BATCH_MAX_ATTEMPTS * 2 * SECONDS
+    run = load_run(tmp_path)
+    assert set(run.manifest["attempts"].values()) == {openai_batch.BATCH_MAX_ATTEMPTS}
+    assert run.manifest["done"]
+    for video in videos:
+        assert not any(result["success"] for result in results[video])
+        assert all("batch_expired" in result["error"] for result in results[video])
+
+
+def test_outcome_mapping():
+    ok = {"custom_id": "0-3", "response": {"status_code": 200, "body": {
+        "id": "x", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": '{"second": 3, "overall_action": "sport", "sub_action": "", "description": "d"}'}}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15, "prompt_tokens_details": {"cached_tokens": 4}}}}}
+    result = sample._batch_api_result(ok, 3, 1)
+    assert result["success"] and result["parsed_json"]["overall_action"] == "sport"
+    assert (result["tokens_used"], result["cached_tokens"]) == (15, 4)
+
+    server_error = {"custom_id": "0-3", "response": {"status_code": 500, "body": {"error": {"message": "boom", "code": "server_error"}}}}
+    assert sample._batch_api_result(server_error, 3, 1)["error"] == "server_error: boom"
+    assert not openai_batch.is_answered(server_error)
+    assert not sample._batch_api_result(None, 3, 1)["success"]
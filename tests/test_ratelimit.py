@@ -0,0 +1,154 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+
+import api
+import clients
+import ratelimit
+import sample
+from mock_servers import BackgroundServer, create_openai_app
+from ratelimit import RateLimiter, create_completion_async
+
+
+@pytest.fixture
+def mock_openai(free_port, monkeypatch, tmp_path):
+    """A mock OpenAI server answering 429 above 3 concurrent requests, used by the shared async client."""
+    monkeypatch.chdir(tmp_path)  # Runs save their results to output/
+    app = create_openai_app(latency=0.1, jitter=0.0, max_concurrency=3)
+    with BackgroundServer(app, port=free_port) as server:
+        monkeypatch.setattr(clients, "_async_openai_client", AsyncOpenAI(api_key="test", base_url=f"{server.url}/v1", max_retries=0))
+        yield app
+
+
+def test_uploads_share_the_server_limiter(mock_openai, make_video, monkeypatch):
+    monkeypatch.setattr(api, "RATE_LIMITER", RateLimiter(3, 3))
+    videos = [make_video(f"{name}.mp4", seconds=6) for name in "abc"]
+    # Each upload alone may make 3 calls at a time; together they must stay within the shared 3
+    options = {'max_workers': 3, 'max_concurrency': 3}
+
+    async def run():
+        return await asyncio.gather(*(api.analyze_frames(video, dict(options)) for video in videos))
+
+    results = asyncio.run(run())
+    assert [len(frames) for frames in results] == [6, 6, 6]
+    assert all(frame['success'] for frames in results for frame in frames)
+    assert mock_openai.state.stats['429'] == 0
+    assert api.RATE_LIMITER.rate_limited == 0
+
+
+def test_request_concurrency_caps_its_share(mock_openai, make_video, monkeypatch):
+    monkeypatch.setattr(api, "RATE_LIMITER", RateLimiter(10, 10))
+    video = make_video(seconds=6)
+    # The server would allow 10 calls at once; the request asks for at most 3, which the mock accepts
+    results = asyncio.run(api.analyze_frames(video, {'max_workers': 1, 'max_concurrency': 3}))
+    assert len(results) == 6
+    assert mock_openai.state.stats['429'] == 0
+
+
+def test_null_max_workers_uses_the_default(mock_openai, make_video, monkeypatch):
+    monkeypatch.setattr(api, "RATE_LIMITER", RateLimiter(3, 3))
+    video = make_video(seconds=4)
+    options = dict(api.AnalysisOptions(max_workers=None, max_concurrency=3))
+    results = asyncio.run(api.analyze_frames(video, options))
+    assert len(results) == 4 and all(result['success'] for result in results)
+
+
+
+@pytest.fixture
+def openai_server(free_port, monkeypatch):
+    """Start a mock OpenAI server with the given options; returns (app, AsyncOpenAI client for it)."""
+    monkeypatch.setattr(ratelimit, "RETRY_BASE_DELAY", 0.01)
+    servers = []
+
+    def start(**options):
+        app = create_openai_app(jitter=0.0, **options)
+        server = BackgroundServer(app, port=free_port).__enter__()
+        servers.append(server)
+        return app, AsyncOpenAI(api_key="test", base_url=f"{server.url}/v1", max_retries=0)
+    yield start
+    for server in servers:
+        server.__exit__(None, None, None)
+
+
+def complete_all(client, limiter, seconds):
+    async def run():
+        requests = [sample._frame_request("Describe the frame.", "AAAA", second) for second in seconds]
+        return await asyncio.gather(*(create_completion_async(client, request, limiter) for request in requests))
+    return asyncio.run(run())
+
+
+def test_injected_429s_are_retried(openai_server):
+    app, client = openai_server(latency=0.01, error_rate=0.3)
+    limiter = RateLimiter(4, 8)
+    responses = complete_all(client, limiter, range(40))
+    assert len(responses) == 40
+    assert app.state.stats['200'] == 40
+    assert app.state.stats['429'] + app.state.stats['500'] > 0
+    assert limiter.retries == app.state.stats['429'] + app.state.stats['500']
+    assert limiter.rate_limited == app.state.stats['429']
+
+
+def test_concurrency_limit_shrinks_on_429s_and_grows_again(openai_server, monkeypatch):
+    app, client = openai_server(latency=0.05, max_concurrency=4)
+    limiter = RateLimiter(16, 16)
+    limits = []
+    release = limiter.release
+    monkeypatch.setattr(limiter, "release", lambda *args, **kwargs: (release(*args, **kwargs), limits.append(limiter.limit)))
+    responses = complete_all(client, limiter, range(60))
+    assert len(responses) == 60
+    assert app.state.stats['429'] > 0
+    lowest = min(limits)
+    assert lowest <= 8  # Halved at least once
+    assert max(limits[limits.index(lowest):]) > lowest  # And raised again by the successes that followed
+
+
+def test_retry_after_pauses_every_request():
+    limiter = RateLimiter(4, 4)
+
+    async def run():
+        started = await limiter.acquire_async(1)
+        limiter.release(started, httpx.Headers({'retry-after-ms': "300"}), rate_limited=True)
+        begin = time.monotonic()
+        await limiter.acquire_async(1)
+        return time.monotonic() - begin
+
+    assert 0.25 <= asyncio.run(run()) < 1
+
+
+def test_exhausted_request_budget_pauses_until_reset():
+    limiter = RateLimiter(4, 4)
+    headers = httpx.Headers({
+        'x-ratelimit-limit-requests': "100", 'x-ratelimit-remaining-requests': "0", 'x-ratelimit-reset-requests': "300ms",
+    })
+
+    async def run():
+        started = await limiter.acquire_async(1)
+        limiter.release(started, headers, success=True)
+        begin = time.monotonic()
+        await limiter.acquire_async(1)
+        return time.monotonic() - begin
+
+    assert 0.25 <= asyncio.run(run()) < 1
+    assert limiter.requests.capacity == 100
+
+
+def test_slot_waiters_are_woken_by_release(monkeypatch):
+    limiter = RateLimiter(1, 1)
+    attempts = []
+    try_acquire = limiter._try_acquire
+    monkeypatch.setattr(limiter, "_try_acquire", lambda tokens: (attempts.append(1), try_acquire(tokens))[1])
+
+    async def run():
+        started = await limiter.acquire_async(1)
+        waiter = asyncio.ensure_future(limiter.acquire_async(1))
+        await asyncio.sleep(0.3)
+        assert not waiter.done()
+        limiter.release(started, success=True)
+        await asyncio.wait_for(waiter, 0.1)
+
+    asyncio.run(run())
+    # One attempt for the first caller, then the waiter tries once, sleeps, and succeeds when woken
+    assert len(attempts) == 3
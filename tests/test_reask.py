@@ -0,0 +1,115 @@
+import asyncio
+import functools
+
+import httpx
+import openai
+import pytest
+from openai import AsyncOpenAI
+
+import clients
+import ratelimit
+import sample
+from metrics import REASKS
+from mock_servers import BackgroundServer, create_openai_app
+from ratelimit import is_transient
+from sample import PARSE_ERROR, ReaskPass
+
+
+def status_error(status, code=None):
+    response = httpx.Response(status, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    error_class = {401: openai.AuthenticationError, 429: openai.RateLimitError, 500: openai.InternalServerError}[status]
+    return error_class("error", response=response, body={'code': code} if code else None)
+
+
+def test_transient_errors():
+    assert is_transient(status_error(429))
+    assert is_transient(status_error(500))
+    assert is_transient(openai.APITimeoutError(httpx.Request("POST", "https://api.openai.com")))
+    assert not is_transient(status_error(429, "insufficient_quota"))
+    assert not is_transient(status_error(401))
+    assert not is_transient("No answer from the batch")
+
+
+@pytest.mark.parametrize("error, deferred", [
+    (status_error(500), True),
+    (status_error(401), False),
+    (ValueError("unexpected"), False),
+])
+def test_only_parse_failures_and_transient_errors_are_reasked(error, deferred):
+    reasks = ReaskPass(budget=10)
+    assert reasks.defer((0, 0), sample._frame_error_result(error, 0, 0, 0.1)) is deferred
+    assert reasks.defer((1, 1), {'success': False, 'error': PARSE_ERROR})
+    assert not reasks.defer((2, 2), {'success': True})
+
+
+@pytest.fixture
+def mock_openai(free_port, monkeypatch, tmp_path):
+    """A mock OpenAI server answering every unstructured request with broken JSON."""
+    monkeypatch.chdir(tmp_path)  # Runs save their results to output/
+    app = create_openai_app(latency=0.01, jitter=0.0, malformed_rate=1.0)
+    with BackgroundServer(app, port=free_port) as server:
+        monkeypatch.setattr(clients, "_async_openai_client", AsyncOpenAI(api_key="test", base_url=f"{server.url}/v1", max_retries=0))
+        yield app
+
+
+@pytest.mark.parametrize("structured_output", [False, True])
+def test_reask_pass_only_with_structured_outputs(mock_openai, make_video, structured_output):
+    video = make_video(seconds=4)
+    results = asyncio.run(sample.process_video_async(video, verbose=False, structured_output=structured_output, reask_budget=10))
+    assert len(results) == 4
+    if structured_output:
+        assert all(result['success'] for result in results)
+    else:
+        assert not any(result['success'] or result.get('reasked') for result in results)
+        assert mock_openai.state.stats['requests'] == 4
+        assert mock_openai.state.stats['structured'] == 0
+
+
+def reask_count(outcome):
+    return int(REASKS.labels(outcome)._value.get())
+
+
+@pytest.fixture
+def failing_openai(free_port, monkeypatch, tmp_path):
+    """A mock OpenAI server failing error_rate of the requests, with the limiter's retries turned off."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sample, "create_completion_async", functools.partial(ratelimit.create_completion_async, max_retries=0))
+
+    def start(error_rate):
+        app = create_openai_app(latency=0.01, jitter=0.0, error_rate=error_rate)
+        server = BackgroundServer(app, port=free_port).__enter__()
+        servers.append(server)
+        monkeypatch.setattr(clients, "_async_openai_client", AsyncOpenAI(api_key="test", base_url=f"{server.url}/v1", max_retries=0))
+        return app
+
+    servers = []
+    yield start
+    for server in servers:
+        server.__exit__(None, None, None)
+
+
+def test_reask_pass_keeps_to_its_budget(failing_openai, make_video, capsys):
+    app = failing_openai(error_rate=1.0)
+    failed, recovered = reask_count("failed"), reask_count("recovered")
+    video = make_video(seconds=6)
+    results = asyncio.run(sample.process_video_async(video, structured_output=True, reask_budget=4))
+    assert len(results) == 6
+    assert not any(result['success'] for result in results)
+    assert sum(1 for result in results if result.get('reasked')) == 4
+    assert app.state.stats['requests'] == 6 + 4
+    assert reask_count("failed") - failed == 4
+    assert reask_count("recovered") == recovered
+    assert "Re-asked frames: 4 requests, 0 recovered" in capsys.readouterr().out
+
+
+def test_reask_pass_recovers_transient_failures(failing_openai, make_video, capsys):
+    app = failing_openai(error_rate=0.5)
+    failed, recovered = reask_count("failed"), reask_count("recovered")
+    video = make_video(seconds=12)
+    results = asyncio.run(sample.process_video_async(video, structured_output=True, reask_budget=50))
+    reasked = [result for result in results if result.get('reasked')]
+    assert reasked and all(result['reasked'] <= sample.REASK_ATTEMPTS for result in reasked)
+    assert any(result['success'] for result in reasked)
+    reasks = (reask_count("failed") - failed) + (reask_count("recovered") - recovered)
+    assert reasks == app.state.stats['requests'] - 12
+    assert f"Re-asked frames: {reasks} requests, {reask_count('recovered') - recovered} recovered" in capsys.readouterr().out
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from openai import AsyncOpenAI
+
+import clients
+import sample
+from cache import FrameCache
+from checkpoint import RunCheckpoint, load_results
+from mock_servers import BackgroundServer, create_openai_app
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample.py")
+SECONDS = 30
+
+
+def run_cli(args, cwd, env, **kwargs):
+    return subprocess.Popen([sys.executable, SCRIPT] + args, cwd=cwd, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **kwargs)
+
+
+def test_killed_run_resumes_without_repeating_calls(tmp_path, free_port, make_video):
+    video_path = make_video(seconds=SECONDS)
+    checkpoint_dir = tmp_path / "checkpoints"
+    killed_dir, reference_dir = tmp_path / "killed", tmp_path / "reference"
+    killed_dir.mkdir()
+    reference_dir.mkdir()
+    app = create_openai_app(latency=0.1, jitter=0.02, max_concurrency=1000, rpm=1_000_000)
+    with BackgroundServer(app, port=free_port) as server:
+        env = dict(os.environ, OPENAI_BASE_URL=f"{server.url}/v1", OPENAI_API_KEY="test")
+        options = [video_path, "2", "--max-concurrency", "2", "--reask-budget", "0"]
+
+        reference = run_cli(options + ["--no-checkpoint"], reference_dir, env)
+        assert reference.wait(timeout=120) == 0
+        assert not checkpoint_dir.exists()
+        app.state.seconds.clear()
+
+        first = run_cli(options + ["--checkpoint-dir", str(checkpoint_dir)], killed_dir, env)
+        deadline = time.monotonic() + 60
+        while sum(app.state.seconds.values()) < 10 and first.poll() is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        first.send_signal(signal.SIGKILL)
+        first.wait()
+        time.sleep(0.3)  # Requests in flight at the kill still reach the mock
+        killed_calls = app.state.seconds.copy()
+        checkpointed = {}
+        for name in os.listdir(checkpoint_dir):
+            checkpointed.update(load_results(str(checkpoint_dir / name)))
+        assert 0 < len(checkpointed) < SECONDS
+
+        resumed = run_cli(options + ["--checkpoint-dir", str(checkpoint_dir), "--resume"], killed_dir, env)
+        assert resumed.wait(timeout=120) == 0
+        resumed_calls = app.state.seconds - killed_calls
+
+    # No checkpointed frame is asked again, and every other frame exactly once
+    assert not set(resumed_calls) & set(checkpointed)
+    assert sorted(resumed_calls) == sorted(set(range(SECONDS)) - set(checkpointed))
+    assert all(count == 1 for count in resumed_calls.values())
+    with open(reference_dir / "output" / "video.json", encoding="utf-8") as f:
+        expected = json.load(f)
+    with open(killed_dir / "output" / "video.json", encoding="utf-8") as f:
+        assert json.load(f) == expected
+    assert len(expected) == SECONDS
+    assert not os.listdir(checkpoint_dir)  # Removed once every frame succeeded
+
+
+def test_async_run_saves_checkpoint_and_cache(tmp_path, free_port, make_video, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # Runs save their results to output/
+    video_path = make_video(seconds=8)
+    checkpoint_dir = tmp_path / "checkpoints"
+    cache = FrameCache(str(tmp_path / "cache"))
+    app = create_openai_app(latency=0.02, jitter=0.0)
+    with BackgroundServer(app, port=free_port) as server:
+        monkeypatch.setattr(clients, "_async_openai_client", AsyncOpenAI(api_key="test", base_url=f"{server.url}/v1", max_retries=0))
+        monkeypatch.setattr(RunCheckpoint, "remove", RunCheckpoint.close)  # Keep the log of the finished run
+        results = asyncio.run(sample.process_video_async(video_path, verbose=False, cache=cache, checkpoint_dir=str(checkpoint_dir)))
+        # The writes happen on a writer thread; they are all done when the run returns
+        checkpointed = {}
+        for name in os.listdir(checkpoint_dir):
+            checkpointed.update(load_results(str(checkpoint_dir / name)))
+        assert sorted(checkpointed) == list(range(8))
+        assert cache.stats()['entries'] == 8
+
+        requests = app.state.stats['requests']
+        again = asyncio.run(sample.process_video_async(video_path, verbose=False, cache=cache))
+        assert app.state.stats['requests'] == requests
+    assert [result['parsed_json'] for result in again] == [result['parsed_json'] for result in results]
@@ -0,0 +1,43 @@
+import asyncio
+
+import api
+from api import compact_timeline
+
+
+def frame(second, action="eating", sub_action="", description=None):
+    return {'second': second, 'overall_action': action, 'sub_action': sub_action, 'description': description or f"frame {second}"}
+
+
+def test_merges_consecutive_seconds():
+    segments = compact_timeline([frame(2), frame(0), frame(1), frame(3, "walking")])
+    assert [(s['start'], s['end'], s['frames'], s['action']) for s in segments] == [(0, 2, 3, "eating"), (3, 3, 1, "walking")]
+
+
+def test_missing_seconds_start_a_new_segment():
+    segments = compact_timeline([frame(0), frame(1), frame(40)])
+    assert [(s['start'], s['end'], s['frames']) for s in segments] == [(0, 1, 2), (40, 40, 1)]
+    assert segments[1]['representative_descriptions'] == ["frame 40"]
+
+
+def test_sub_action_change_starts_a_new_segment():
+    segments = compact_timeline([frame(0, sub_action="a"), frame(1, sub_action="b")])
+    assert [(s['start'], s['sub_action']) for s in segments] == [(0, "a"), (1, "b")]
+
+
+def test_payload_format_is_a_request_option(monkeypatch):
+    sent = []
+
+    async def send_to_dust(payload, uncompacted_data=None):
+        sent.append(payload)
+        return {}
+
+    monkeypatch.setattr(api, "send_to_dust", send_to_dust)
+    results = [{'second': second, 'success': True, 'parsed_json': frame(second)} for second in range(3)]
+    asyncio.run(api.summarize_with_dust(results, payload_format="timeline"))
+    asyncio.run(api.summarize_with_dust(results, payload_format="frames"))
+    assert [payload.get('format') for payload in sent] == ["timeline", None]
+    assert len(sent[0]['timeline']) == 1 and len(sent[1]['data']) == 3
+
+    options = api.AnalysisOptions(dust_payload_format="timeline")
+    assert dict(options)['dust_payload_format'] == "timeline"
+    assert api.analysis_cache_key("hash", dict(options)) != api.analysis_cache_key("hash", dict(api.AnalysisOptions(dust_payload_format="frames")))
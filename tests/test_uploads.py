@@ -0,0 +1,149 @@
+import asyncio
+import base64
+import io
+import json
+import os
+import tracemalloc
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.datastructures import UploadFile
+
+import api
+import uploads
+from uploads import Base64StreamDecoder, InvalidUpload, UploadTooLarge
+
+
+async def _chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def save_body(body: bytes, path, chunk_size, max_bytes=1 << 30):
+    return asyncio.run(uploads.save_base64_json_body(_chunks(body, chunk_size), str(path), max_bytes))
+
+
+def test_decoder_splits_at_any_offset():
+    data = os.urandom(1000)
+    encoded = base64.b64encode(data)
+    for split in range(1, 12):
+        decoder = Base64StreamDecoder()
+        decoded = b"".join(decoder.decode(encoded[start:start + split]) for start in range(0, len(encoded), split))
+        decoder.finish()
+        assert decoded == data
+
+
+def test_decoder_ignores_whitespace_and_rejects_truncated_input():
+    data = os.urandom(300)
+    encoded = base64.b64encode(data)
+    decoder = Base64StreamDecoder()
+    assert decoder.decode(encoded[:100] + b"\n  " + encoded[100:]) == data
+    decoder = Base64StreamDecoder()
+    decoder.decode(encoded[:-1])
+    with pytest.raises(InvalidUpload):
+        decoder.finish()
+
+
+def test_base64_body_with_escaped_slashes_split_everywhere(tmp_path):
+    # Random bytes whose base64 contains plenty of "/", escaped as "\/" like some JSON encoders do
+    data = bytes(range(256)) * 8
+    encoded = base64.b64encode(data)
+    assert encoded.count(b"/") > 10
+    escaped = encoded.replace(b"/", b"\\/")
+    body = b'{"file_extension": ".mov", "video_base64": "' + escaped + b'", "max_workers": 3}'
+    path = tmp_path / "video.bin"
+    split_after_backslash = False
+    for chunk_size in range(1, 40):
+        split_after_backslash |= any(body[end - 1:end] == b"\\" for end in range(chunk_size, len(body), chunk_size))
+        fields = save_body(body, path, chunk_size)
+        assert path.read_bytes() == data, chunk_size
+        assert fields == {"file_extension": ".mov", "video_base64": "", "max_workers": 3}
+    assert split_after_backslash
+
+
+def test_base64_body_with_wrapped_lines(tmp_path):
+    data = os.urandom(3000)
+    encoded = base64.encodebytes(data).replace(b"\n", b"\\n")
+    body = b'{"video_base64": "' + encoded + b'"}'
+    path = tmp_path / "video.bin"
+    for chunk_size in (1, 7, 64, 4096):
+        save_body(body, path, chunk_size)
+        assert path.read_bytes() == data
+
+
+@pytest.mark.parametrize("body", [
+    b'{"video_base64": "QUJD!"}',
+    b'{"video_base64": "QUJDRA"}',
+    b'{"video_base64": "QUJD\\u0041"}',
+    b'{"video_base64": "QUJD',
+    b'["video_base64"]',
+])
+def test_invalid_base64_body(body, tmp_path):
+    with pytest.raises(InvalidUpload):
+        save_body(body, tmp_path / "video.bin", 3)
+
+
+def test_size_limits(tmp_path):
+    data = os.urandom(10_000)
+    with pytest.raises(UploadTooLarge):
+        save_body(b'{"video_base64": "' + base64.b64encode(data) + b'"}', tmp_path / "video.bin", 1000, max_bytes=9_999)
+    save_body(b'{"video_base64": "' + base64.b64encode(data) + b'"}', tmp_path / "video.bin", 1000, max_bytes=10_000)
+
+    for size in (len(data), None):  # Size announced by the client or not
+        upload = UploadFile(file=io.BytesIO(data), size=size, filename="video.mp4")
+        with pytest.raises(UploadTooLarge):
+            asyncio.run(uploads.save_upload_file(upload, str(tmp_path / "upload.bin"), max_bytes=9_999))
+
+
+def test_endpoints_answer_413_above_max_upload_mb(monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_MB", 0.01)
+    client = TestClient(api.app)
+    data = os.urandom(20_000)
+
+    response = client.post("/analyze", files={"file": ("video.mp4", data, "video/mp4")})
+    assert response.status_code == 413
+    response = client.post("/analyze/base64", content=json.dumps({"video_base64": base64.b64encode(data).decode()}))
+    assert response.status_code == 413
+    # Bodies that cannot fit are turned away by their Content-Length before being read
+    response = client.post("/analyze/base64", content=b"x" * (uploads.max_request_bytes(uploads.max_upload_bytes()) + 1))
+    assert response.status_code == 413
+
+
+def _peak_mb(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def test_peak_memory_does_not_grow_with_the_upload(tmp_path):
+    def receive(size_mb):
+        source = tmp_path / f"body_{size_mb}.json"
+        with open(source, "wb") as f:
+            f.write(b'{"video_base64": "')
+            for _ in range(size_mb // 3):
+                f.write(base64.b64encode(os.urandom(3 * 1024 * 1024)))
+            f.write(b'"}')
+
+        async def read_file():
+            with open(source, "rb") as f:
+                while chunk := f.read(64 * 1024):
+                    yield chunk
+
+        def base64_body():
+            asyncio.run(uploads.save_base64_json_body(read_file(), str(tmp_path / "out.bin"), 1 << 40))
+
+        def multipart():
+            with open(tmp_path / "out.bin", "rb") as f:
+                upload = UploadFile(file=f, size=None, filename="video.mp4")
+                asyncio.run(uploads.save_upload_file(upload, str(tmp_path / "copy.bin"), 1 << 40))
+
+        return _peak_mb(base64_body), _peak_mb(multipart)
+
+    small = receive(3)
+    large = receive(24)
+    for small_peak, large_peak in zip(small, large):
+        assert large_peak < 4
+        assert large_peak < small_peak + 1
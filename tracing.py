@@ -0,0 +1,222 @@
+import os
+import re
+import json
+import time
+import uuid
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+# Configuration
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))  # Fraction of requests traced (0 = off, 1 = every request)
+TRACE_DIR = os.getenv("TRACE_DIR", os.path.join(".cache", "traces"))  # One Chrome trace JSON file per traced request
+
+CORRELATION_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")  # Accepted client-supplied request IDs
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+def correlation_id(requested: Optional[str] = None) -> str:
+    """The client's request ID if it is a safe file name, else a new random one."""
+    if requested and CORRELATION_ID_PATTERN.match(requested):
+        return requested
+    return uuid.uuid4().hex
+
+class _NoopSpan:
+    """Stands in for a span when the current request is not traced, at the cost of a context variable lookup."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+    def start(self):
+        return self
+
+    def end(self):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class Span:
+    """
+    A timed operation of a trace, with args (e.g. second, tokens_used) shown in the trace viewer.
+    Used as a context manager it becomes the current span, the parent of spans opened inside it
+    (also in threads started through bind()).
+    """
+
+    def __init__(self, trace: "Trace", name: str, parent: Optional["Span"], args: Dict):
+        self.trace = trace
+        self.name = name
+        self.parent = parent
+        self.args = args
+        self.lane = None
+        self.start_ns = None
+        self._token = None
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def start(self) -> "Span":
+        self.trace._open(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def end(self):
+        if self.start_ns is not None:
+            self.trace._close(self, time.perf_counter_ns())
+            self.start_ns = None
+
+    def __enter__(self):
+        self.start()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.args.setdefault("error", f"{exc_type.__name__}: {exc}")
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Exited from another context (e.g. an async generator finished by another task)
+            _current_span.set(self.parent)
+        self.end()
+        return False
+
+class Trace:
+    """
+    The spans of one traced request, exported as a Chrome trace event file (opens in
+    ui.perfetto.dev or chrome://tracing). Concurrent spans are laid out on separate lanes (shown
+    as threads), since the viewers require the spans of one thread to nest.
+    """
+
+    def __init__(self, trace_id: str, name: str):
+        self.trace_id = trace_id
+        self.name = name
+        self.started_at = datetime.now(timezone.utc)
+        self._origin_ns = time.perf_counter_ns()
+        self._events: List[Dict] = []
+        self._lanes: List[List[Span]] = []  # Per lane, the stack of spans open on it
+        self._lock = threading.Lock()
+
+    def _open(self, span: Span):
+        with self._lock:
+            parent = span.parent
+            if parent is not None and parent.lane is not None and self._lanes[parent.lane][-1:] == [parent]:
+                span.lane = parent.lane
+            else:
+                span.lane = next((i for i, stack in enumerate(self._lanes) if not stack), len(self._lanes))
+                if span.lane == len(self._lanes):
+                    self._lanes.append([])
+            self._lanes[span.lane].append(span)
+
+    def _close(self, span: Span, end_ns: int):
+        event = {
+            "name": span.name,
+            "cat": "video_analysis",
+            "ph": "X",
+            "ts": (span.start_ns - self._origin_ns) / 1000,
+            "dur": (end_ns - span.start_ns) / 1000,
+            "pid": 1,
+            "tid": span.lane,
+            "args": dict(span.args, thread=threading.current_thread().name),
+        }
+        with self._lock:
+            stack = self._lanes[span.lane]
+            if span in stack:
+                stack.remove(span)
+            self._events.append(event)
+
+    def export(self, trace_dir: str = TRACE_DIR) -> str:
+        """Close the spans still open and write the trace to trace_dir/<trace_id>.json; returns its path."""
+        with self._lock:
+            still_open = [span for stack in self._lanes for span in stack]
+        for span in still_open:
+            span.set(unfinished=True)
+            span.end()
+        with self._lock:
+            events = list(self._events)
+            lanes = len(self._lanes)
+        metadata = [{"name": "process_name", "ph": "M", "pid": 1, "args": {"name": f"{self.name} ({self.trace_id})"}}]
+        metadata += [{"name": "thread_name", "ph": "M", "pid": 1, "tid": lane, "args": {"name": f"lane {lane}"}} for lane in range(lanes)]
+        document = {
+            "traceEvents": metadata + sorted(events, key=lambda event: event["ts"]),
+            "displayTimeUnit": "ms",
+            "otherData": {"trace_id": self.trace_id, "name": self.name, "started_at": self.started_at.isoformat()},
+        }
+        os.makedirs(trace_dir, exist_ok=True)
+        path = os.path.join(trace_dir, f"{self.trace_id}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(document, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return path
+
+def span(name: str, **args):
+    """
+    A child span of the current span, to be used as a context manager; a no-op outside a
+    sampled trace.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(parent.trace, name, parent, args)
+
+def bind(fn, queued: Optional[str] = None):
+    """
+    fn wrapped to run in a copy of the current context, so spans it opens in a worker thread
+    belong to the current trace. With queued, a span of that name covers the time from now until
+    the worker starts running it (e.g. waiting in a ThreadPoolExecutor queue).
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return fn
+    context = contextvars.copy_context()
+    waiting = Span(parent.trace, queued, parent, {}).start() if queued else None
+
+    def run(*args, **kwargs):
+        if waiting is not None:
+            waiting.end()
+        return context.run(fn, *args, **kwargs)
+    return run
+
+def start_trace(name: str, trace_id: Optional[str] = None, sample_rate: Optional[float] = None, **args) -> Optional[Span]:
+    """
+    Start a trace with probability sample_rate (TRACE_SAMPLE_RATE by default). Returns its root
+    span, now the current span, or None when the trace is not sampled. End it with finish_trace.
+    """
+    rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return None
+    root = Span(Trace(trace_id or correlation_id(), name), name, None, args)
+    return root.__enter__()
+
+def finish_trace(root: Optional[Span], error: Optional[BaseException] = None) -> Optional[str]:
+    """End a trace started by start_trace and write it out; returns the trace file path."""
+    if root is None:
+        return None
+    root.__exit__(type(error) if error is not None else None, error, None)
+    try:
+        path = root.trace.export()
+    except OSError as e:
+        print(f"[TRACE] WARNING: Could not write trace {root.trace.trace_id}: {e}")
+        return None
+    print(f"[TRACE] Wrote trace {root.trace.trace_id} to '{path}'")
+    return path
+
+@contextmanager
+def traced(name: str, trace_id: Optional[str] = None, sample_rate: Optional[float] = None, **args):
+    """start_trace / finish_trace around a with block; yields the root span, or None if not sampled."""
+    root = start_trace(name, trace_id, sample_rate, **args)
+    try:
+        yield root
+    except BaseException as e:
+        finish_trace(root, e)
+        raise
+    finish_trace(root)
@@ -0,0 +1,136 @@
+import os
+import asyncio
+import re
+import json
+import base64
+import binascii
+from typing import AsyncIterator, Dict
+
+# Configuration
+MAX_UPLOAD_MB = float(os.getenv("MAX_UPLOAD_MB", "2048"))  # Largest video accepted, after base64 decoding
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes read and written at a time
+MAX_JSON_FIELDS_BYTES = 64 * 1024  # Size limit of a JSON body apart from the base64 video
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the configured maximum size."""
+
+class InvalidUpload(ValueError):
+    """Raised when an upload body is malformed (bad base64, bad JSON)."""
+
+def max_upload_bytes() -> int:
+    return int(MAX_UPLOAD_MB * 1024 * 1024)
+
+def max_request_bytes(max_bytes: int) -> int:
+    """Largest request body that can carry a video of max_bytes (base64 adds a third, plus the other fields)."""
+    return max_bytes * 4 // 3 + MAX_JSON_FIELDS_BYTES + UPLOAD_CHUNK_SIZE
+
+def _too_large(max_bytes: int) -> UploadTooLarge:
+    return UploadTooLarge(f"Upload exceeds the maximum size of {max_bytes / (1024 * 1024):g} MB")
+
+async def save_upload_file(upload, path: str, max_bytes: int, digest=None) -> int:
+    """
+    Copy a multipart UploadFile to path in UPLOAD_CHUNK_SIZE chunks, so it is never held in
+    memory as a whole. The writes run in a worker thread so a slow disk does not block the event
+    loop. Returns the number of bytes written. A hashlib object passed as digest
+    is updated with the file's content as it is written.
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise _too_large(max_bytes)
+    written = 0
+    with open(path, "wb") as f:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > max_bytes:
+                raise _too_large(max_bytes)
+            await asyncio.to_thread(f.write, chunk)
+            if digest is not None:
+                digest.update(chunk)
+    return written
+
+class Base64StreamDecoder:
+    """
+    Decode base64 that arrives in pieces of any length. Whitespace is ignored; input is decoded
+    in whole 4-character groups and the remainder is kept for the next piece.
+    """
+
+    def __init__(self):
+        self._pending = b""
+
+    def decode(self, data: bytes) -> bytes:
+        data = self._pending + re.sub(rb"\s+", b"", data)
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        try:
+            return base64.b64decode(data[:usable], validate=True)
+        except binascii.Error as e:
+            raise InvalidUpload(f"Invalid base64 encoding: {e}")
+
+    def finish(self):
+        if self._pending:
+            raise InvalidUpload("Invalid base64 encoding: Incorrect padding")
+
+async def save_base64_json_body(chunks: AsyncIterator[bytes], path: str, max_bytes: int, field: str = "video_base64", digest=None) -> Dict:
+    """
+    Read a JSON object body from chunks (e.g. Request.stream()), decoding the base64 string in
+    field straight to path (from a worker thread) as it arrives. Only the other fields are kept in memory; they are
+    returned as a dict, with field set to "". A hashlib object passed as digest is updated with
+    the decoded bytes.
+    """
+    key = re.compile(rb'"' + re.escape(field.encode()) + rb'"\s*:\s*"')
+    fields = bytearray()  # The body with the base64 string left out
+    decoder = Base64StreamDecoder()
+    state = "before"  # before -> inside (the base64 string) -> after
+    escape = b""  # A trailing backslash carried over to the next chunk
+    written = 0
+
+    with open(path, "wb") as f:
+        async for chunk in chunks:
+            while chunk:
+                if state == "inside":
+                    end = chunk.find(b'"')
+                    data = escape + (chunk if end < 0 else chunk[:end])
+                    chunk = b"" if end < 0 else chunk[end + 1:]
+                    escape = b""
+                    if end < 0 and data.endswith(b"\\"):
+                        data, escape = data[:-1], b"\\"
+                    if b"\\" in data:
+                        # JSON encoders may escape "/" or wrap long strings with "\n"
+                        data = data.replace(b"\\/", b"/").replace(b"\\n", b"").replace(b"\\r", b"")
+                        if b"\\" in data:
+                            raise InvalidUpload("Invalid base64 encoding: unexpected escape sequence")
+                    decoded = decoder.decode(data)
+                    written += len(decoded)
+                    if written > max_bytes:
+                        raise _too_large(max_bytes)
+                    await asyncio.to_thread(f.write, decoded)
+                    if digest is not None:
+                        digest.update(decoded)
+                    if end >= 0:
+                        decoder.finish()
+                        fields += b'""'
+                        state = "after"
+                    continue
+
+                fields += chunk
+                chunk = b""
+                if state == "before":
+                    match = key.search(fields)
+                    if match:
+                        chunk = bytes(fields[match.end():])
+                        del fields[match.end() - 1:]
+                        state = "inside"
+                if len(fields) > MAX_JSON_FIELDS_BYTES:
+                    raise InvalidUpload(f"JSON body without {field} exceeds {MAX_JSON_FIELDS_BYTES // 1024} KB")
+
+    if state == "inside":
+        raise InvalidUpload("Invalid JSON body: unterminated string")
+    try:
+        body = json.loads(bytes(fields))
+    except ValueError as e:
+        raise InvalidUpload(f"Invalid JSON body: {e}")
+    if not isinstance(body, dict):
+        raise InvalidUpload("Invalid JSON body: expected an object")
+    return body